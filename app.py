@@ -1,16 +1,27 @@
 import streamlit as st
 import pandas as pd
-import PyPDF2
 from io import StringIO, BytesIO
-from fpdf import FPDF
 
+# Only what the first page needs is imported up front; the GenAI client, the PDF parser and
+# writer, and the non-default engines are loaded on first use (and then stay in sys.modules,
+# so reruns do not pay for them again)
 from llm_pipeline import LLMPipeline
 from executor import PandasExecutor
 from utils import extract_text_from_file
+from dataset_registry import get_registry
+from orchestrator import PipelineOrchestrator
+import instrumentation
+
+
+@st.cache_resource
+def get_pipeline():
+    """One LLMPipeline (and response cache / mapping store) per server process, shared by all sessions."""
+    return LLMPipeline()
+
 
 # --- State Management ---
 if "pipeline" not in st.session_state:
-    st.session_state.pipeline = LLMPipeline()
+    st.session_state.pipeline = get_pipeline()
 
 if "agent_1_rules" not in st.session_state:
     st.session_state.agent_1_rules = []
@@ -24,6 +35,18 @@ if "final_report" not in st.session_state:
 if "raw_df" not in st.session_state:
     st.session_state.raw_df = None
 
+if "column_roles" not in st.session_state:
+    st.session_state.column_roles = None
+
+if "dataset" not in st.session_state:
+    st.session_state.dataset = None
+
+if "account_rule_index" not in st.session_state:
+    st.session_state.account_rule_index = None
+
+if "trace" not in st.session_state:
+    st.session_state.trace = None
+
 # --- UI Setup ---
 st.set_page_config(page_title="AI Data Policy Agent", layout="wide")
 st.title("🛡️ Data Policy Compliance Agent")
@@ -50,6 +73,45 @@ class StreamlitConsoleRedirect:
 
 import os
 
+def convert_md_to_pdf(md_text):
+    """Convert markdown report to PDF using fpdf2 (pure Python, no native deps)."""
+    from fpdf import FPDF
+
+    pdf = FPDF()
+    # Every multi_cell returns to the left margin on the next line (fpdf2 otherwise stays at the right edge)
+    pdf.set_auto_page_break(auto=True, margin=15)
+    pdf.add_page()
+    pdf.set_font('Helvetica', size=10)
+    
+    for line in md_text.split('\n'):
+        stripped = line.strip()
+        # Handle headers
+        if stripped.startswith('### '):
+            pdf.set_font('Helvetica', 'B', 12)
+            pdf.multi_cell(0, 7, stripped[4:], new_x="LMARGIN", new_y="NEXT")
+            pdf.set_font('Helvetica', size=10)
+        elif stripped.startswith('## '):
+            pdf.set_font('Helvetica', 'B', 14)
+            pdf.multi_cell(0, 8, stripped[3:], new_x="LMARGIN", new_y="NEXT")
+            pdf.set_font('Helvetica', size=10)
+        elif stripped.startswith('# '):
+            pdf.set_font('Helvetica', 'B', 16)
+            pdf.multi_cell(0, 10, stripped[2:], new_x="LMARGIN", new_y="NEXT")
+            pdf.set_font('Helvetica', size=10)
+        elif stripped.startswith('|'):
+            # Table rows — render as fixed-width text
+            pdf.set_font('Courier', size=8)
+            pdf.multi_cell(0, 5, stripped, new_x="LMARGIN", new_y="NEXT")
+            pdf.set_font('Helvetica', size=10)
+        elif stripped.startswith('```'):
+            continue  # Skip code fences
+        elif stripped == '':
+            pdf.ln(3)
+        else:
+            pdf.multi_cell(0, 6, stripped, new_x="LMARGIN", new_y="NEXT")
+    
+    return pdf.output()
+
 # --- Sidebar ---
 st.sidebar.header("1. Upload Policy")
 uploaded_policy = st.sidebar.file_uploader("Upload Policy (PDF/TXT)", type=["pdf", "txt"])
@@ -62,28 +124,82 @@ if available_csvs:
     selected_csv = st.sidebar.selectbox("Select Repository Dataset", available_csvs)
     csv_path = os.path.join(data_dir, selected_csv)
     
-    # Only read if it changed or not loaded yet
-    if st.session_state.raw_df is None or "last_csv" not in st.session_state or st.session_state.last_csv != selected_csv:
+    # Only acquire if it changed on disk, was switched, or is not loaded yet
+    dataset = st.session_state.dataset
+    if dataset is None or st.session_state.get("last_csv") != selected_csv or dataset.stale:
         try:
-            st.session_state.raw_df = pd.read_csv(csv_path)
+            # One typed frame per file version, shared read-only by every session in this process
+            st.session_state.dataset = get_registry().acquire(csv_path)
+            st.session_state.raw_df = st.session_state.dataset.df
+            st.session_state.column_roles = st.session_state.dataset.column_roles
             st.session_state.last_csv = selected_csv
+            if dataset is not None:
+                dataset.release()
         except Exception as e:
             st.sidebar.error(f"Failed to load CSV: {e}")
 
     if st.session_state.raw_df is not None:
         st.sidebar.success(f"Loaded: `{selected_csv}` ({len(st.session_state.raw_df)} rows)")
+        registry_stats = get_registry().stats()
+        st.sidebar.caption(
+            f"Shared datasets: {registry_stats['datasets']} in memory ({registry_stats['bytes'] / 2**20:,.0f} MB of "
+            f"{registry_stats['max_bytes'] / 2**20:,.0f} MB), {registry_stats['in_use']} in use"
+        )
 else:
     st.sidebar.error("No CSV files found in the `data/` repository directory.")
 
+cache_stats = st.session_state.pipeline.cache.stats()
+if cache_stats["hits"] or cache_stats["misses"]:
+    st.sidebar.caption(
+        f"LLM cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses "
+        f"(~{cache_stats['saved_seconds']}s of Gemini time saved)"
+    )
+
+st.sidebar.header("2. Execution Engine")
+execution_engine = st.sidebar.radio(
+    "Run mapped rules with",
+    ["Pandas (pandas_query)", "Pandas parallel (multi-core)", "DuckDB (sql_query)", "Pandas chunked (out-of-core)",
+     "Pandas incremental (append-only)"],
+    help="DuckDB executes Agent 2's SQL with a vectorized, multi-threaded engine. "
+         "Chunked mode streams the file in row chunks with bounded memory (distinct accounts are approximate). "
+         "Incremental mode only evaluates rows appended since the last run and merges them into stored metrics. "
+         "Parallel mode evaluates pandas_query rules over row shards on every CPU core, with identical metrics."
+)
+pipelined_mode = st.sidebar.checkbox(
+    "Pipelined execution",
+    help="Map and execute each rule while Agent 1 is still extracting, instead of running the agents back to back."
+)
+
 if uploaded_policy and st.session_state.raw_df is not None:
     if st.sidebar.button("Run Full Agent Pipeline", type="primary"):
         # Reset state on run
         st.session_state.agent_1_rules = []
         st.session_state.agent_2_mapped_rules = []
         st.session_state.final_report = ""
+        st.session_state.account_rule_index = None
+        st.session_state.report_pdf = None
+        # Every stage below reports timings, memory and LLM stats into this run's trace
+        tracer = instrumentation.start_trace("pipeline_run")
         
-        policy_text = extract_text_from_file(uploaded_policy)
-        executor = PandasExecutor(st.session_state.raw_df)
+        with instrumentation.span("policy_extraction"):
+            policy_text = extract_text_from_file(uploaded_policy)
+        with instrumentation.span("executor_init", engine=execution_engine):
+            if execution_engine.startswith("DuckDB"):
+                from duckdb_executor import DuckDBExecutor
+                executor = DuckDBExecutor(st.session_state.dataset.copy())
+            elif execution_engine.startswith("Pandas chunked"):
+                from chunked_executor import ChunkedExecutor
+                executor = ChunkedExecutor(csv_path)
+            elif execution_engine.startswith("Pandas incremental"):
+                from incremental import IncrementalExecutor
+                executor = IncrementalExecutor(csv_path)
+            elif execution_engine.startswith("Pandas parallel"):
+                from parallel import ParallelExecutor
+                executor = ParallelExecutor(st.session_state.dataset.copy(), st.session_state.column_roles, compact=False)
+            else:
+                # The registry frame is already parsed and compacted, so only the column roles are applied;
+                # a copy-on-write view keeps any remaining dtype fix private to this run
+                executor = PandasExecutor(st.session_state.dataset.copy(), st.session_state.column_roles, compact=False)
         schema_info = executor.get_schema_summary()
 
         # --- Live Backend Logging Window ---
@@ -91,65 +207,107 @@ if uploaded_policy and st.session_state.raw_df is not None:
         log_container = st.empty()
         # Override output removed (no more websocket flooding!)
         
+        raw_metrics_json = None
         try:
-            # [AGENT 1 EXECUTION]
-            with st.status("🕵️‍♂️ Agent 1: Extracting Rules & Generating Queries...", expanded=True) as status1:
-                try:
-                    def agent1_streamer():
-                        for chunk in st.session_state.pipeline.agent_1_extract_generic_rules(policy_text):
-                            if isinstance(chunk, tuple):
-                                st.session_state.agent1_result = chunk
-                            else:
-                                yield chunk
+            if pipelined_mode:
+                # [AGENTS 1-3 OVERLAPPED]
+                with st.status("⚡ Pipelined: Extracting, Mapping & Executing Rules Concurrently...", expanded=True) as status0, \
+                        instrumentation.span("pipelined_agents"):
+                    try:
+                        orchestrator = PipelineOrchestrator(st.session_state.pipeline, executor)
+                        live_json = st.empty()
+                        progress = st.empty()
+                        tail = ""
+                        counts = {"EXTRACTED": 0, "MAPPED": 0, "EXECUTED": 0}
+                        for event, payload in orchestrator.run(policy_text, schema_info['columns'], schema_info['sample_csv']):
+                            if event == "TEXT":
+                                # Keep last 3000 chars to prevent UI lag on massive JSONs
+                                tail = (tail + payload)[-3000:]
+                                live_json.markdown(f"```json\n{tail}\n```")
+                            elif event in counts:
+                                counts[event] += 1
+                                progress.write(f"Extracted {counts['EXTRACTED']} · Mapped {counts['MAPPED']} · Executed {counts['EXECUTED']}")
+                            elif event == "ERROR":
+                                st.error(payload)
+                            elif event == "DONE":
+                                st.session_state.agent_1_rules = payload["agent_1_rules"]
+                                st.session_state.agent_2_mapped_rules = payload["mapped_rules"]
+                                raw_metrics_json = payload["metrics_json"]
+
+                        if raw_metrics_json is None:
+                            st.stop()
+                        status0.update(state="complete")
+                    except Exception as e:
+                        status0.update(label=f"Pipeline Error: {e}", state="error")
+                        st.stop()
+            else:
+                # [AGENT 1 EXECUTION]
+                with st.status("🕵️‍♂️ Agent 1: Extracting Rules & Generating Queries...", expanded=True) as status1, \
+                        instrumentation.span("agent_1"):
+                    try:
+                        def agent1_streamer():
+                            for chunk in st.session_state.pipeline.agent_1_extract_generic_rules(policy_text):
+                                if isinstance(chunk, tuple):
+                                    # ("RULE", rule) events arrive mid-stream; keep only the final result
+                                    if chunk[0] != "RULE":
+                                        st.session_state.agent1_result = chunk
+                                else:
+                                    yield chunk
                                 
-                    with st.expander("Live JSON Parsing", expanded=True):
-                        st.write_stream(agent1_streamer())
+                        with st.expander("Live JSON Parsing", expanded=True):
+                            st.write_stream(agent1_streamer())
                         
-                    status, payload = st.session_state.agent1_result
+                        status, payload = st.session_state.agent1_result
                     
-                    if status == "ERROR":
-                        st.error(payload)
-                        st.stop()
+                        if status == "ERROR":
+                            st.error(payload)
+                            st.stop()
                         
-                    st.session_state.agent_1_rules = payload
-                    st.write(f"✅ Extracted {len(st.session_state.agent_1_rules)} rules.")
-                    status1.update(state="complete")
-                except Exception as e:
-                    status1.update(label=f"Agent 1 Error: {e}", state="error")
-                    st.stop()
+                        st.session_state.agent_1_rules = payload
+                        st.write(f"✅ Extracted {len(st.session_state.agent_1_rules)} rules.")
+                        status1.update(state="complete")
+                    except Exception as e:
+                        status1.update(label=f"Agent 1 Error: {e}", state="error")
+                        st.stop()
 
-            # [AGENT 2 EXECUTION - SINGLE BATCHED CALL]
-            with st.status("🗺️ Agent 2: Mapping Schema & Values...", expanded=True) as status2:
-                try:
-                     result = st.session_state.pipeline.agent_2_map_all_rules(
-                         st.session_state.agent_1_rules,
-                         schema_info['columns'],
-                         schema_info['sample_csv']
-                     )
+                # [AGENT 2 EXECUTION - SINGLE BATCHED CALL]
+                with st.status("🗺️ Agent 2: Mapping Schema & Values...", expanded=True) as status2:
+                    try:
+                         result = st.session_state.pipeline.agent_2_map_all_rules(
+                             st.session_state.agent_1_rules,
+                             schema_info['columns'],
+                             schema_info['sample_csv']
+                         )
                      
-                     if result[0] == "ERROR":
-                         st.error(result[1])
-                         st.stop()
+                         if result[0] == "ERROR":
+                             st.error(result[1])
+                             st.stop()
                      
-                     st.session_state.agent_2_mapped_rules = [r.model_dump() for r in result[1].mapped_rules]
+                         st.session_state.agent_2_mapped_rules = [r.model_dump() for r in result[1].mapped_rules]
                      
-                     for mapped in st.session_state.agent_2_mapped_rules:
-                         if mapped['status'] == 'SKIPPED':
-                             st.warning(f"⚠️ Skipped '{mapped['title']}': {mapped.get('skip_reason', 'Missing columns.')}")
-                         else:
-                             st.success(f"✅ Mapped '{mapped['title']}' columns: {mapped['columns_remapped']}")
+                         for mapped in st.session_state.agent_2_mapped_rules:
+                             if mapped['status'] == 'SKIPPED':
+                                 st.warning(f"⚠️ Skipped '{mapped['title']}': {mapped.get('skip_reason', 'Missing columns.')}")
+                             else:
+                                 st.success(f"✅ Mapped '{mapped['title']}' columns: {mapped['columns_remapped']}")
                      
-                     status2.update(state="complete")
-                except Exception as e:
-                    status2.update(label=f"Agent 2 Error: {e}", state="error")
-                    st.stop()
+                         status2.update(state="complete")
+                    except Exception as e:
+                        status2.update(label=f"Agent 2 Error: {e}", state="error")
+                        st.stop()
                     
             # [AGENT 3 EXECUTION]
             with st.status("⚙️ Agent 3: Executing Mapped Queries & Generating Report...", expanded=True) as status3:
                 try:
-                    # Run the scripts locally to get raw metrics
-                    st.write("Executing Pandas queries against DataFrame...")
-                    raw_metrics_json = executor.run_all_rules_and_collect_metrics(st.session_state.agent_2_mapped_rules)
+                    # Run the scripts locally to get raw metrics (already done per rule in pipelined mode)
+                    if raw_metrics_json is None:
+                        st.write(f"Executing mapped queries with {execution_engine}...")
+                        with instrumentation.span("execute_rules", engine=execution_engine):
+                            raw_metrics_json = executor.run_all_rules_and_collect_metrics(st.session_state.agent_2_mapped_rules)
+
+                    # Keep each rule's violating accounts for cross-rule questions without re-running
+                    if isinstance(executor, PandasExecutor) and executor.account_col and executor.rule_bitmaps:
+                        st.session_state.account_rule_index = executor.account_rule_index()
                     
                     # Pass to LLM to generate Markdown Report live
                     st.write("Generating Executive Report live...")
@@ -159,10 +317,16 @@ if uploaded_policy and st.session_state.raw_df is not None:
                             print(chunk, end="", flush=True)
                             yield chunk
                             
-                    with st.expander("Viewing Agent 3 Brain (Live Report Generation)"):
+                    with st.expander("Viewing Agent 3 Brain (Live Report Generation)"), instrumentation.span("agent_3_report"):
                         generated_report = st.write_stream(report_generator())
                         
                     st.session_state.final_report = generated_report.strip()
+                    # Rendered once per report rather than on every rerun of the page
+                    with instrumentation.span("pdf_export", chars=len(st.session_state.final_report)):
+                        try:
+                            st.session_state.report_pdf = convert_md_to_pdf(st.session_state.final_report)
+                        except Exception as e:
+                            st.session_state.report_pdf = e
                     status3.update(state="complete")
                 except Exception as e:
                     status3.update(label=f"Agent 3 Error: {e}", state="error")
@@ -171,47 +335,15 @@ if uploaded_policy and st.session_state.raw_df is not None:
         finally:
             # Always restore standard terminal behavior to avoid breaking Streamlit server
             sys.stdout = sys.__stdout__
-
-def convert_md_to_pdf(md_text):
-    """Convert markdown report to PDF using fpdf2 (pure Python, no native deps)."""
-    pdf = FPDF()
-    pdf.set_auto_page_break(auto=True, margin=15)
-    pdf.add_page()
-    pdf.set_font('Helvetica', size=10)
-    
-    for line in md_text.split('\n'):
-        stripped = line.strip()
-        # Handle headers
-        if stripped.startswith('### '):
-            pdf.set_font('Helvetica', 'B', 12)
-            pdf.multi_cell(0, 7, stripped[4:])
-            pdf.set_font('Helvetica', size=10)
-        elif stripped.startswith('## '):
-            pdf.set_font('Helvetica', 'B', 14)
-            pdf.multi_cell(0, 8, stripped[3:])
-            pdf.set_font('Helvetica', size=10)
-        elif stripped.startswith('# '):
-            pdf.set_font('Helvetica', 'B', 16)
-            pdf.multi_cell(0, 10, stripped[2:])
-            pdf.set_font('Helvetica', size=10)
-        elif stripped.startswith('|'):
-            # Table rows — render as fixed-width text
-            pdf.set_font('Courier', size=8)
-            pdf.multi_cell(0, 5, stripped)
-            pdf.set_font('Helvetica', size=10)
-        elif stripped.startswith('```'):
-            continue  # Skip code fences
-        elif stripped == '':
-            pdf.ln(3)
-        else:
-            pdf.multi_cell(0, 6, stripped)
-    
-    return pdf.output()
+            instrumentation.stop_trace()
+            st.session_state.trace = tracer
+            st.session_state.trace_paths = tracer.export()
 
 # --- Main View ---
 
 if st.session_state.final_report:
-    tab1, tab2, tab3 = st.tabs(["📑 Executive Report (Agent 3)", "🗺️ Schema Mapping (Agent 2)", "🗄️ Raw Data"])
+    tab1, tab2, tab3, tab4, tab5 = st.tabs(["📑 Executive Report (Agent 3)", "🗺️ Schema Mapping (Agent 2)", "🗄️ Raw Data",
+                                            "🔗 Cross-Rule Offenders", "⏱️ Timing"])
         
     with tab1:
         st.write("### AI Generated Executive Report")
@@ -230,7 +362,11 @@ if st.session_state.final_report:
             )
         with col2:
             try:
-                pdf_bytes = convert_md_to_pdf(st.session_state.final_report)
+                pdf_bytes = st.session_state.get("report_pdf")
+                if pdf_bytes is None:
+                    pdf_bytes = st.session_state.report_pdf = convert_md_to_pdf(st.session_state.final_report)
+                if isinstance(pdf_bytes, Exception):
+                    raise pdf_bytes
                 st.download_button(
                     label="📥 Download Report (PDF)",
                     data=pdf_bytes,
@@ -253,5 +389,46 @@ if st.session_state.final_report:
                 
     with tab3:
         st.dataframe(st.session_state.raw_df.head(100))
+
+    with tab4:
+        index = st.session_state.account_rule_index
+        if index is None:
+            st.info("Cross-rule offenders are available with the Pandas engine.")
+        else:
+            min_rules = st.slider("Minimum rules tripped", 1, len(index.rules), 2) if len(index.rules) > 1 else 1
+            st.dataframe(index.multi_rule_offenders(min_rules=min_rules, top=500), use_container_width=True)
+
+    with tab5:
+        trace = st.session_state.trace
+        if trace is None:
+            st.info("Run the pipeline to see its timing breakdown.")
+        else:
+            records = pd.DataFrame(trace.records())
+            stages = records[records["parent_id"].isna() & ~records["name"].isin(["rule", "predicate", "operator", "llm"])]
+            st.write("### Stages")
+            st.bar_chart(stages.groupby("name", sort=False)["duration_s"].sum())
+            st.dataframe(stages[["name", "duration_s", "peak_rss_mb", "thread"]], use_container_width=True)
+
+            llm = records[records["name"] == "llm"]
+            if not llm.empty:
+                st.write("### LLM calls")
+                st.dataframe(llm[[c for c in ["agent", "cached", "duration_s", "ttft_s", "tokens_per_second", "prompt_chars",
+                                              "response_chars", "prompt_tokens", "output_tokens", "tokens_estimated"]
+                                  if c in llm]], use_container_width=True)
+
+            rules = records[records["name"] == "rule"]
+            if not rules.empty:
+                st.write("### Rules")
+                st.dataframe(rules[[c for c in ["rule_id", "status", "duration_s", "rows_scanned", "violations", "peak_rss_mb"]
+                                    if c in rules]].sort_values("duration_s", ascending=False), use_container_width=True)
+
+            predicates = records[records["name"].isin(["predicate", "operator"])]
+            if not predicates.empty:
+                st.write("### Slowest predicates and operators")
+                columns = [c for c in ["name", "predicate", "operator", "duration_s", "rows_scanned", "peak_rss_mb"] if c in predicates]
+                st.dataframe(predicates[columns].nlargest(20, "duration_s"), use_container_width=True)
+
+            paths = st.session_state.get("trace_paths") or {}
+            st.caption(f"Trace: `{paths.get('jsonl')}` · Prometheus textfile: `{paths.get('prometheus')}`")
         
 # End of file
@@ -0,0 +1,239 @@
+"""
+Headless batch runner: scores many policy x dataset jobs without Streamlit.
+
+The manifest is JSON lines, one job per line:
+    {"policy": "policies/aml.pdf", "dataset": "data/emea.csv", "output": "out/aml_emea"}
+with an optional "id" (by default a hash of the three paths). Relative paths are resolved
+against the manifest's directory. Each job writes report.md, metrics.json and mapped_rules.json
+into its output directory.
+
+Work is shared across jobs wherever the inputs are the same:
+    - each policy is read and extracted by Agent 1 once, whatever the number of datasets;
+    - each dataset is loaded once into the dataset registry and its frame is shared by every job
+      that uses it (and by any other holder in the process);
+    - LLM calls from all jobs go through one semaphore (`llm_concurrency` in flight at most),
+      while rule execution runs on its own pool of `execution_workers` threads, so jobs waiting
+      on the model do not hold up jobs that are executing rules and vice versa.
+
+Finished jobs are appended to a progress log (JSON lines, by default <manifest>.progress.jsonl);
+rerunning the same manifest skips every job already logged as done, so an interrupted nightly
+run resumes where it stopped. Failed jobs are logged with their error and retried on the next run.
+
+    python batch_runner.py nightly.jsonl --jobs 8 --llm-concurrency 4
+"""
+import argparse
+import contextvars
+import hashlib
+import io
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+
+from dataset_registry import DatasetRegistry, get_registry
+from executor import PandasExecutor
+from llm_pipeline import LLMPipeline
+from utils import extract_text_from_file
+
+
+def load_manifest(path: str) -> list:
+    """Reads the job manifest; returns [{"id", "policy", "dataset", "output"}] with absolute paths."""
+    base = os.path.dirname(os.path.abspath(path))
+    jobs = []
+    seen = set()
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip() or line.lstrip().startswith("#"):
+                continue
+            entry = json.loads(line)
+            missing = [k for k in ("policy", "dataset", "output") if not entry.get(k)]
+            if missing:
+                raise ValueError(f"{path}:{line_no}: job is missing {', '.join(missing)}")
+            job = {k: os.path.normpath(os.path.join(base, entry[k])) for k in ("policy", "dataset", "output")}
+            job["id"] = str(entry.get("id") or hashlib.sha1(
+                "\0".join(job[k] for k in ("policy", "dataset", "output")).encode("utf-8")).hexdigest()[:12])
+            if job["id"] in seen:
+                raise ValueError(f"{path}:{line_no}: duplicate job id '{job['id']}'")
+            seen.add(job["id"])
+            jobs.append(job)
+    return jobs
+
+
+def read_policy(path: str) -> str:
+    """Extracts a policy file's text the same way the app does for an uploaded PDF/TXT."""
+    with open(path, "rb") as f:
+        buffer = io.BytesIO(f.read())
+    buffer.name = os.path.basename(path)
+    return extract_text_from_file(buffer)
+
+
+def read_progress(path: str) -> dict:
+    """Latest progress entry per job id (a torn last line from an interrupted run is ignored)."""
+    latest = {}
+    if not os.path.exists(path):
+        return latest
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            latest[entry["job_id"]] = entry
+    return latest
+
+
+def _write_atomic(path: str, text: str):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+class _Memo:
+    """Computes each key once, even when several threads ask for it at the same time."""
+
+    def __init__(self):
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, compute):
+        with self._lock:
+            future = self._futures.get(key)
+            owner = future is None
+            if owner:
+                future = self._futures[key] = Future()
+        if owner:
+            try:
+                future.set_result(compute())
+            except BaseException as e:
+                future.set_exception(e)
+        return future.result()
+
+
+class BatchRunner:
+    """
+    Runs manifest jobs on `jobs` threads. `pipeline` defaults to a fresh LLMPipeline, whose
+    response cache and mapping store are shared by all jobs; `registry` defaults to the
+    process-wide dataset registry.
+    """
+
+    def __init__(self, pipeline: LLMPipeline = None, jobs: int = 4, llm_concurrency: int = 2,
+                 execution_workers: int = None, registry: DatasetRegistry = None):
+        self.pipeline = pipeline if pipeline is not None else LLMPipeline()
+        self.registry = registry if registry is not None else get_registry()
+        self.jobs = jobs
+        self.llm_slots = threading.BoundedSemaphore(llm_concurrency)
+        self.execution_workers = execution_workers or os.cpu_count() or 1
+        self._rules = _Memo()
+        self._log_lock = threading.Lock()
+
+    def _extract_rules(self, policy_path: str):
+        policy_text = read_policy(policy_path)
+        with self.llm_slots:
+            result = None
+            for chunk in self.pipeline.agent_1_extract_generic_rules(policy_text):
+                if isinstance(chunk, tuple) and chunk[0] != "RULE":
+                    result = chunk
+        if result is None or result[0] == "ERROR":
+            raise RuntimeError(f"Agent 1 failed for {policy_path}: {result[1] if result else 'no result'}")
+        return result[1]
+
+    def run_job(self, job: dict, execution_pool: ThreadPoolExecutor) -> dict:
+        """Runs one job end to end and writes its outputs; returns its summary."""
+        started = time.perf_counter()
+        agent_1_rules = self._rules.get(job["policy"], lambda: self._extract_rules(job["policy"]))
+        # Held until the rules have run, so the registry keeps the shared frame while this job needs it
+        with self.registry.acquire(job["dataset"]) as dataset:
+            # The registry frame is already parsed and compacted; a copy-on-write view per job keeps
+            # any column change private while the data itself is shared
+            executor = PandasExecutor(dataset.copy(), dataset.column_roles, compact=False)
+            schema_info = executor.get_schema_summary()
+
+            with self.llm_slots:
+                status, payload = self.pipeline.agent_2_map_all_rules(
+                    agent_1_rules, schema_info["columns"], schema_info["sample_csv"])
+            if status == "ERROR":
+                raise RuntimeError(f"Agent 2 failed: {payload}")
+            mapped_rules = [r.model_dump() for r in payload.mapped_rules]
+
+            metrics_json = execution_pool.submit(contextvars.copy_context().run,
+                                                 executor.run_all_rules_and_collect_metrics, mapped_rules).result()
+
+        with self.llm_slots:
+            report = "".join(self.pipeline.agent_3_generate_executive_report(metrics_json)).strip()
+
+        os.makedirs(job["output"], exist_ok=True)
+        _write_atomic(os.path.join(job["output"], "mapped_rules.json"), json.dumps(mapped_rules, indent=2))
+        _write_atomic(os.path.join(job["output"], "metrics.json"), metrics_json)
+        _write_atomic(os.path.join(job["output"], "report.md"), report)
+
+        metrics = json.loads(metrics_json)
+        return {
+            "rules": len(mapped_rules),
+            "violations": sum(m.get("violation_count") or 0 for m in metrics),
+            "seconds": round(time.perf_counter() - started, 3),
+        }
+
+    def _log(self, progress_path: str, entry: dict):
+        entry["finished_at"] = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        with self._log_lock, open(progress_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def run(self, jobs: list, progress_path: str) -> dict:
+        """
+        Runs every job not already logged as done in `progress_path`.
+        Returns {"done": [job ids], "failed": {job id: error}, "skipped": [job ids]}.
+        """
+        progress = read_progress(progress_path)
+        skipped = [job["id"] for job in jobs if progress.get(job["id"], {}).get("status") == "done"]
+        todo = [job for job in jobs if job["id"] not in set(skipped)]
+        summary = {"done": [], "failed": {}, "skipped": skipped}
+        if skipped:
+            print(f"Resuming: {len(skipped)} of {len(jobs)} jobs already done.")
+
+        with ThreadPoolExecutor(max_workers=self.execution_workers, thread_name_prefix="batch-exec") as execution_pool, \
+                ThreadPoolExecutor(max_workers=self.jobs, thread_name_prefix="batch-job") as job_pool:
+            # Each job runs in a copy of the caller's context, so an active trace (see instrumentation) follows it
+            futures = {job_pool.submit(contextvars.copy_context().run, self.run_job, job, execution_pool): job
+                       for job in todo}
+            for future in as_completed(futures):
+                job = futures[future]
+                entry = {"job_id": job["id"], "policy": job["policy"], "dataset": job["dataset"], "output": job["output"]}
+                try:
+                    entry.update(status="done", **future.result())
+                    summary["done"].append(job["id"])
+                    print(f"[{len(summary['done']) + len(summary['failed'])}/{len(todo)}] {job['id']} done "
+                          f"({entry['rules']} rules, {entry['violations']} violations, {entry['seconds']}s)")
+                except Exception as e:
+                    entry.update(status="failed", error=f"{type(e).__name__}: {e}")
+                    summary["failed"][job["id"]] = entry["error"]
+                    print(f"[{len(summary['done']) + len(summary['failed'])}/{len(todo)}] {job['id']} FAILED: {entry['error']}")
+                self._log(progress_path, entry)
+        return summary
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Score many policy x dataset jobs headlessly.")
+    parser.add_argument("manifest", help="JSONL of {\"policy\", \"dataset\", \"output\"[, \"id\"]} jobs.")
+    parser.add_argument("--progress", default=None, help="Progress log (default: <manifest>.progress.jsonl).")
+    parser.add_argument("--jobs", type=int, default=4, help="Jobs in flight at once.")
+    parser.add_argument("--llm-concurrency", type=int, default=2, help="LLM calls in flight at once, across all jobs.")
+    parser.add_argument("--execution-workers", type=int, default=None, help="Threads executing rules (default: CPU count).")
+    args = parser.parse_args(argv)
+
+    jobs = load_manifest(args.manifest)
+    progress_path = args.progress or os.path.splitext(args.manifest)[0] + ".progress.jsonl"
+    runner = BatchRunner(jobs=args.jobs, llm_concurrency=args.llm_concurrency, execution_workers=args.execution_workers)
+    summary = runner.run(jobs, progress_path)
+    print(f"{len(summary['done'])} done, {len(summary['failed'])} failed, {len(summary['skipped'])} skipped. "
+          f"Progress log: {progress_path}")
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
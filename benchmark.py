@@ -0,0 +1,341 @@
+"""
+End-to-end benchmark: ingest, mapping, execution and reporting over generated datasets.
+
+Every (backend, rows, rules) combination runs the same stages the app does and records wall
+time, peak RSS and rows/sec for each:
+    load            pd.read_csv of the generated file
+    dtype_fix       executor construction (date/amount parsing and dtype compaction)
+    schema_summary  executor.get_schema_summary()
+    mapping         Agent 1 extraction + Agent 2 mapping
+    rule_eval       shared-scan evaluation of every READY rule (Pandas backends)
+    metrics         per-rule aggregation (for other backends: execution and aggregation together)
+    json            to_lean_metrics_json()
+    report          Agent 3 executive report
+
+The LLM agents are served by RecordedModels, which replays data/benchmark/recorded_responses.json
+in place of the Gemini client, so runs are offline and deterministic. Datasets come from
+generate_mock_data with a fixed seed and are cached under .cache/benchmark/.
+
+Results are written as JSON ({"meta": {...}, "results": [...]}) and can be compared across commits:
+    python benchmark.py --rows 10000 100000 --rules 10 40 --out base.json
+    python benchmark.py --rows 10000 100000 --rules 10 40 --compare base.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+import llm_pipeline
+from executor import PandasExecutor, to_lean_metrics_json
+from generate_mock_data import generate_dataset
+from instrumentation import current_rss
+from llm_cache import LLMResponseCache
+from mapping_store import MappingStore
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+RECORDED_RESPONSES = os.path.join(ROOT, "data", "benchmark", "recorded_responses.json")
+BENCHMARK_DIR = os.path.join(ROOT, ".cache", "benchmark")
+POLICY_PATH = os.path.join(ROOT, "test_policy.txt")
+
+STAGES = ["load", "dtype_fix", "schema_summary", "mapping", "rule_eval", "metrics", "json", "report"]
+# Stages whose cost scales with the data; the others get no rows/sec figure
+ROW_STAGES = {"load", "dtype_fix", "schema_summary", "rule_eval", "metrics", "json"}
+
+# Thresholds and limits (3 to 7 digit numbers outside quotes, so account ids are left alone) scaled to derive rule variants
+_THRESHOLD_RE = re.compile(r"""('(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"|`[^`]*`)|(?<![\w.])(\d{3,7}(?:\.\d+)?)(?![\w.])""")
+
+_STREAM_CHUNK = 64
+
+
+def _scale_thresholds(query: str, factor: float) -> str:
+    def replace(match):
+        if match.group(1):
+            return match.group(1)
+        value = float(match.group(2)) * factor
+        return f"{value:.2f}".rstrip("0").rstrip(".")
+    return _THRESHOLD_RE.sub(replace, query)
+
+
+def expand_rules(rules: list, count: int) -> list:
+    """
+    The first `count` rules of the recorded rule set repeated as variants: variant k > 0 gets
+    rule_id '<id>#k' and its thresholds scaled by (1 + k/100), so variants evaluate distinct predicates.
+    """
+    expanded = []
+    for i in range(count):
+        variant, rule = divmod(i, len(rules))
+        rule = dict(rules[rule])
+        if variant:
+            rule["rule_id"] = f"{rule['rule_id']}#{variant}"
+            for field in ("sql_query", "pandas_query"):
+                if rule.get(field):
+                    rule[field] = _scale_thresholds(rule[field], 1 + variant / 100)
+        expanded.append(rule)
+    return expanded
+
+
+class RecordedModels:
+    """
+    Replays recorded agent responses in place of `client.models`. Agent 1 streams the rule set,
+    Agent 2 returns the recorded mapping of every rule whose id appears in its prompt, and
+    Agent 3 streams the recorded report.
+    """
+
+    def __init__(self, rule_count: int, path: str = RECORDED_RESPONSES):
+        with open(path, encoding="utf-8") as f:
+            recorded = json.load(f)
+        self.agent_1 = expand_rules(recorded["agent_1"], rule_count)
+        self.agent_2 = expand_rules(recorded["agent_2"], rule_count)
+        self.agent_3 = recorded["agent_3"]
+
+    @staticmethod
+    def _stream(text: str):
+        for i in range(0, len(text), _STREAM_CHUNK):
+            yield types.SimpleNamespace(text=text[i:i + _STREAM_CHUNK])
+
+    def generate_content_stream(self, model, contents, config):
+        if contents.startswith("You are Agent 3"):
+            return self._stream(self.agent_3)
+        return self._stream(json.dumps(self.agent_1))
+
+    def generate_content(self, model, contents, config):
+        mapped = [m for m in self.agent_2 if f'"rule_id": "{m["rule_id"]}"' in contents]
+        return types.SimpleNamespace(text=json.dumps({"mapped_rules": mapped}))
+
+
+class _PeakRSS:
+    """Samples this process's resident set size in a background thread; `peak` is in bytes."""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, current_rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = current_rss()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+
+class _StageTimer:
+    def __init__(self, verbose: bool):
+        self.verbose = verbose
+        self.timings = {}
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        sink = contextlib.nullcontext() if self.verbose else contextlib.redirect_stdout(io.StringIO())
+        with _PeakRSS() as rss, sink:
+            started = time.perf_counter()
+            yield
+            elapsed = time.perf_counter() - started
+        self.timings[name] = (elapsed, rss.peak)
+
+
+def dataset_path(rows: int, seed: int = 42) -> str:
+    """Generated IBM-layout CSV with `rows` rows, created on first use and reused afterwards."""
+    path = os.path.join(BENCHMARK_DIR, "data", f"ibm_aml_{rows}_{seed}.csv")
+    if not os.path.exists(path):
+        with contextlib.redirect_stdout(io.StringIO()):
+            generate_dataset(rows, path, layout="ibm_aml", seed=seed)
+    return path
+
+
+def _make_executor(backend: str, df: pd.DataFrame, path: str, workers: int):
+    if backend == "pandas":
+        return PandasExecutor(df)
+    if backend == "parallel":
+        from parallel import ParallelExecutor
+        return ParallelExecutor(df, n_workers=workers)
+    if backend == "duckdb":
+        from duckdb_executor import DuckDBExecutor
+        return DuckDBExecutor(df)
+    if backend == "chunked":
+        from chunked_executor import ChunkedExecutor
+        return ChunkedExecutor(path)
+    raise ValueError(f"Unknown backend '{backend}'")
+
+
+def run_case(backend: str, rows: int, rule_count: int, seed: int = 42, workers: int = None, verbose: bool = False) -> dict:
+    """Runs every stage once for one configuration; returns {stage: (seconds, peak_rss_bytes)}."""
+    path = dataset_path(rows, seed)
+    with open(POLICY_PATH, encoding="utf-8") as f:
+        policy_text = f.read()
+    timer = _StageTimer(verbose)
+    original_client = llm_pipeline.client
+    llm_pipeline.client = types.SimpleNamespace(models=RecordedModels(rule_count))
+    try:
+        with tempfile.TemporaryDirectory() as state:
+            # Fresh caches every run, so the mapping stage always goes through the (stubbed) model
+            pipeline = llm_pipeline.LLMPipeline(cache=LLMResponseCache(os.path.join(state, "llm")),
+                                                mapping_store=MappingStore(os.path.join(state, "maps")))
+            with timer.stage("load"):
+                df = pd.read_csv(path)
+            with timer.stage("dtype_fix"):
+                executor = _make_executor(backend, df, path, workers)
+            with timer.stage("schema_summary"):
+                schema = executor.get_schema_summary()
+
+            with timer.stage("mapping"):
+                agent_1_rules = next(payload for kind, payload in
+                                     (e for e in pipeline.agent_1_extract_generic_rules(policy_text) if isinstance(e, tuple))
+                                     if kind == "DONE")
+                status, mapped = pipeline.agent_2_map_all_rules(agent_1_rules, schema["columns"], schema["sample_csv"])
+                if status == "ERROR":
+                    raise RuntimeError(mapped)
+                mapped_rules = [m.model_dump() for m in mapped.mapped_rules]
+
+            if isinstance(executor, PandasExecutor):
+                with timer.stage("rule_eval"):
+                    ready = [r["pandas_query"] for r in mapped_rules if r["status"] == "READY" and r["pandas_query"]]
+                    results = dict(zip(ready, executor.execute_mapped_queries(ready)))
+                with timer.stage("metrics"):
+                    metrics = [executor.collect_rule_metric(r, results.get(r["pandas_query"])) for r in mapped_rules]
+                with timer.stage("json"):
+                    metrics_json = to_lean_metrics_json(metrics)
+            else:
+                with timer.stage("metrics"):
+                    metrics_json = executor.run_all_rules_and_collect_metrics(mapped_rules)
+                with timer.stage("json"):
+                    metrics_json = to_lean_metrics_json(json.loads(metrics_json))
+
+            with timer.stage("report"):
+                "".join(pipeline.agent_3_generate_executive_report(metrics_json))
+            if hasattr(executor, "close"):
+                executor.close()
+    finally:
+        llm_pipeline.client = original_client
+    return timer.timings
+
+
+def _git(*args) -> str:
+    try:
+        return subprocess.run(["git", *args], cwd=ROOT, capture_output=True, text=True, timeout=30).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+def run_benchmarks(backends, row_counts, rule_counts, repeat: int = 1, seed: int = 42, workers: int = None,
+                   verbose: bool = False) -> dict:
+    """
+    Runs every combination `repeat` times and keeps each stage's fastest time and highest peak RSS.
+    Returns {"meta": {...}, "results": [{"backend", "rows", "rules", "stage", "seconds", "peak_rss_mb", "rows_per_sec"}]}.
+    """
+    results = []
+    for backend in backends:
+        for rows in row_counts:
+            for rule_count in rule_counts:
+                best = {}
+                for _ in range(repeat):
+                    for stage, (seconds, peak) in run_case(backend, rows, rule_count, seed, workers, verbose).items():
+                        previous = best.get(stage, (float("inf"), 0))
+                        best[stage] = (min(previous[0], seconds), max(previous[1], peak))
+                for stage in STAGES:
+                    if stage not in best:
+                        continue
+                    seconds, peak = best[stage]
+                    results.append({
+                        "backend": backend, "rows": rows, "rules": rule_count, "stage": stage,
+                        "seconds": round(seconds, 6),
+                        "peak_rss_mb": round(peak / 2**20, 1),
+                        "rows_per_sec": round(rows / seconds) if stage in ROW_STAGES and seconds > 0 else None,
+                    })
+                    print(f"{backend:>8} {rows:>10,} rows {rule_count:>4} rules  {stage:<15}"
+                          f"{seconds:9.3f}s {peak / 2**20:9.1f} MB")
+
+    meta = {
+        "commit": _git("rev-parse", "HEAD"),
+        "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "seed": seed,
+        "repeat": repeat,
+    }
+    return {"meta": meta, "results": results}
+
+
+def compare_results(baseline: dict, current: dict, tolerance: float = 0.2, min_seconds: float = 0.05) -> list:
+    """
+    Matches stages by (backend, rows, rules, stage) and returns one entry per match with the time
+    ratio current / baseline; `regression` is set when a stage that takes at least `min_seconds`
+    got more than `tolerance` slower.
+    """
+    base = {(r["backend"], r["rows"], r["rules"], r["stage"]): r for r in baseline["results"]}
+    comparison = []
+    for row in current["results"]:
+        key = (row["backend"], row["rows"], row["rules"], row["stage"])
+        if key not in base:
+            continue
+        before, after = base[key]["seconds"], row["seconds"]
+        ratio = after / before if before > 0 else float("inf")
+        comparison.append({
+            "backend": key[0], "rows": key[1], "rules": key[2], "stage": key[3],
+            "baseline_seconds": before, "seconds": after, "ratio": round(ratio, 3),
+            "regression": max(before, after) >= min_seconds and ratio > 1 + tolerance,
+        })
+    return comparison
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the compliance pipeline end to end on generated data.")
+    parser.add_argument("--backends", nargs="+", default=["pandas"], choices=["pandas", "parallel", "duckdb", "chunked"])
+    parser.add_argument("--rows", nargs="+", type=int, default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--rules", nargs="+", type=int, default=[10, 40])
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per configuration; the fastest is kept.")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes for the parallel backend.")
+    parser.add_argument("--out", default=None, help="Results file (default: .cache/benchmark/results/<commit>.json).")
+    parser.add_argument("--compare", default=None, help="Baseline results file to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown before a stage counts as a regression.")
+    parser.add_argument("--verbose", action="store_true", help="Show the executors' own logging.")
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(args.backends, args.rows, args.rules, args.repeat, args.seed, args.workers, args.verbose)
+    out = args.out or os.path.join(BENCHMARK_DIR, "results", f"{(report['meta']['commit'] or 'unknown')[:12]}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {out}")
+
+    if not args.compare:
+        return 0
+    with open(args.compare, encoding="utf-8") as f:
+        baseline = json.load(f)
+    comparison = compare_results(baseline, report, args.tolerance)
+    for row in comparison:
+        flag = "  REGRESSION" if row["regression"] else ""
+        print(f"{row['backend']:>8} {row['rows']:>10,} rows {row['rules']:>4} rules  {row['stage']:<15}"
+              f"{row['baseline_seconds']:9.3f}s -> {row['seconds']:9.3f}s  x{row['ratio']:.2f}{flag}")
+    return 1 if any(row["regression"] for row in comparison) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
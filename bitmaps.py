@@ -0,0 +1,189 @@
+import numpy as np
+import pandas as pd
+
+# Rows are split into 2^16-row blocks; each non-empty block is stored as a sorted uint16 position
+# array while sparse, or as a packed 8 KB bitset once it holds more than ARRAY_LIMIT rows
+# (the point where the array would be larger), as in Roaring bitmaps.
+BLOCK_BITS = 16
+BLOCK_SIZE = 1 << BLOCK_BITS
+ARRAY_LIMIT = 4096
+
+
+def _to_packed(container: np.ndarray) -> np.ndarray:
+    if container.dtype == np.uint8:
+        return container
+    dense = np.zeros(BLOCK_SIZE, dtype=bool)
+    dense[container] = True
+    return np.packbits(dense)
+
+
+def _encode(packed: np.ndarray):
+    """Picks the smaller representation for one block; returns None for an empty block."""
+    count = int(np.bitwise_count(packed).sum())
+    if count == 0:
+        return None
+    if count > ARRAY_LIMIT:
+        return packed
+    return np.flatnonzero(np.unpackbits(packed)).astype(np.uint16)
+
+
+def _cardinality(container: np.ndarray) -> int:
+    return int(np.bitwise_count(container).sum()) if container.dtype == np.uint8 else len(container)
+
+
+class RowBitmap:
+    """
+    Compressed set of row positions (Roaring-style) over a table of `size` rows.
+
+    Supports &, |, - (and-not), len() (number of set rows) and conversion back to positions or a
+    boolean mask. A dense 10M-row result takes ~1.25 MB; sparse results take 2 bytes per row.
+    """
+
+    def __init__(self, size: int, blocks: dict = None):
+        self.size = int(size)
+        self.blocks = blocks or {}
+
+    @classmethod
+    def from_mask(cls, mask) -> "RowBitmap":
+        mask = np.asarray(mask, dtype=bool)
+        n = len(mask)
+        blocks = {}
+        n_blocks = -(-n // BLOCK_SIZE)
+        padded = np.zeros(n_blocks * BLOCK_SIZE, dtype=bool)
+        padded[:n] = mask
+        padded = padded.reshape(n_blocks, BLOCK_SIZE)
+        counts = padded.sum(axis=1)
+        for key in np.flatnonzero(counts):
+            if counts[key] > ARRAY_LIMIT:
+                blocks[int(key)] = np.packbits(padded[key])
+            else:
+                blocks[int(key)] = np.flatnonzero(padded[key]).astype(np.uint16)
+        return cls(n, blocks)
+
+    @classmethod
+    def from_positions(cls, positions, size: int) -> "RowBitmap":
+        """Builds a bitmap from row positions (any order, duplicates allowed)."""
+        positions = np.asarray(positions, dtype=np.int64)
+        if not np.all(positions[1:] > positions[:-1]):
+            positions = np.unique(positions)
+        blocks = {}
+        keys = positions >> BLOCK_BITS
+        bounds = np.flatnonzero(np.diff(keys)) + 1
+        for chunk in np.split(positions, bounds) if len(positions) else []:
+            low = (chunk & (BLOCK_SIZE - 1)).astype(np.uint16)
+            key = int(chunk[0] >> BLOCK_BITS)
+            blocks[key] = _to_packed(low) if len(low) > ARRAY_LIMIT else low
+        return cls(size, blocks)
+
+    def __len__(self):
+        return sum(_cardinality(c) for c in self.blocks.values())
+
+    @property
+    def nbytes(self) -> int:
+        return sum(c.nbytes for c in self.blocks.values())
+
+    def to_positions(self) -> np.ndarray:
+        """Sorted int64 row positions."""
+        parts = []
+        for key in sorted(self.blocks):
+            container = self.blocks[key]
+            low = np.flatnonzero(np.unpackbits(container)) if container.dtype == np.uint8 else container
+            parts.append(low.astype(np.int64) + (key << BLOCK_BITS))
+        return np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+
+    def to_mask(self) -> np.ndarray:
+        mask = np.zeros(self.size, dtype=bool)
+        mask[self.to_positions()] = True
+        return mask
+
+    def _combine(self, other: "RowBitmap", op, keys) -> "RowBitmap":
+        blocks = {}
+        empty = np.zeros(BLOCK_SIZE // 8, dtype=np.uint8)
+        for key in keys:
+            a, b = self.blocks.get(key), other.blocks.get(key)
+            packed = op(_to_packed(a) if a is not None else empty, _to_packed(b) if b is not None else empty)
+            encoded = _encode(packed)
+            if encoded is not None:
+                blocks[key] = encoded
+        return RowBitmap(max(self.size, other.size), blocks)
+
+    def __and__(self, other: "RowBitmap") -> "RowBitmap":
+        return self._combine(other, np.bitwise_and, self.blocks.keys() & other.blocks.keys())
+
+    def __or__(self, other: "RowBitmap") -> "RowBitmap":
+        return self._combine(other, np.bitwise_or, self.blocks.keys() | other.blocks.keys())
+
+    def __sub__(self, other: "RowBitmap") -> "RowBitmap":
+        return self._combine(other, lambda a, b: a & ~b, self.blocks.keys())
+
+
+class AccountRuleIndex:
+    """
+    Sparse accounts x rules index built from each rule's violation bitmap.
+
+    Every rule keeps a bitmap over account codes plus the number of violating rows per flagged
+    account, so intersections, unions and multi-rule rankings are bitwise operations on accounts
+    rather than re-runs over the transactions.
+    """
+
+    def __init__(self, accounts: pd.Series, rule_bitmaps: dict):
+        codes, self.accounts = pd.factorize(accounts)
+        n_accounts = len(self.accounts)
+        self.rules = list(rule_bitmaps)
+        self.account_bitmaps = {}
+        self.violation_counts = {}
+        for rule, bitmap in rule_bitmaps.items():
+            rule_codes = codes[bitmap.to_positions()]
+            flagged, counts = np.unique(rule_codes[rule_codes >= 0], return_counts=True)
+            self.account_bitmaps[rule] = RowBitmap.from_positions(flagged, n_accounts)
+            self.violation_counts[rule] = (flagged, counts)
+
+    def _labels(self, bitmap: RowBitmap) -> list:
+        return list(self.accounts[bitmap.to_positions()])
+
+    def accounts_for(self, rule) -> list:
+        return self._labels(self.account_bitmaps[rule])
+
+    def intersection(self, rules) -> list:
+        """Accounts flagged by every one of `rules`."""
+        bitmaps = [self.account_bitmaps[r] for r in rules]
+        result = bitmaps[0]
+        for bitmap in bitmaps[1:]:
+            result = result & bitmap
+        return self._labels(result)
+
+    def union(self, rules) -> list:
+        """Accounts flagged by at least one of `rules`."""
+        result = RowBitmap(len(self.accounts))
+        for rule in rules:
+            result = result | self.account_bitmaps[rule]
+        return self._labels(result)
+
+    def multi_rule_offenders(self, min_rules: int = 2, top: int = None) -> pd.DataFrame:
+        """
+        Accounts flagged by at least `min_rules` rules, ranked by number of rules, then by total
+        violating transactions, then by first appearance in the data.
+        """
+        n_accounts = len(self.accounts)
+        rules_tripped = np.zeros(n_accounts, dtype=np.int64)
+        violations = np.zeros(n_accounts, dtype=np.int64)
+        for flagged, counts in self.violation_counts.values():
+            rules_tripped[flagged] += 1
+            violations[flagged] += counts
+
+        selected = np.flatnonzero(rules_tripped >= min_rules)
+        order = np.lexsort((selected, -violations[selected], -rules_tripped[selected]))
+        selected = selected[order][:top]
+
+        tripped_by = [[] for _ in selected]
+        for rule in self.rules:
+            flagged = self.violation_counts[rule][0]
+            for i in np.flatnonzero(np.isin(selected, flagged)):
+                tripped_by[i].append(rule)
+
+        return pd.DataFrame({
+            "account": self.accounts[selected],
+            "rules_tripped": rules_tripped[selected],
+            "violations": violations[selected],
+            "rules": tripped_by,
+        })
@@ -0,0 +1,322 @@
+import numpy as np
+import pandas as pd
+
+from executor import (
+    PandasExecutor,
+    resolve_rule_columns,
+    skipped_metric,
+    error_metric,
+    flagged_metric,
+    to_lean_metrics_json,
+)
+from incremental import history_window
+from ingestion import widen_numeric
+from operators import duplicate_keys
+from parsing import to_amount, to_datetime
+from query_plan import get_plan
+from sketches import HyperLogLog, SpaceSaving
+
+# Per-chunk key counts are merged whenever this many have accumulated, bounding the key-count pass's memory
+_MERGE_EVERY = 8
+
+
+def _resolve_args(df: pd.DataFrame, args, kwargs):
+    """Operator arguments as evaluate_operator passes them: columns as Series, literals as values."""
+    def resolve(arg):
+        kind, value = arg
+        if kind == "column":
+            if value not in df.columns:
+                raise ValueError(f"Unknown column '{value}'")
+            return widen_numeric(df[value])
+        return value
+    return [resolve(a) for a in args], {k: resolve(v) for k, v in kwargs}
+
+
+def _time_columns(query: str) -> set:
+    """The time columns a query's windowed operators read (positional or `time=`)."""
+    columns = set()
+    for name, args, kwargs in get_plan(query).operators.values():
+        kwargs = dict(kwargs)
+        if "time" in kwargs:
+            columns.add(kwargs["time"][1])
+        elif name in ("velocity_count", "velocity_sum", "structuring_count") and len(args) > 1:
+            columns.add(args[1][1])
+    return columns
+
+
+def _mixes_history(query: str) -> bool:
+    """True if a query combines a whole-file duplicate_count with other cross-row operators."""
+    operators = get_plan(query).operators.values()
+    return any(name not in ("in_list", "duplicate_count") or (name == "duplicate_count" and "time" in dict(kwargs))
+               for name, args, kwargs in operators)
+
+
+class RuleAccumulator:
+    """
+    Mergeable per-rule metrics: violation count, exposure sum, date range, distinct accounts
+    (HyperLogLog) and top offenders (SpaceSaving). Memory is bounded regardless of row count.
+    """
+
+    def __init__(self, topk_capacity: int = 1000, hll_precision: int = 14):
+        self.count = 0
+        self.amount_sum = 0.0
+        self.min_date = None
+        self.max_date = None
+        self.accounts = HyperLogLog(precision=hll_precision)
+        self.offenders = SpaceSaving(capacity=topk_capacity)
+        self.error = None
+
+    def update(self, amounts=None, dates=None, accounts=None, positions=None, count=0):
+        """Folds one chunk's violating rows in. Each argument is that chunk's masked column (or None)."""
+        self.count += int(count)
+        if amounts is not None:
+            self.amount_sum += float(to_amount(amounts).fillna(0).sum())
+        if dates is not None:
+            dates = to_datetime(dates).dropna()
+            if not dates.empty:
+                lo, hi = dates.min(), dates.max()
+                self.min_date = lo if self.min_date is None else min(self.min_date, lo)
+                self.max_date = hi if self.max_date is None else max(self.max_date, hi)
+        if accounts is not None:
+            self.accounts.update(accounts)
+            self.offenders.update(accounts, positions)
+
+    def merge(self, other: "RuleAccumulator"):
+        self.count += other.count
+        self.amount_sum += other.amount_sum
+        for attr, pick in (("min_date", min), ("max_date", max)):
+            mine, theirs = getattr(self, attr), getattr(other, attr)
+            setattr(self, attr, theirs if mine is None else mine if theirs is None else pick(mine, theirs))
+        self.accounts.merge(other.accounts)
+        self.offenders.merge(other.offenders)
+        self.error = self.error or other.error
+        return self
+
+    def to_metric(self, rule, total_rows):
+        """Renders the accumulated state as the same metric entry PandasExecutor produces."""
+        if self.error:
+            return error_metric(rule, self.error)
+        date_range = "N/A"
+        if self.min_date is not None:
+            date_range = f"{self.min_date.strftime('%Y-%m-%d %H:%M')} to {self.max_date.strftime('%Y-%m-%d %H:%M')}"
+        return flagged_metric(
+            rule, self.count, total_rows,
+            unique_accounts=self.accounts.count(),
+            total_exposure=self.amount_sum,
+            avg_amount=self.amount_sum / self.count if self.count else 0,
+            date_range=date_range,
+            top_offenders=[f"{acct} ({val} txns)" for acct, val in self.offenders.top(3)],
+        )
+
+
+class ChunkedExecutor:
+    """
+    Out-of-core execution: streams a CSV/Parquet file in row chunks, evaluates every rule mask
+    per chunk with PandasExecutor and folds the results into RuleAccumulators.
+    Only one chunk is resident at a time, so file size is not limited by memory.
+
+    Operators whose result depends on rows outside the chunk keep state across chunks instead:
+    duplicate_count without a time tolerance is fed key counts taken over the whole file by an
+    extra pass (memory grows with the number of distinct keys, not rows). Windowed operators
+    (velocity, structuring, duplicates within a tolerance) are evaluated over the chunk plus a
+    carried tail of the rows within the largest window of its latest time, the same way
+    IncrementalExecutor handles appends. That is exact when the file is in time order; when a
+    chunk reaches back past the carried history, the affected rules report an ERROR instead of
+    an undercount.
+    """
+
+    def __init__(self, path: str, chunksize: int = 1_000_000, topk_capacity: int = 1000, hll_precision: int = 14):
+        self.path = str(path)
+        self.chunksize = chunksize
+        self.topk_capacity = topk_capacity
+        self.hll_precision = hll_precision
+
+    def iter_chunks(self):
+        """Yields DataFrame chunks whose index continues across chunks (global row positions)."""
+        if self.path.lower().endswith(".parquet"):
+            import pyarrow.parquet as pq
+            offset = 0
+            for batch in pq.ParquetFile(self.path).iter_batches(batch_size=self.chunksize):
+                chunk = batch.to_pandas()
+                chunk.index = pd.RangeIndex(offset, offset + len(chunk))
+                offset += len(chunk)
+                yield chunk
+        else:
+            yield from pd.read_csv(self.path, chunksize=self.chunksize)
+
+    def get_schema_summary(self):
+        """Returns standard headers and 5 sample values (from the first chunk) for Agent 2 to use in mapping."""
+        first_chunk = next(iter(self.iter_chunks()))
+        return PandasExecutor(first_chunk, compact=False).get_schema_summary()
+
+    def _count_duplicate_keys(self, queries) -> dict:
+        """
+        One pass over the file counting the keys of every tolerance-free duplicate_count call in
+        `queries`. Returns {operator variable: Series of counts indexed by key hash}; calls whose
+        arguments do not resolve are left out, so they fail per chunk with the usual error.
+        """
+        calls = {}
+        for query in queries:
+            for var, (name, args, kwargs) in get_plan(query).operators.items():
+                if name == "duplicate_count" and "time" not in dict(kwargs):
+                    calls[var] = (args, kwargs)
+        partial = {var: [] for var in calls}
+        for chunk in self.iter_chunks():
+            # Typed exactly as in the evaluation pass, so both passes hash the same values
+            chunk = PandasExecutor(chunk, compact=False).df
+            for var, (args, kwargs) in calls.items():
+                if partial.get(var) is None:
+                    continue
+                try:
+                    columns, kw = _resolve_args(chunk, args, kwargs)
+                    hashes, valid = duplicate_keys(*columns, amount=kw.get("amount"), bucket=kw.get("bucket"))
+                except (ValueError, TypeError):
+                    partial[var] = None
+                    continue
+                partial[var].append(pd.Series(hashes[valid]).value_counts())
+                if len(partial[var]) >= _MERGE_EVERY:
+                    partial[var] = [pd.concat(partial[var]).groupby(level=0).sum()]
+        return {var: pd.concat(parts).groupby(level=0).sum() if parts else pd.Series(dtype=np.int64)
+                for var, parts in partial.items() if parts is not None}
+
+    @staticmethod
+    def _file_duplicate_counts(chunk: pd.DataFrame, key_counts: dict) -> dict:
+        """This chunk's duplicate_count results from whole-file key counts, by operator variable."""
+        values = {}
+        for var, (args, kwargs, counts) in key_counts.items():
+            columns, kw = _resolve_args(chunk, args, kwargs)
+            hashes, valid = duplicate_keys(*columns, amount=kw.get("amount"), bucket=kw.get("bucket"))
+            per_row = counts.reindex(hashes).fillna(0).to_numpy(dtype=np.int64)
+            values[var] = np.where(valid, per_row, 0)
+        return values
+
+    @staticmethod
+    def _fold(acc: RuleAccumulator, rule, executor, frame: pd.DataFrame, indices):
+        """Adds the violating rows at index labels `indices` of `frame` to a rule's accumulator."""
+        if acc.error or len(indices) == 0:
+            return
+        rule_amount_col, rule_date_col, rule_account_col = resolve_rule_columns(rule)
+        amount_col = rule_amount_col or executor.amount_col
+        date_col = rule_date_col or executor.date_col
+        account_col = rule_account_col or executor.account_col
+        acc.update(
+            amounts=frame.loc[indices, amount_col] if amount_col in frame.columns else None,
+            dates=frame.loc[indices, date_col] if date_col in frame.columns else None,
+            accounts=frame.loc[indices, account_col] if account_col in frame.columns else None,
+            # Index labels are global row numbers, so ties rank by first appearance in the file
+            positions=np.asarray(indices),
+            count=len(indices),
+        )
+
+    def _evaluate_windowed(self, rules, accumulators, executor, carried):
+        """
+        Evaluates windowed rules over the carried tail plus this chunk and folds in the rows that
+        became violations: every flagged chunk row, and tail rows not flagged before (centered
+        duplicate windows can reach back into the tail). Updates `carried` in place.
+        """
+        chunk = executor.df
+        time_col = executor.date_col
+        if time_col is None or not pd.api.types.is_datetime64_any_dtype(chunk[time_col]):
+            for rule in rules:
+                accumulators[id(rule)].error = accumulators[id(rule)].error or (
+                    "Windowed operators need a parsed time column in chunked mode; use an in-memory engine.")
+            return
+        window = max(carried["windows"][id(rule)] for rule in rules)
+        times = chunk[time_col]
+        if carried["dropped_max"] is not None and (times.dropna() <= carried["dropped_max"] + window).any():
+            for rule in rules:
+                accumulators[id(rule)].error = accumulators[id(rule)].error or (
+                    f"'{self.path}' is not in `{time_col}` order, so windows reach rows already streamed past; "
+                    "use an in-memory engine for windowed rules.")
+        for rule in rules:
+            other = _time_columns(rule['pandas_query']) - {time_col}
+            if other:
+                accumulators[id(rule)].error = accumulators[id(rule)].error or (
+                    f"Chunked mode carries history by `{time_col}`; windows over {', '.join(sorted(other))} "
+                    "need an in-memory engine.")
+        live = [rule for rule in rules if not accumulators[id(rule)].error]
+        if not live:
+            return
+
+        tail = carried["tail"]
+        frame = pd.concat([tail, chunk]) if tail is not None else chunk
+        frame_executor = PandasExecutor(frame, compact=False)
+        results = frame_executor.execute_mapped_queries([rule['pandas_query'] for rule in live])
+        chunk_start = int(chunk.index.min())
+        for rule, result in zip(live, results):
+            acc = accumulators[id(rule)]
+            if not result["success"]:
+                acc.error = result["error"]
+                continue
+            flagged = frame.index[result["violating_positions"]].to_numpy(dtype=np.int64)
+            already = carried["flagged"].get(id(rule), np.empty(0, dtype=np.int64))
+            fresh = flagged[(flagged >= chunk_start) | ~np.isin(flagged, already)]
+            self._fold(acc, rule, frame_executor, frame, pd.Index(fresh))
+            carried["flagged"][id(rule)] = np.union1d(already, flagged)
+
+        # Keep just the rows a later chunk's windows can still reach
+        keep = frame[time_col] >= frame[time_col].max() - window
+        dropped = frame.loc[~keep, time_col].max()
+        if pd.notna(dropped):
+            carried["dropped_max"] = dropped if carried["dropped_max"] is None else max(carried["dropped_max"], dropped)
+        carried["tail"] = frame[keep]
+        floor = int(carried["tail"].index.min()) if keep.any() else chunk_start + len(chunk)
+        carried["flagged"] = {k: v[v >= floor] for k, v in carried["flagged"].items()}
+
+    def run_all_rules_and_collect_metrics(self, rules_from_agent2):
+        """Runs Agent 3's execution loop chunk by chunk and compiles the lean metrics JSON."""
+        ready = [r for r in rules_from_agent2 if r['status'] == 'READY' and r['pandas_query']]
+        accumulators = {id(r): RuleAccumulator(self.topk_capacity, self.hll_precision) for r in ready}
+        total_rows = 0
+
+        windows = {id(r): history_window(r['pandas_query']) for r in ready}
+        windowed = [r for r in ready if isinstance(windows[id(r)], pd.Timedelta)]
+        per_chunk = [r for r in ready if not isinstance(windows[id(r)], pd.Timedelta)]
+        carried = {"windows": windows, "tail": None, "flagged": {}, "dropped_max": None}
+        for rule in per_chunk:
+            if windows[id(rule)] == "all" and _mixes_history(rule['pandas_query']):
+                accumulators[id(rule)].error = ("Chunked mode cannot combine a whole-file duplicate_count with "
+                                                "windowed operators in one rule; use an in-memory engine.")
+
+        whole_file = [r['pandas_query'] for r in per_chunk if windows[id(r)] == "all" and not accumulators[id(r)].error]
+        key_counts = {}
+        if whole_file:
+            print(f"Agent 3: Counting duplicate keys over the whole file for {len(whole_file)} rules...")
+            counts = self._count_duplicate_keys(whole_file)
+            for query in whole_file:
+                for var, (name, args, kwargs) in get_plan(query).operators.items():
+                    if var in counts:
+                        key_counts[var] = (args, kwargs, counts[var])
+
+        for chunk_no, chunk in enumerate(self.iter_chunks()):
+            print(f"Agent 3: Evaluating {len(ready)} rules on chunk {chunk_no} ({len(chunk)} rows)...")
+            total_rows += len(chunk)
+            # Chunks are read once, so re-typing them for memory would not pay for itself
+            executor = PandasExecutor(chunk, compact=False)
+            if key_counts:
+                executor.preset_operator_values(self._file_duplicate_counts(executor.df, key_counts))
+            results = executor.execute_mapped_queries([r['pandas_query'] for r in per_chunk])
+
+            for rule, result in zip(per_chunk, results):
+                acc = accumulators[id(rule)]
+                if not result["success"]:
+                    acc.error = acc.error or result["error"]
+                    continue
+                self._fold(acc, rule, executor, chunk, result["violating_indices"])
+
+            if windowed:
+                self._evaluate_windowed(windowed, accumulators, executor, carried)
+
+        metrics = []
+        for rule in rules_from_agent2:
+            if id(rule) not in accumulators:
+                metrics.append(skipped_metric(rule))
+                continue
+            acc = accumulators[id(rule)]
+            if acc.error:
+                print(f"  [ERROR] {rule['title']}: {acc.error}")
+            else:
+                print(f"  [SUCCESS] {rule['title']}: Found {acc.count} violations.")
+            metrics.append(acc.to_metric(rule, total_rows))
+
+        return to_lean_metrics_json(metrics)
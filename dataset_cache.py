@@ -0,0 +1,102 @@
+import hashlib
+import json
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+from executor import PandasExecutor
+
+# Bump when the typing logic in PandasExecutor changes so stale caches are rebuilt
+CACHE_VERSION = 3
+
+# Only the head and tail of the file are hashed, so keying a multi-GB CSV stays instant
+_HASH_BLOCK = 1 << 20
+
+
+def _cache_paths(csv_path: str):
+    """The typed Arrow copy and its metadata live next to the CSV as hidden files."""
+    folder, name = os.path.split(os.path.abspath(csv_path))
+    base = os.path.join(folder, f".{name}")
+    return base + ".arrow", base + ".meta.json"
+
+
+def _file_key(csv_path: str) -> dict:
+    """Identity of the source file: size, mtime and a hash of its first/last megabyte."""
+    stat = os.stat(csv_path)
+    digest = hashlib.sha256()
+    with open(csv_path, "rb") as f:
+        digest.update(f.read(_HASH_BLOCK))
+        if stat.st_size > _HASH_BLOCK:
+            f.seek(max(stat.st_size - _HASH_BLOCK, _HASH_BLOCK))
+            digest.update(f.read(_HASH_BLOCK))
+    return {
+        "cache_version": CACHE_VERSION,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256_head_tail": digest.hexdigest(),
+    }
+
+
+def _read_meta(meta_path: str):
+    try:
+        with open(meta_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_cache(df: pd.DataFrame, meta: dict, arrow_path: str, meta_path: str):
+    """Writes the Arrow IPC file and metadata atomically (temp file + rename)."""
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    tmp_arrow = arrow_path + ".tmp"
+    # Uncompressed IPC so the file can be memory-mapped without decoding
+    with pa.OSFile(tmp_arrow, "wb") as sink:
+        with ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_arrow, arrow_path)
+
+    tmp_meta = meta_path + ".tmp"
+    with open(tmp_meta, "w") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp_meta, meta_path)
+
+
+def load_dataset(csv_path: str):
+    """
+    Loads a dataset CSV, using a typed, memory-mapped Arrow copy when one is up to date.
+
+    On the first load the CSV is parsed, typed by PandasExecutor and written as Arrow IPC next
+    to the CSV along with its dtypes and amount/date/account column roles. Later loads (in any
+    process) memory-map that file instead of re-parsing. Returns (DataFrame, column_roles).
+    """
+    arrow_path, meta_path = _cache_paths(csv_path)
+    key = _file_key(csv_path)
+
+    meta = _read_meta(meta_path)
+    if meta and meta.get("key") == key and os.path.exists(arrow_path):
+        try:
+            with pa.memory_map(arrow_path, "r") as source:
+                table = ipc.open_file(source).read_all()
+            # split_blocks keeps numeric columns as zero-copy views of the mapped pages
+            df = table.to_pandas(split_blocks=True)
+            return df, meta["column_roles"]
+        except (OSError, pa.ArrowException) as e:
+            print(f"[Warning] Dataset cache for {csv_path} is unreadable, rebuilding: {e}")
+
+    df = pd.read_csv(csv_path)
+    executor = PandasExecutor(df)
+    column_roles = {"amount": executor.amount_col, "date": executor.date_col, "account": executor.account_col}
+
+    try:
+        _write_cache(executor.df, {
+            "key": key,
+            "dtypes": {c: str(t) for c, t in executor.df.dtypes.items()},
+            "column_roles": column_roles,
+            "ingestion_report": executor.ingestion_report,
+        }, arrow_path, meta_path)
+    except (OSError, pa.ArrowException) as e:
+        print(f"[Warning] Failed to write dataset cache for {csv_path}: {e}")
+
+    return executor.df, column_roles
@@ -0,0 +1,185 @@
+"""
+Process-wide registry of loaded datasets, shared by every session and batch job.
+
+Each dataset file (keyed by absolute path, mtime and size) is loaded once through the typed
+Arrow cache (see dataset_cache.load_dataset) and kept as a single, already-typed DataFrame.
+Callers acquire a DatasetHandle instead of owning a copy:
+
+    handle = get_registry().acquire("data/emea.csv")
+    handle.df                 # this holder's view of the shared frame
+    executor = PandasExecutor(handle.copy(), handle.column_roles)
+    handle.release()          # or `with` the handle; also released when it is garbage collected
+
+Views are shallow copies, so no column data is duplicated; copy-on-write (pandas' default from
+3.0, enabled here for older versions) copies a column only when someone assigns to it, which
+keeps the shared frame immutable. Datasets no handle refers to are evicted least-recently-used
+first once the registry is over its memory budget, and immediately once their file has changed.
+"""
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import pandas as pd
+
+from dataset_cache import load_dataset
+
+DEFAULT_MAX_BYTES = 4 * 1024 ** 3
+
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
+
+
+def dataset_key(path: str) -> tuple:
+    """Identity of one version of a dataset file: (absolute path, mtime_ns, size)."""
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    return path, stat.st_mtime_ns, stat.st_size
+
+
+class _Entry:
+    def __init__(self, key: tuple, df: pd.DataFrame, column_roles: dict):
+        self.key = key
+        self.df = df
+        self.column_roles = column_roles
+        self.nbytes = int(df.memory_usage(deep=True).sum())
+        self.refs = 0
+        # Set once a newer version of the same file has been loaded
+        self.superseded = False
+
+
+class DatasetHandle:
+    """One holder's reference to a shared dataset. `df` must be treated as read-only; use copy() to modify."""
+
+    def __init__(self, registry: "DatasetRegistry", entry: _Entry):
+        self.key = entry.key
+        self.path = entry.key[0]
+        self.column_roles = dict(entry.column_roles)
+        self.nbytes = entry.nbytes
+        self.df = entry.df.copy(deep=False)
+        self._finalizer = weakref.finalize(self, registry._release, entry)
+
+    def copy(self) -> pd.DataFrame:
+        """A new copy-on-write view, for consumers that modify the frame (e.g. PandasExecutor)."""
+        return self.df.copy(deep=False)
+
+    @property
+    def stale(self) -> bool:
+        """True once the file on disk differs from the version this handle holds."""
+        try:
+            return dataset_key(self.path) != self.key
+        except OSError:
+            return True
+
+    def release(self):
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class DatasetRegistry:
+    """
+    Loads each dataset version once and shares it between holders, with reference counting and
+    a `max_bytes` LRU budget over the datasets nobody holds. Datasets in use are never evicted,
+    so the budget can be exceeded while they are held. Thread-safe; concurrent first acquires
+    of the same file wait for a single load.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, loader=load_dataset):
+        self.max_bytes = max_bytes
+        self.loader = loader
+        self.loads = 0
+        self.hits = 0
+        self.evictions = 0
+        # key -> _Entry, least recently used first
+        self._entries = OrderedDict()
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, path: str) -> DatasetHandle:
+        key = dataset_key(path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self.hits += 1
+                return self._hold(entry)
+            future = self._loading.get(key)
+            owner = future is None
+            if owner:
+                future = self._loading[key] = Future()
+
+        if not owner:
+            entry = future.result()
+            with self._lock:
+                return self._hold(entry)
+
+        try:
+            df, column_roles = self.loader(key[0])
+            entry = _Entry(key, df, column_roles)
+        except BaseException as e:
+            with self._lock:
+                del self._loading[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._loading[key]
+            self.loads += 1
+            for other in self._entries.values():
+                if other.key[0] == key[0]:
+                    other.superseded = True
+            handle = self._hold(entry)
+            self._evict()
+        future.set_result(entry)
+        return handle
+
+    def _hold(self, entry: _Entry) -> DatasetHandle:
+        # Called with the lock held; an entry evicted between its load and this call is re-adopted
+        self._entries[entry.key] = entry
+        self._entries.move_to_end(entry.key)
+        entry.refs += 1
+        return DatasetHandle(self, entry)
+
+    def _release(self, entry: _Entry):
+        with self._lock:
+            entry.refs -= 1
+            self._evict()
+
+    def _evict(self):
+        total = sum(e.nbytes for e in self._entries.values())
+        for key, entry in list(self._entries.items()):
+            if entry.refs == 0 and (entry.superseded or total > self.max_bytes):
+                del self._entries[key]
+                total -= entry.nbytes
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = list(self._entries.values())
+        return {
+            "datasets": len(entries),
+            "in_use": sum(1 for e in entries if e.refs),
+            "bytes": sum(e.nbytes for e in entries),
+            "max_bytes": self.max_bytes,
+            "loads": self.loads,
+            "hits": self.hits,
+            "evictions": self.evictions,
+        }
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> DatasetRegistry:
+    """The process-wide registry, created on first use."""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = DatasetRegistry()
+    return _registry
@@ -0,0 +1,201 @@
+import json
+import threading
+
+import duckdb
+import pandas as pd
+
+from executor import (
+    detect_column_roles,
+    resolve_rule_columns,
+    skipped_metric,
+    error_metric,
+    flagged_metric,
+    to_lean_metrics_json,
+)
+
+from parsing import DATE_FORMATS
+
+# Agent 1 writes its SQL against `transactions`, Agent 2's examples use `dataset`
+TABLE_ALIASES = ("transactions", "dataset")
+
+
+def _quote_ident(name: str) -> str:
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _normalize_sql(sql: str) -> str:
+    """Rewrites MySQL-style backtick identifiers into standard double quotes and drops a trailing ';'."""
+    out = []
+    quote = None
+    for ch in sql:
+        if quote:
+            out.append(ch)
+            if ch == quote:
+                quote = None
+        elif ch == "'":
+            quote = ch
+            out.append(ch)
+        elif ch == "`":
+            out.append('"')
+        else:
+            out.append(ch)
+    return "".join(out).strip().rstrip(";").strip()
+
+
+class DuckDBExecutor:
+    """
+    Executes Agent 2's mapped `sql_query` strings with DuckDB.
+    Mirrors PandasExecutor's interface (schema summary, per-rule execution, metrics JSON) but
+    pushes every aggregate into SQL, so the source can be a CSV/Parquet file larger than memory.
+    """
+
+    def __init__(self, source, threads: int = None):
+        """`source` is a loaded DataFrame (registered zero-copy) or a path to a .csv / .parquet file."""
+        self.con = duckdb.connect()
+        self._lock = threading.Lock()
+        if threads:
+            self.con.execute(f"SET threads = {int(threads)}")
+
+        if isinstance(source, pd.DataFrame):
+            self.con.register("_source_df", source)
+            relation = "_source_df"
+        elif str(source).lower().endswith(".parquet"):
+            relation = f"read_parquet('{str(source).replace(chr(39), chr(39) * 2)}')"
+        else:
+            relation = f"read_csv_auto('{str(source).replace(chr(39), chr(39) * 2)}')"
+
+        for alias in TABLE_ALIASES:
+            self.con.execute(f"CREATE VIEW {alias} AS SELECT * FROM {relation}")
+
+        described = self.con.execute(f"DESCRIBE {TABLE_ALIASES[0]}").fetchall()
+        self.columns = [row[0] for row in described]
+        self.column_types = {row[0]: row[1] for row in described}
+        self.total_rows = self.con.execute(f"SELECT count(*) FROM {TABLE_ALIASES[0]}").fetchone()[0]
+
+        roles = detect_column_roles(self.columns)
+        self.amount_col = roles["amount"]
+        self.date_col = roles["date"]
+        self.account_col = roles["account"]
+
+    def get_schema_summary(self):
+        """Returns standard headers and 5 sample values for Agent 2 to use in mapping."""
+        samples = {}
+        for col in self.columns:
+            q = _quote_ident(col)
+            rows = self.con.execute(
+                f"SELECT DISTINCT {q} FROM {TABLE_ALIASES[0]} WHERE {q} IS NOT NULL LIMIT 5"
+            ).fetchall()
+            samples[col] = [r[0] for r in rows]
+        return {
+            "columns": list(self.columns),
+            "sample_csv": json.dumps(samples, default=str)
+        }
+
+    def execute_mapped_query(self, mapped_query: str):
+        """
+        Runs one mapped SQL query and returns its violation count and a 5-row sample.
+        Row positions are not materialized for SQL results, so `violating_indices` is always None.
+        """
+        try:
+            if not mapped_query or str(mapped_query).strip() == "":
+                 return {"success": False, "error": "Empty query string."}
+
+            sql = _normalize_sql(mapped_query)
+            violation_count = self.con.execute(f"SELECT count(*) FROM ({sql}) AS v").fetchone()[0]
+            sample_df = self.con.execute(f"SELECT * FROM ({sql}) AS v LIMIT 5").df() if violation_count > 0 else pd.DataFrame()
+
+            return {
+                "success": True,
+                "violation_count": int(violation_count),
+                "violating_indices": None,
+                "sample_df": sample_df
+            }
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+
+    def _date_expr(self, col: str) -> str:
+        """SQL expression turning a date column into a TIMESTAMP, parsing strings if needed."""
+        q = _quote_ident(col)
+        if "TIMESTAMP" in self.column_types.get(col, "") or self.column_types.get(col) == "DATE":
+            return f"CAST({q} AS TIMESTAMP)"
+        formats = ", ".join(f"'{f}'" for f in DATE_FORMATS)
+        return f"COALESCE(TRY_CAST({q} AS TIMESTAMP), try_strptime(CAST({q} AS VARCHAR), [{formats}]))"
+
+    def _aggregate_rule(self, sql: str, amount_col, date_col, account_col):
+        """Computes count, exposure, date range, unique accounts and top offenders in SQL."""
+        result_cols = [r[0] for r in self.con.execute(f"DESCRIBE SELECT * FROM ({sql}) AS v").fetchall()]
+        selects = ["count(*)"]
+
+        has_amount = amount_col in result_cols
+        if has_amount:
+            amt = f"COALESCE(TRY_CAST({_quote_ident(amount_col)} AS DOUBLE), 0)"
+            selects += [f"sum({amt})", f"avg({amt})"]
+
+        has_date = date_col in result_cols
+        if has_date:
+            selects += [f"min({self._date_expr(date_col)})", f"max({self._date_expr(date_col)})"]
+
+        has_account = account_col in result_cols
+        if has_account:
+            selects.append(f"count(DISTINCT {_quote_ident(account_col)})")
+
+        row = list(self.con.execute(f"SELECT {', '.join(selects)} FROM ({sql}) AS v").fetchone())
+        agg = {"count": int(row.pop(0)), "total_exposure": 0, "avg_amount": 0,
+               "date_range": "N/A", "unique_accounts": 0, "top_offenders": []}
+        if agg["count"] == 0:
+            return agg
+
+        if has_amount:
+            agg["total_exposure"] = row.pop(0) or 0
+            agg["avg_amount"] = row.pop(0) or 0
+        if has_date:
+            min_date, max_date = row.pop(0), row.pop(0)
+            if min_date is not None and max_date is not None:
+                agg["date_range"] = f"{min_date.strftime('%Y-%m-%d %H:%M')} to {max_date.strftime('%Y-%m-%d %H:%M')}"
+        if has_account:
+            agg["unique_accounts"] = row.pop(0)
+            acct = _quote_ident(account_col)
+            # Ties are broken by first appearance, matching pandas' value_counts() ordering
+            top_3 = self.con.execute(
+                f"SELECT {acct}, count(*) AS n FROM (SELECT {acct}, row_number() OVER () AS rn FROM ({sql}) AS v) "
+                f"WHERE {acct} IS NOT NULL GROUP BY {acct} ORDER BY n DESC, min(rn) LIMIT 3"
+            ).fetchall()
+            agg["top_offenders"] = [f"{a} ({n} txns)" for a, n in top_3]
+        return agg
+
+    def run_all_rules_and_collect_metrics(self, rules_from_agent2):
+        """Runs Agent 3's execution loop over each rule's `sql_query` and compiles the metrics JSON."""
+        return to_lean_metrics_json([self.collect_rule_metric(rule) for rule in rules_from_agent2])
+
+    def collect_rule_metric(self, rule):
+        """Executes one mapped rule's SQL and returns its metric entry (safe to call from worker threads)."""
+        # If Agent 2 skipped it because of missing columns
+        if rule['status'] != 'READY' or not rule.get('sql_query'):
+            return skipped_metric(rule)
+
+        print(f"Agent 3: Executing mapped SQL for '{rule['title']}' (DuckDB)...")
+        rule_amount_col, rule_date_col, rule_account_col = resolve_rule_columns(rule)
+
+        try:
+            # One connection is shared; DuckDB parallelizes each query internally
+            with self._lock:
+                agg = self._aggregate_rule(
+                    _normalize_sql(rule['sql_query']),
+                    rule_amount_col or self.amount_col,
+                    rule_date_col or self.date_col,
+                    rule_account_col or self.account_col,
+                )
+        except Exception as e:
+            print(f"  [ERROR] {e}")
+            return error_metric(rule, str(e))
+
+        count = agg["count"]
+        print(f"  [SUCCESS] Found {count} violations.")
+        return flagged_metric(
+            rule, count, self.total_rows,
+            unique_accounts=agg["unique_accounts"],
+            total_exposure=agg["total_exposure"],
+            avg_amount=agg["avg_amount"],
+            date_range=agg["date_range"],
+            top_offenders=agg["top_offenders"],
+        )
@@ -1,235 +1,498 @@
+import numpy as np
 import pandas as pd
 import json
+import threading
+
+import instrumentation
+from bitmaps import RowBitmap, AccountRuleIndex
+
+from query_plan import get_plan, evaluate_operator
+from ingestion import compact_dtypes, format_memory_report
+from parsing import (
+    is_text_dtype,
+    detect_datetime_format,
+    is_amount_text,
+    parse_datetime_column,
+    parse_amount_column,
+    to_amount,
+    to_datetime,
+)
+
+
+def detect_column_roles(columns):
+    """Guesses which columns hold the transaction amount, date and account by name."""
+    roles = {"amount": None, "date": None, "account": None}
+
+    for c in columns:
+        lower_c = c.lower()
+        if 'amount' in lower_c or 'value' in lower_c or 'amt' in lower_c:
+            roles["amount"] = c
+            break
+            
+    for c in columns:
+        lower_c = c.lower()
+        if 'date' in lower_c or 'time' in lower_c or 'timestamp' in lower_c:
+            roles["date"] = c
+            break
+            
+    for c in columns:
+        lower_c = c.lower()
+        if 'account' in lower_c or 'acct' in lower_c or 'id' in lower_c:
+            roles["account"] = c
+            break
+
+    return roles
+
+
+def resolve_rule_columns(rule):
+    """Extracts Agent 2's exact amount/date/account mappings for one rule (None where unmapped)."""
+    rule_amount_col = None
+    rule_date_col = None
+    rule_account_col = None
+    
+    for mapping in rule.get('columns_remapped', []):
+        if '->' in mapping:
+            generic, actual = mapping.split('->')
+            generic, actual = generic.strip().lower(), actual.strip()
+            if generic in ['amount', 'trans_amt', 'value']:
+                rule_amount_col = actual
+            elif generic in ['timestamp', 'date', 'time']:
+                rule_date_col = actual
+            elif generic in ['sender_account', 'account', 'from_acct']:
+                rule_account_col = actual
+
+    return rule_amount_col, rule_date_col, rule_account_col
+
+
+def skipped_metric(rule):
+    """Metric entry for a rule Agent 2 skipped (e.g. because of missing columns)."""
+    return {
+        "rule_id": rule['rule_id'],
+        "title": rule['title'],
+        "severity": rule['severity'],
+        "status": "SKIPPED",
+        "violation_count": 0,
+        "total_amount_exposure": 0,
+        "sql_query": rule.get('sql_query', ''),
+        "pandas_query": rule.get('pandas_query', '')
+    }
+
+
+def error_metric(rule, error):
+    """Metric entry for a rule whose query failed to execute."""
+    return {
+        "rule_id": rule['rule_id'],
+        "title": rule['title'],
+        "severity": rule['severity'],
+        "status": "ERROR: " + error,
+        "violation_count": 0,
+        "total_amount_exposure": 0
+    }
+
+
+def compute_risk_score(severity, count, total_rows, total_exposure):
+    """Risk Score (1-10) from severity, violation share and financial exposure."""
+    base_scores = {"CRITICAL": 8, "HIGH": 5, "MEDIUM": 3, "LOW": 1}
+    risk_score = base_scores.get(severity.upper(), 1)
+    
+    if count > (total_rows * 0.1): # > 10% of total rows
+        risk_score += 1
+    if float(total_exposure) > 1000000:
+        risk_score += 1
+        
+    return min(score for score in [risk_score, 10]) # Cap at 10
+
+
+def flagged_metric(rule, count, total_rows, unique_accounts=0, total_exposure=0, avg_amount=0,
+                   date_range="N/A", top_offenders=None, sample_rows=None):
+    """Metric entry for a rule that executed successfully (FLAGGED or CLEAN)."""
+    return {
+        "rule_id": rule['rule_id'],
+        "title": rule['title'],
+        "severity": rule['severity'],
+        "status": "FLAGGED" if count > 0 else "CLEAN",
+        "risk_score": compute_risk_score(rule['severity'], count, total_rows, total_exposure),
+        "violation_count": count,
+        "unique_accounts": int(unique_accounts),
+        "total_amount_exposure": float(total_exposure),
+        "avg_amount": float(avg_amount),
+        "date_range": date_range,
+        "top_offenders": top_offenders or [],
+        "sql_query": rule.get('sql_query', ''),
+        "pandas_query": rule.get('pandas_query', ''),
+        "sample_offending_row": sample_rows or []
+    }
+
+
+_NAT = np.iinfo(np.int64).min
+
+
+def top_codes(codes: np.ndarray, n_codes: int, k: int = 3):
+    """
+    Distinct count and the k most frequent non-negative codes as [(code, count)], with ties broken
+    by first appearance in `codes` (the ordering pandas' value_counts() uses).
+    Counts with bincount when the code space is small relative to the input, np.unique otherwise.
+    """
+    codes = codes[codes >= 0]
+    if len(codes) == 0:
+        return 0, []
+    if len(codes) * 16 < n_codes:
+        uniq, inverse, counts = np.unique(codes, return_inverse=True, return_counts=True)
+        row_counts = counts[inverse]
+        count_of = lambda c: counts[np.searchsorted(uniq, c)]
+    else:
+        by_code = np.bincount(codes, minlength=n_codes)
+        row_counts = by_code[codes]
+        counts = by_code[by_code > 0]
+        count_of = lambda c: by_code[c]
+    distinct = len(counts)
+    kth = np.partition(counts, -k)[-k] if distinct > k else counts.min()
+
+    # Only accounts reaching the k-th largest count can be in the top k; order those by first appearance
+    candidates = pd.unique(codes[row_counts >= kth])
+    candidate_counts = count_of(candidates)
+    order = np.argsort(-candidate_counts, kind="stable")[:k]
+    return distinct, [(int(candidates[i]), int(candidate_counts[i])) for i in order]
+
+
+def to_lean_metrics_json(metrics):
+    """Strips bulky sample rows before sending to LLM — Agent 3 only needs aggregated metrics."""
+    lean_metrics = []
+    for m in metrics:
+        lean = {k: v for k, v in m.items() if k != 'sample_offending_row'}
+        lean_metrics.append(lean)
+    
+    return json.dumps(lean_metrics, separators=(',', ':'), default=str)
+
 
 class PandasExecutor:
     """Safely executes dynamically mapped Pandas queries against a loaded DataFrame."""
     
-    def __init__(self, df: pd.DataFrame):
+    def __init__(self, df: pd.DataFrame, column_roles: dict = None, compact: bool = True):
         self.df = df
+        self._operator_cache = {}
+        self.ingestion_report = None
+        # {column: {"kind", "format", "failures"}} for columns parsed at load time
+        self.parse_report = {}
+        # Typed (parsed) copies of columns that were not converted in place, built on first use
+        self._typed_columns = {}
+        # Compressed violating-row sets of every executed rule, by rule_id
+        self.rule_bitmaps = {}
+        # Rules may run on several threads at once (see orchestrator.py): guards the caches above,
+        # so each operator result and typed column is built once
+        self._cache_lock = threading.RLock()
         
         # Auto-fix common issues Agent 3 identified
-        self._auto_fix_dtypes()
+        with instrumentation.span("dtype_fix", rows=len(df)):
+            self._auto_fix_dtypes(column_roles, compact)
 
-    def _auto_fix_dtypes(self):
-        """Silently cast common columns to correct types for easier Pandas querying using sampling."""
+    def _auto_fix_dtypes(self, column_roles: dict = None, compact: bool = True):
+        """
+        Silently cast common columns to correct types for easier Pandas querying using sampling.
+        `column_roles` (e.g. from the dataset cache) skips re-detecting the amount/date/account columns.
+        With `compact`, every other column is then re-typed to its most compact lossless dtype
+        (see ingestion.compact_dtypes) and the memory saved is recorded in `ingestion_report`.
+        """
         # Lowercase all actual columns to find standard ones
         cols_lower = {c.lower(): c for c in self.df.columns}
-        
-        # Auto-cast known timestamp columns based on 100-row sample
-        for t_col in ['timestamp', 'date', 'time', 'trans_date', 'transaction_date']:
-            if t_col in cols_lower:
-                real_col = cols_lower[t_col]
-                if self.df[real_col].dtype == 'object':
-                    sample = self.df[real_col].dropna().head(100)
-                    if len(sample) > 0 and sample.astype(str).str.match(r'^\d{4}-\d{2}-\d{2}|\d{2}/\d{2}/\d{4}').all():
-                        try:
-                            self.df[real_col] = pd.to_datetime(self.df[real_col], errors='coerce')
-                        except (ValueError, TypeError) as e:
-                            print(f"[Warning] Failed to auto-cast {real_col} to datetime: {e}")
-        
-        # Auto-cast known amount columns based on 100-row sample
-        for a_col in ['amount', 'trans_amt', 'value', 'usd_amount', 'amount_paid']:
-            if a_col in cols_lower:
-                real_col = cols_lower[a_col]
-                if self.df[real_col].dtype == 'object':
-                    sample = self.df[real_col].dropna().head(100)
-                    if len(sample) > 0 and sample.astype(str).str.match(r'^[\$,]?\s*\d+(?:,\d{3})*(?:\.\d+)?$').all():
-                        try:
-                            self.df[real_col] = self.df[real_col].replace(r'[\$,]', '', regex=True).astype(float)
-                        except (ValueError, TypeError) as e:
-                            print(f"[Warning] Failed to auto-cast {real_col} to float: {e}")
 
         # Pre-compute Global Schema Mappings for N+1 Metrics Calculation
-        self.amount_col = None
-        self.date_col = None
-        self.account_col = None
-
-        for c in self.df.columns:
-            lower_c = c.lower()
-            if 'amount' in lower_c or 'value' in lower_c or 'amt' in lower_c:
-                self.amount_col = c
-                break
-                
-        for c in self.df.columns:
-            lower_c = c.lower()
-            if 'date' in lower_c or 'time' in lower_c or 'timestamp' in lower_c:
-                self.date_col = c
-                break
-                
-        for c in self.df.columns:
-            lower_c = c.lower()
-            if 'account' in lower_c or 'acct' in lower_c or 'id' in lower_c:
-                self.account_col = c
-                break
+        roles = column_roles or detect_column_roles(self.df.columns)
+        self.amount_col = roles["amount"]
+        self.date_col = roles["date"]
+        self.account_col = roles["account"]
+
+        # Known timestamp/amount columns are parsed once, whole-column, with a format detected from a sample
+        date_cols = [cols_lower[c] for c in ['timestamp', 'date', 'time', 'trans_date', 'transaction_date'] if c in cols_lower]
+        amount_cols = [cols_lower[c] for c in ['amount', 'trans_amt', 'value', 'usd_amount', 'amount_paid'] if c in cols_lower]
+        for real_col in dict.fromkeys(date_cols + [self.date_col]):
+            if real_col in self.df.columns and is_text_dtype(self.df[real_col]):
+                fmt = detect_datetime_format(self.df[real_col])
+                if fmt is not None:
+                    self.df[real_col], self.parse_report[real_col] = parse_datetime_column(self.df[real_col], fmt)
+        for real_col in dict.fromkeys(amount_cols + [self.amount_col]):
+            if real_col in self.df.columns and is_text_dtype(self.df[real_col]) and is_amount_text(self.df[real_col]):
+                self.df[real_col], self.parse_report[real_col] = parse_amount_column(self.df[real_col])
+
+        for real_col, report in self.parse_report.items():
+            if report["failures"]:
+                print(f"[Warning] {report['failures']} values in {real_col} could not be parsed as {report['kind']}.")
+
+        if compact:
+            self.ingestion_report = compact_dtypes(self.df, skip={self.date_col})
+            print(format_memory_report(self.ingestion_report))
+
+    def _metric_array(self, col: str, kind: str):
+        """
+        Contiguous NumPy form of a column for the metrics pass, built once per column:
+        "amount" -> float64 (missing as 0), "date" -> int64 nanoseconds (missing as _NAT),
+        "account" -> (int codes, uniques) from pd.factorize (missing as -1).
+        """
+        key = (col, "array:" + kind)
+        with self._cache_lock:
+            if key not in self._typed_columns:
+                if kind == "amount":
+                    array = self._typed_column(col, "amount").to_numpy(dtype=np.float64, na_value=0.0)
+                    array = np.nan_to_num(array, nan=0.0)
+                elif kind == "date":
+                    array = self._typed_column(col, "date").to_numpy(dtype="datetime64[ns]").view(np.int64)
+                else:
+                    array = pd.factorize(self.df[col])
+                self._typed_columns[key] = array
+            return self._typed_columns[key]
+
+    def _typed_column(self, col: str, kind: str) -> pd.Series:
+        """
+        The column as float64 amounts or datetimes. Columns still stored as text are parsed in full
+        once and cached, so rules that aggregate over them never re-parse their violating rows.
+        """
+        key = (col, kind)
+        with self._cache_lock:
+            if key not in self._typed_columns:
+                self._typed_columns[key] = to_amount(self.df[col]) if kind == "amount" else to_datetime(self.df[col])
+            return self._typed_columns[key]
+
+    def account_rule_index(self, account_col: str = None) -> AccountRuleIndex:
+        """Accounts x rules index over every rule executed so far (see bitmaps.AccountRuleIndex)."""
+        with self._cache_lock:
+            rule_bitmaps = dict(self.rule_bitmaps)
+        return AccountRuleIndex(self.df[account_col or self.account_col], rule_bitmaps)
 
     def get_schema_summary(self):
         """Returns standard headers and 5 sample values for Agent 2 to use in mapping."""
-        return {
-            "columns": list(self.df.columns),
-            "sample_csv": json.dumps({
-                col: self.df[col].dropna().unique()[:5].tolist()
-                for col in self.df.columns
-            }, default=str)
-        }
+        with instrumentation.span("schema_summary", rows=len(self.df)):
+            return {
+                "columns": list(self.df.columns),
+                "sample_csv": json.dumps({
+                    col: self.df[col].dropna().unique()[:5].tolist()
+                    for col in self.df.columns
+                }, default=str)
+            }
 
     def execute_mapped_query(self, mapped_query: str):
         """
-        Executes dynamically mapped Pandas queries safely using df.eval() rather than query() to get a boolean mask.
+        Executes one mapped Pandas query through its compiled plan to get a boolean mask.
         Returns indices of violations rather than a full copied DataFrame for memory efficiency.
         """
-        try:
-            if not mapped_query or str(mapped_query).strip() == "":
-                 return {"success": False, "error": "Empty query string."}
-                 
-            # df.eval returns a boolean mask, meaning we don't immediately copy rows.
-            mask = self.df.eval(mapped_query)
-            
-            # Count True values in mask without allocating memory
-            violation_count = mask.sum()
-            
-            # Save strictly what is needed: a small sample and the mask indices
-            if violation_count > 0:
-                sample_df = self.df[mask].head(5).copy()
-                violation_indices = mask[mask].index
-            else:
-                 sample_df = pd.DataFrame()
-                 violation_indices = pd.Index([])
-            
-            return {
-                "success": True,
-                "violation_count": int(violation_count),
-                "violating_indices": violation_indices,
-                "sample_df": sample_df
-            }
-        except Exception as e:
-            return {"success": False, "error": str(e)}
+        return self.execute_mapped_queries([mapped_query])[0]
 
-    def run_all_rules_and_collect_metrics(self, rules_from_agent2):
-        """Runs Agent 3's execution loop and compiles the metric dictionary for reporting."""
-        metrics = []
-        
-        for rule in rules_from_agent2:
-            # If Agent 2 skipped it because of missing columns
-            if rule['status'] != 'READY' or not rule['pandas_query']:
-                metrics.append({
-                    "rule_id": rule['rule_id'],
-                    "title": rule['title'],
-                    "severity": rule['severity'],
-                    "status": "SKIPPED",
-                    "violation_count": 0,
-                    "total_amount_exposure": 0,
-                    "sql_query": rule.get('sql_query', ''),
-                    "pandas_query": rule.get('pandas_query', '')
-                })
+    def execute_mapped_queries(self, mapped_queries):
+        """
+        Shared-scan batch mode: compiles every query up front (cached by normalized text, see
+        query_plan.get_plan), rejects queries with unknown columns before touching the data,
+        evaluates each distinct sub-predicate exactly once and composes the per-query masks from
+        those cached columns. Returns one result per query, in the same shape as execute_mapped_query().
+        """
+        with instrumentation.span("rule_eval", rows=len(self.df), queries=len(mapped_queries)):
+            return self._execute_batch(mapped_queries)
+
+    def _execute_batch(self, mapped_queries):
+        plans = {}
+        results = {}
+        for q in mapped_queries:
+            if q in plans or q in results:
                 continue
-                
-            print(f"Agent 3: Executing mapped query for '{rule['title']}'...")
-            result = self.execute_mapped_query(rule['pandas_query'])
-            
-            if not result["success"]:
-                 print(f"  [ERROR] {result['error']}")
-                 metrics.append({
-                    "rule_id": rule['rule_id'],
-                    "title": rule['title'],
-                    "severity": rule['severity'],
-                    "status": "ERROR: " + result["error"],
-                    "violation_count": 0,
-                    "total_amount_exposure": 0
-                })
+            if not q or str(q).strip() == "":
+                results[q] = {"success": False, "error": "Empty query string."}
+                continue
+            plan = get_plan(q)
+            missing = plan.missing_columns(self.df.columns)
+            if plan.error:
+                results[q] = {"success": False, "error": plan.error}
+            elif missing:
+                results[q] = {"success": False, "error": f"Unknown column(s): {', '.join(missing)}"}
             else:
-                count = result["violation_count"]
-                print(f"  [SUCCESS] Found {count} violations.")
-                
-                # Default generic metrics
-                unique_accounts = 0
-                total_exposure = 0
-                avg_amount = 0
-                date_range = "N/A"
-                top_offenders = []
-                
-                # Dynamically extract Agent 2's exact mappings for this specific rule
-                mapped_cols = rule.get('columns_remapped', [])
-                rule_amount_col = None
-                rule_date_col = None
-                rule_account_col = None
-                
-                for mapping in mapped_cols:
-                    if '->' in mapping:
-                        generic, actual = mapping.split('->')
-                        generic, actual = generic.strip().lower(), actual.strip()
-                        if generic in ['amount', 'trans_amt', 'value']:
-                            rule_amount_col = actual
-                        elif generic in ['timestamp', 'date', 'time']:
-                            rule_date_col = actual
-                        elif generic in ['sender_account', 'account', 'from_acct']:
-                            rule_account_col = actual
-                
-                if count > 0:
-                    indices = result["violating_indices"]
-                    sample_df = result["sample_df"]
-                    
-                    # Compute aggregations using the exact row indices on the actual mapped columns
-                    target_amount_col = rule_amount_col or self.amount_col
-                    target_date_col = rule_date_col or self.date_col
-                    target_account_col = rule_account_col or self.account_col
+                plans[q] = plan
 
-                    if target_amount_col and target_amount_col in self.df.columns:
+        # Operator columns (e.g. velocity windows) are computed once per executor and shared by all rules
+        operator_values = {}
+        operator_errors = {}
+        for plan in plans.values():
+            for var, (name, args, kwargs) in plan.operators.items():
+                if var in operator_values or var in operator_errors:
+                    continue
+                with self._cache_lock:
+                    if var not in self._operator_cache:
                         try:
-                            amounts = pd.to_numeric(self.df.loc[indices, target_amount_col], errors='coerce').fillna(0)
-                            total_exposure = amounts.sum()
-                            avg_amount = amounts.mean()
+                            with instrumentation.span("operator", operator=name, rows_scanned=len(self.df)):
+                                self._operator_cache[var] = evaluate_operator(self.df, name, args, kwargs)
                         except Exception as e:
-                            print(f"[Warning] Failed to aggregate amount column {target_amount_col}: {e}")
-                            
-                    if target_date_col and target_date_col in self.df.columns:
-                        try:
-                            dates = pd.to_datetime(self.df.loc[indices, target_date_col], errors='coerce').dropna()
-                            if not dates.empty:
-                                date_range = f"{dates.min().strftime('%Y-%m-%d %H:%M')} to {dates.max().strftime('%Y-%m-%d %H:%M')}"
-                        except Exception as e:
-                            print(f"[Warning] Failed to find date range for {target_date_col}: {e}")
-                            
-                    if target_account_col and target_account_col in self.df.columns:
-                        try:
-                            accounts = self.df.loc[indices, target_account_col]
-                            unique_accounts = accounts.nunique()
-                            top_3 = accounts.value_counts().head(3)
-                            top_offenders = [f"{acct} ({val} txns)" for acct, val in top_3.items()]
-                        except Exception as e:
-                            print(f"[Warning] Failed to extract top offenders for {target_account_col}: {e}")
-                
-                # Risk Score (1-10)
-                base_scores = {"CRITICAL": 8, "HIGH": 5, "MEDIUM": 3, "LOW": 1}
-                risk_score = base_scores.get(rule['severity'].upper(), 1)
-                
-                if count > (len(self.df) * 0.1): # > 10% of total rows
-                    risk_score += 1
-                if float(total_exposure) > 1000000:
-                    risk_score += 1
+                            operator_errors[var] = f"{name}() failed: {e}"
+                            continue
+                    operator_values[var] = self._operator_cache[var]
+
+        # Evaluate each distinct predicate once across all rules
+        pending = {}
+        leaf_errors = {}
+        for plan in plans.values():
+            for key in plan.leaves:
+                if key in pending or key in leaf_errors:
+                    continue
+                failed_ops = [operator_errors[v] for v in plan.operators if v in operator_errors and v in key]
+                if failed_ops:
+                    leaf_errors[key] = failed_ops[0]
+                else:
+                    pending[key] = plan
+        leaf_masks, errors = self._evaluate_leaves(pending, operator_values)
+        leaf_errors.update(errors)
+
+        total_leaves = sum(len(p.leaves) for p in plans.values())
+        print(f"Agent 3: Shared scan evaluated {len(leaf_masks) + len(leaf_errors)} distinct predicates for {total_leaves} predicate references.")
+
+        for q, plan in plans.items():
+            failed = [leaf_errors[key] for key in plan.leaves if key in leaf_errors]
+            if failed:
+                results[q] = {"success": False, "error": failed[0]}
+                continue
+            try:
+                results[q] = self._result_from_mask(plan.combine(leaf_masks))
+            except Exception as e:
+                results[q] = {"success": False, "error": str(e)}
+
+        return [results[q] for q in mapped_queries]
+
+    def preset_operator_values(self, values: dict):
+        """
+        Supplies operator results computed elsewhere, by operator variable (see QueryPlan.operators),
+        e.g. counts taken over a whole file when this executor only holds one chunk of it.
+        """
+        with self._cache_lock:
+            self._operator_cache.update(values)
+
+    def _evaluate_leaves(self, leaves: dict, operator_values: dict):
+        """
+        Evaluates every predicate in `leaves` ({key: plan that compiled it}) over the whole frame.
+        Returns ({key: boolean mask}, {key: error message}).
+        """
+        leaf_masks = {}
+        leaf_errors = {}
+        for key, plan in leaves.items():
+            try:
+                with instrumentation.span("predicate", predicate=key, rows_scanned=len(self.df)):
+                    leaf_masks[key] = plan.evaluate_leaf(self.df, key, operator_values)
+            except Exception as e:
+                leaf_errors[key] = f"{key}: {e}"
+        return leaf_masks, leaf_errors
+
+    def _result_from_mask(self, mask):
+        """Packages a boolean mask into the violation result dict returned by the execute_* methods."""
+        mask = mask.to_numpy(dtype=bool, na_value=False) if isinstance(mask, pd.Series) else np.asarray(mask, dtype=bool)
+
+        # Row positions double as the input for the rule's violation bitmap
+        positions = np.flatnonzero(mask)
+        violation_count = len(positions)
+        
+        # Save strictly what is needed: a small sample and the mask indices
+        if violation_count > 0:
+            sample_df = self.df.iloc[positions[:5]].copy()
+            violation_indices = self.df.index[positions]
+        else:
+             sample_df = pd.DataFrame()
+             violation_indices = pd.Index([])
+        
+        return {
+            "success": True,
+            "violation_count": int(violation_count),
+            "violating_indices": violation_indices,
+            "violating_positions": positions,
+            "sample_df": sample_df
+        }
+
+    def run_all_rules_and_collect_metrics(self, rules_from_agent2, shared_scan=True):
+        """
+        Runs Agent 3's execution loop and compiles the metric dictionary for reporting.
+        With shared_scan, all READY queries are evaluated together so common predicates are computed once.
+        """
+        with instrumentation.span("execution", rows=len(self.df), rules=len(rules_from_agent2)):
+            batch_results = {}
+            if shared_scan:
+                ready_queries = [r['pandas_query'] for r in rules_from_agent2 if r['status'] == 'READY' and r['pandas_query']]
+                batch_results = dict(zip(ready_queries, self.execute_mapped_queries(ready_queries)))
+
+            metrics = [self.collect_rule_metric(rule, batch_results.get(rule.get('pandas_query'))) for rule in rules_from_agent2]
+            with instrumentation.span("json", rules=len(metrics)):
+                return to_lean_metrics_json(metrics)
+
+    def collect_rule_metric(self, rule, result=None):
+        """
+        Executes one mapped rule (unless its `result` was already computed) and returns its metric entry.
+        Safe to call from worker threads: the DataFrame is only read and the caches are locked.
+        """
+        with instrumentation.span("rule", rule_id=rule['rule_id'], shared_scan=result is not None) as span:
+            metric = self._collect_rule_metric(rule, result)
+            span.set(status=metric["status"], violations=metric["violation_count"],
+                     rows_scanned=len(self.df) if rule['status'] == 'READY' and rule['pandas_query'] else 0)
+        return metric
+
+    def _collect_rule_metric(self, rule, result=None):
+        # If Agent 2 skipped it because of missing columns
+        if rule['status'] != 'READY' or not rule['pandas_query']:
+            return skipped_metric(rule)
+            
+        print(f"Agent 3: Executing mapped query for '{rule['title']}'...")
+        result = result or self.execute_mapped_query(rule['pandas_query'])
+        
+        if not result["success"]:
+             print(f"  [ERROR] {result['error']}")
+             return error_metric(rule, result["error"])
+
+        count = result["violation_count"]
+        bitmap = RowBitmap.from_positions(result["violating_positions"], len(self.df))
+        with self._cache_lock:
+            self.rule_bitmaps[rule['rule_id']] = bitmap
+        print(f"  [SUCCESS] Found {count} violations.")
+        
+        # Default generic metrics
+        unique_accounts = 0
+        total_exposure = 0
+        avg_amount = 0
+        date_range = "N/A"
+        top_offenders = []
+        
+        # Dynamically extract Agent 2's exact mappings for this specific rule
+        rule_amount_col, rule_date_col, rule_account_col = resolve_rule_columns(rule)
+        
+        if count > 0:
+            positions = result["violating_positions"]
+            sample_df = result["sample_df"]
+            
+            # Compute aggregations in one pass over the mask positions, on arrays prepared once per column
+            target_amount_col = rule_amount_col or self.amount_col
+            target_date_col = rule_date_col or self.date_col
+            target_account_col = rule_account_col or self.account_col
+
+            if target_amount_col and target_amount_col in self.df.columns:
+                try:
+                    amounts = self._metric_array(target_amount_col, "amount")[positions]
+                    total_exposure = amounts.sum()
+                    avg_amount = total_exposure / count
+                except Exception as e:
+                    print(f"[Warning] Failed to aggregate amount column {target_amount_col}: {e}")
+                    
+            if target_date_col and target_date_col in self.df.columns:
+                try:
+                    dates = self._metric_array(target_date_col, "date")[positions]
+                    dates = dates[dates != _NAT]
+                    if len(dates):
+                        lo, hi = pd.Timestamp(dates.min()), pd.Timestamp(dates.max())
+                        date_range = f"{lo.strftime('%Y-%m-%d %H:%M')} to {hi.strftime('%Y-%m-%d %H:%M')}"
+                except Exception as e:
+                    print(f"[Warning] Failed to find date range for {target_date_col}: {e}")
                     
-                risk_score = min(score for score in [risk_score, 10]) # Cap at 10
-
-                metrics.append({
-                    "rule_id": rule['rule_id'],
-                    "title": rule['title'],
-                    "severity": rule['severity'],
-                    "status": "FLAGGED" if count > 0 else "CLEAN",
-                    "risk_score": risk_score,
-                    "violation_count": count,
-                    "unique_accounts": int(unique_accounts),
-                    "total_amount_exposure": float(total_exposure),
-                    "avg_amount": float(avg_amount),
-                    "date_range": date_range,
-                    "top_offenders": top_offenders,
-                    "sql_query": rule.get('sql_query', ''),
-                    "pandas_query": rule.get('pandas_query', ''),
-                    "sample_offending_row": sample_df.to_dict(orient="records") if count > 0 else []
-                })
-                
-        # Strip bulky sample rows before sending to LLM — Agent 3 only needs aggregated metrics
-        lean_metrics = []
-        for m in metrics:
-            lean = {k: v for k, v in m.items() if k != 'sample_offending_row'}
-            lean_metrics.append(lean)
+            if target_account_col and target_account_col in self.df.columns:
+                try:
+                    codes, uniques = self._metric_array(target_account_col, "account")
+                    unique_accounts, top_3 = top_codes(codes[positions], len(uniques), 3)
+                    top_offenders = [f"{uniques[code]} ({val} txns)" for code, val in top_3]
+                except Exception as e:
+                    print(f"[Warning] Failed to extract top offenders for {target_account_col}: {e}")
         
-        return json.dumps(lean_metrics, separators=(',', ':'), default=str)
+        return flagged_metric(
+            rule, count, len(self.df),
+            unique_accounts=unique_accounts,
+            total_exposure=total_exposure,
+            avg_amount=avg_amount,
+            date_range=date_range,
+            top_offenders=top_offenders,
+            sample_rows=sample_df.to_dict(orient="records") if count > 0 else []
+        )
@@ -1,81 +1,321 @@
-import pandas as pd
-import numpy as np
+"""
+Synthetic AML transaction generator for tests and benchmarks.
+
+Rows are generated fully vectorized, chunk by chunk, from a seeded NumPy generator, so any row
+count (a thousand to hundreds of millions) can be written to CSV or Parquet without holding the
+dataset in memory, and the same seed and chunk size always give the same file.
+
+Known money-laundering patterns are injected at configurable rates and labeled, so rule results
+can be checked against ground truth:
+- structuring: several cash payments just under the 10,000 reporting threshold from one account within a day
+- velocity: a burst of payments from one account within an hour
+- sanctions: payments to an account on the `sanctions` reference list
+- duplicate: the same payment (accounts, amount, currency, format) repeated within minutes
+Injected rows get `is_laundering` = 1; a `<output>.labels.jsonl` sidecar (JSON lines, so the app
+never offers it as a dataset) lists each one's global row number, pattern and group, so every row
+of a group can be traced back.
+"""
+import argparse
 import os
 
-def create_mock_ibm_dataset():
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+from reference_lists import load_reference_list
+
+# Logical fields -> column names of each known dataset layout, in file order
+LAYOUTS = {
+    # The IBM AML dataset, as shipped in data/ibm_aml_sample_1000.csv
+    "ibm_aml": {
+        "timestamp": "Timestamp", "from_bank": "From Bank", "from_account": "Account",
+        "to_bank": "To Bank", "to_account": "Account.1", "amount_received": "Amount Received",
+        "receiving_currency": "Receiving Currency", "amount_paid": "Amount Paid",
+        "payment_currency": "Payment Currency", "payment_format": "Payment Format",
+        "is_laundering": "Is Laundering",
+    },
+    # The snake_case variant of the IBM schema this script used to write
+    "ibm_aml_snake": {
+        "timestamp": "timestamp", "from_bank": "from_bank", "from_account": "from_account",
+        "to_bank": "to_bank", "to_account": "to_account", "amount_paid": "amount_paid",
+        "receiving_currency": "receiving_currency", "amount_received": "amount_received",
+        "payment_format": "payment_format", "is_laundering": "is_laundering",
+    },
+    # A flat ledger export with a single currency column
+    "generic": {
+        "timestamp": "transaction_date", "from_account": "account", "to_account": "counterparty",
+        "amount_paid": "amount", "payment_currency": "currency", "payment_format": "channel",
+        "is_laundering": "is_laundering",
+    },
+}
+
+# strftime layout of the timestamp column in CSV output (Parquet keeps real timestamps)
+TIMESTAMP_FORMATS = {"ibm_aml": "%Y/%m/%d %H:%M", "ibm_aml_snake": "%Y/%m/%d %H:%M", "generic": "%Y-%m-%d %H:%M:%S"}
+
+BANKS = ["AXIS", "BARC", "BNP", "BOA", "CITI", "DB", "HDFC", "HSBC", "ICICI", "JPM", "RBC", "SBI", "TD", "UBS", "WELLS"]
+FORMATS = ["ACH", "Bitcoin", "Cash", "Cheque", "Credit Card", "Reinvestment", "Wire"]
+# Units of each currency per US dollar
+CURRENCIES = {
+    "US Dollar": 1.0, "Euro": 0.92, "British Pound": 0.79, "Swiss Franc": 0.88, "Japanese Yen": 150.0,
+    "Canadian Dollar": 1.36, "Australian Dollar": 1.52, "Indian Rupee": 83.0, "Saudi Riyal": 3.75, "UAE Dirham": 3.67,
+}
+
+# Share of all rows that belongs to each injected pattern
+DEFAULT_RATES = {"structuring": 0.002, "velocity": 0.002, "sanctions": 0.0005, "duplicate": 0.001}
+
+# Rows per injected group
+GROUP_SIZES = {"structuring": 4, "velocity": 12, "sanctions": 1, "duplicate": 2}
+
+STRUCTURING_THRESHOLD = 10_000
+STRUCTURING_MARGIN = 0.1
+
+_START = np.datetime64("2022-01-01T00:00", "m")
+_SPAN_MINUTES = 365 * 24 * 60
+
+# Account numbers are 9 digits (800000000-899999999) like the IBM sample's; codes are scattered
+# over that range by a multiplier coprime to its size, so ids look random but need no lookup table
+_ACCOUNT_BASE = 800_000_000
+_ACCOUNT_RANGE = 100_000_000
+_ACCOUNT_STRIDE = 7_368_787
+
+
+def account_ids(codes: np.ndarray) -> np.ndarray:
+    """Maps account codes (0 <= code < 10^8) to distinct 9-digit account numbers."""
+    return _ACCOUNT_BASE + (codes.astype(np.int64) * _ACCOUNT_STRIDE) % _ACCOUNT_RANGE
+
+
+def _sanctioned_accounts() -> np.ndarray:
+    try:
+        entries = load_reference_list("sanctions")
+    except (KeyError, OSError, ValueError):
+        return np.empty(0, dtype=np.int64)
+    if entries.integers is None:
+        return np.empty(0, dtype=np.int64)
+    return entries.integers.to_numpy()
+
+
+def _base_rows(rng, n: int, n_accounts: int) -> dict:
+    """Background traffic: uniformly active accounts, log-normal amounts (a quarter of them large), random formats."""
+    from_codes = rng.integers(0, n_accounts, n)
+    to_codes = (from_codes + rng.integers(1, n_accounts, n)) % n_accounts
+    large = rng.random(n) < 0.25
+    log_amounts = np.where(large, rng.normal(13.0, 0.8, n), rng.normal(8.9, 0.9, n))
+    currency_names = np.array(list(CURRENCIES))
+    rates = np.array(list(CURRENCIES.values()))
+    paid_currency = rng.integers(0, len(CURRENCIES), n)
+    received_currency = rng.integers(0, len(CURRENCIES), n)
+    return {
+        "timestamp": _START + rng.integers(0, _SPAN_MINUTES, n).astype("m8[m]"),
+        "from_code": from_codes,
+        "to_code": to_codes,
+        "amount_paid": np.round(np.exp(log_amounts), 2),
+        "paid_currency": paid_currency,
+        "received_currency": received_currency,
+        "payment_format": rng.integers(0, len(FORMATS), n),
+        "is_laundering": np.zeros(n, dtype=np.int8),
+        "to_account_override": np.zeros(n, dtype=np.int64),
+        "_currency_names": currency_names,
+        "_rates": rates,
+    }
+
+
+def _inject(rng, rows: dict, n: int, n_accounts: int, rates: dict, sanctioned: np.ndarray):
+    """Overwrites randomly chosen rows with pattern groups; returns label frames (chunk-relative row, pattern, group)."""
+    # Stochastic rounding keeps the expected share of rows exact even when a chunk holds less than one group
+    groups = {p: int(n * rate / GROUP_SIZES[p] + rng.random()) for p, rate in rates.items() if rate > 0}
+    if "sanctions" in groups and len(sanctioned) == 0:
+        groups.pop("sanctions")
+    total = sum(g * GROUP_SIZES[p] for p, g in groups.items())
+    if total > n:
+        raise ValueError(f"Pattern rates add up to more rows ({total}) than the chunk holds ({n}).")
+    chosen = rng.choice(n, total, replace=False)
+    usd, cash = list(CURRENCIES).index("US Dollar"), FORMATS.index("Cash")
+
+    labels = []
+    start = 0
+    for pattern, count in groups.items():
+        size = GROUP_SIZES[pattern]
+        idx = chosen[start:start + count * size].reshape(count, size)
+        start += count * size
+        if count == 0:
+            continue
+        base_time = _START + rng.integers(0, _SPAN_MINUTES - 24 * 60, count).astype("m8[m]")
+
+        if pattern == "structuring":
+            rows["from_code"][idx] = rng.integers(0, n_accounts, count)[:, None]
+            rows["timestamp"][idx] = base_time[:, None] + np.sort(rng.integers(0, 24 * 60 - 1, (count, size)), axis=1).astype("m8[m]")
+            low = STRUCTURING_THRESHOLD * (1 - STRUCTURING_MARGIN)
+            rows["amount_paid"][idx] = np.round(rng.uniform(low, STRUCTURING_THRESHOLD - 1, (count, size)), 2)
+            rows["paid_currency"][idx] = usd
+            rows["received_currency"][idx] = usd
+            rows["payment_format"][idx] = cash
+        elif pattern == "velocity":
+            rows["from_code"][idx] = rng.integers(0, n_accounts, count)[:, None]
+            rows["timestamp"][idx] = base_time[:, None] + np.sort(rng.integers(0, 60, (count, size)), axis=1).astype("m8[m]")
+        elif pattern == "sanctions":
+            rows["to_account_override"][idx] = sanctioned[rng.integers(0, len(sanctioned), (count, size))]
+        elif pattern == "duplicate":
+            first = idx[:, :1]
+            for field in ("from_code", "to_code", "amount_paid", "paid_currency", "received_currency", "payment_format"):
+                rows[field][idx] = rows[field][first]
+            rows["timestamp"][idx] = rows["timestamp"][first] + rng.integers(0, 30, (count, size)).astype("m8[m]")
+
+        rows["is_laundering"][idx] = 1
+        labels.append(pd.DataFrame({
+            "row": idx.ravel(),
+            "pattern": pattern,
+            "group": np.repeat(np.arange(count), size),
+        }))
+    return labels
+
+
+def generate_chunk(rows: int, chunk_index: int = 0, seed: int = 42, layout: str = "ibm_aml",
+                   n_accounts: int = None, rates: dict = None, sanctioned: np.ndarray = None):
     """
-    Since the real IBM AML dataset requires a Kaggle account to download,
-    we generate a highly faithful synthetic version that perfectly matches 
-    its exact column schema and statistical distributions for the hackathon MVP.
+    Generates one chunk of `rows` transactions as (DataFrame in `layout`, labels DataFrame with
+    chunk-relative `row`, `pattern` and `group`). Chunk i of a dataset is seeded with (seed, i).
     """
+    columns = LAYOUTS[layout]
+    rng = np.random.default_rng([seed, chunk_index])
+    n_accounts = n_accounts or max(1000, rows // 20)
+    rates = DEFAULT_RATES if rates is None else rates
+    sanctioned = _sanctioned_accounts() if sanctioned is None else sanctioned
+
+    data = _base_rows(rng, rows, n_accounts)
+    labels = _inject(rng, data, rows, n_accounts, rates, sanctioned)
+
+    from_account = account_ids(data["from_code"])
+    to_account = account_ids(data["to_code"])
+    # Background payments never hit a sanctioned account by accident, so the labels are exact
+    while True:
+        clash = np.isin(to_account, sanctioned)
+        if not clash.any():
+            break
+        to_account[clash] += 1
+    overridden = data["to_account_override"] > 0
+    to_account[overridden] = data["to_account_override"][overridden]
+
+    paid_rate = data["_rates"][data["paid_currency"]]
+    received_rate = data["_rates"][data["received_currency"]]
+    if "receiving_currency" not in columns or "payment_currency" not in columns:
+        # Layouts with a single currency column carry the payment in one currency
+        received_rate = paid_rate
+        data["received_currency"] = data["paid_currency"]
+    amount_received = np.round(data["amount_paid"] / paid_rate * received_rate, 2)
+
+    fields = {
+        "timestamp": data["timestamp"].astype("datetime64[ns]"),
+        "from_bank": pd.Categorical.from_codes(data["from_code"] % len(BANKS), BANKS),
+        "from_account": from_account,
+        "to_bank": pd.Categorical.from_codes(data["to_code"] % len(BANKS), BANKS),
+        "to_account": to_account,
+        "amount_received": amount_received,
+        "receiving_currency": pd.Categorical.from_codes(data["received_currency"], data["_currency_names"]),
+        "amount_paid": data["amount_paid"],
+        "payment_currency": pd.Categorical.from_codes(data["paid_currency"], data["_currency_names"]),
+        "payment_format": pd.Categorical.from_codes(data["payment_format"], FORMATS),
+        "is_laundering": data["is_laundering"],
+    }
+    df = pd.DataFrame({name: fields[field] for field, name in columns.items()})
+    if not labels:
+        labels = [pd.DataFrame({"row": np.empty(0, dtype=np.int64), "pattern": pd.Series(dtype=str), "group": np.empty(0, dtype=np.int64)})]
+    label_df = pd.concat(labels, ignore_index=True)
+    return df, label_df.sort_values("row", kind="stable", ignore_index=True)
+
+
+def _write_csv(table: pa.Table, path: str, timestamp_col: str, timestamp_format: str, first: bool):
+    index = table.schema.get_field_index(timestamp_col)
+    table = table.set_column(index, timestamp_col, pc.strftime(table[timestamp_col], format=timestamp_format))
+    with open(path, "wb" if first else "ab") as f:
+        if first:
+            # Unquoted, like the shipped sample files (no generated value contains a comma or quote)
+            f.write((",".join(table.column_names) + "\n").encode("utf-8"))
+        pa_csv.write_csv(table, f, pa_csv.WriteOptions(include_header=False, quoting_style="none"))
+
+
+def generate_dataset(rows: int, out_path: str, layout: str = "ibm_aml", seed: int = 42,
+                     chunk_rows: int = 1_000_000, n_accounts: int = None, rates: dict = None,
+                     labels_path: str = None) -> dict:
+    """
+    Writes `rows` synthetic transactions to `out_path` (CSV, or Parquet for .parquet/.pq) in chunks
+    of `chunk_rows`, plus the ground-truth labels to `labels_path` (default: <out_path stem>.labels.jsonl).
+    `n_accounts` defaults to one account per 20 rows; `rates` ({pattern: share of rows}) to DEFAULT_RATES.
+    Returns {"rows", "path", "labels_path", "injected": {pattern: rows}}.
+    """
+    if layout not in LAYOUTS:
+        raise ValueError(f"Unknown layout '{layout}'. Known layouts: {', '.join(LAYOUTS)}")
+    unknown = set(rates or {}) - set(GROUP_SIZES)
+    if unknown:
+        raise ValueError(f"Unknown pattern(s): {', '.join(sorted(unknown))}")
+    rates = {**DEFAULT_RATES, **(rates or {})}
+    n_accounts = n_accounts or max(1000, rows // 20)
+    parquet = out_path.lower().endswith((".parquet", ".pq"))
+    labels_path = labels_path or os.path.splitext(out_path)[0] + ".labels.jsonl"
+    sanctioned = _sanctioned_accounts()
+    timestamp_col = LAYOUTS[layout]["timestamp"]
+
+    os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+    writer = None
+    injected = {}
+    offset = 0
+    try:
+        for chunk_index, start in enumerate(range(0, rows, chunk_rows)):
+            n = min(chunk_rows, rows - start)
+            df, labels = generate_chunk(n, chunk_index, seed, layout, n_accounts, rates, sanctioned)
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if parquet:
+                writer = writer or pq.ParquetWriter(out_path, table.schema)
+                writer.write_table(table)
+            else:
+                _write_csv(table, out_path, timestamp_col, TIMESTAMP_FORMATS[layout], first=chunk_index == 0)
+
+            labels["row"] += offset
+            labels["group"] = labels["pattern"] + "-" + str(chunk_index) + "-" + labels["group"].astype(str)
+            labels.to_json(labels_path, orient="records", lines=True, mode="w" if chunk_index == 0 else "a")
+            for pattern, count in labels["pattern"].value_counts().items():
+                injected[pattern] = injected.get(pattern, 0) + int(count)
+            offset += n
+    finally:
+        if writer is not None:
+            writer.close()
+
+    return {"rows": offset, "path": out_path, "labels_path": labels_path, "injected": injected}
+
+
+def create_mock_ibm_dataset(num_records: int = 1500, out_path: str = "data/ibm_aml_sample.csv", seed: int = 42):
+    """Small IBM-layout sample for the hackathon MVP (see generate_dataset for large runs)."""
     print("Generating faithful IBM AML Schema dataset...")
-    num_records = 1500
-    
-    # EXACT IBM AML Schema Columns
-    columns = [
-        "timestamp", 
-        "from_bank", "from_account", "to_bank", "to_account", 
-        "amount_paid", "receiving_currency", "amount_received", 
-        "payment_format", "is_laundering"
-    ]
-    
-    data = []
-    
-    # Accounts
-    clean_accounts = [f"ACC_{i:04d}" for i in range(1, 500)]
-    laundry_accounts = ["BAD_001", "BAD_002", "BAD_003"]
-    all_accounts = clean_accounts + laundry_accounts
-    
-    banks = ["Bank of America", "Chase", "Wells Fargo", "HSBC", "Deutsche Bank"]
-    formats = ["Wire", "Cheque", "Credit Card", "ACH", "Cash", "Bitcoin"]
-    
-    for i in range(num_records):
-        # Time
-        ts = pd.Timestamp('2024-01-01') + pd.Timedelta(days=np.random.randint(0, 180), hours=np.random.randint(0, 24))
-        
-        # Accounts
-        sender = np.random.choice(all_accounts)
-        receiver = np.random.choice(all_accounts)
-        while sender == receiver:
-            receiver = np.random.choice(all_accounts)
-            
-        # Amounts
-        amount = round(np.random.uniform(10.0, 5000.0), 2)
-        is_laundering = 0
-        
-        # Inject Violations (Ground Truth Labeled)
-        
-        # 1. Huge Cash Transaction (> $10k)
-        if np.random.random() < 0.03:
-            amount = round(np.random.uniform(11000.0, 50000.0), 2)
-            fmt = "Cash"
-            is_laundering = 1
-        # 2. Wire Transfers to Suspicious Accounts
-        elif sender in laundry_accounts or receiver in laundry_accounts:
-            fmt = "Wire"
-            amount = round(np.random.uniform(50000.0, 250000.0), 2)
-            is_laundering = 1
-        else:
-            fmt = np.random.choice(formats)
-            
-        # Append exact schema row
-        data.append([
-            ts.strftime("%Y/%m/%d %H:%M"), 
-            np.random.choice(banks), sender, np.random.choice(banks), receiver,
-            amount, "USD", amount, 
-            fmt, is_laundering
-        ])
-        
-    df = pd.DataFrame(data, columns=columns)
-    
-    # Save
-    os.makedirs("data", exist_ok=True)
-    out_path = "data/ibm_aml_sample.csv"
-    df.to_csv(out_path, index=False)
-    
-    launder_count = df['is_laundering'].sum()
-    print(f"✅ Generated {len(df)} records at '{out_path}'")
-    print(f"✅ Injected {launder_count} ground truth laundering violations.")
+    summary = generate_dataset(num_records, out_path, layout="ibm_aml", seed=seed)
+    print(f"✅ Generated {summary['rows']} records at '{out_path}'")
+    print(f"✅ Injected {sum(summary['injected'].values())} ground truth laundering violations.")
+    return summary
+
+
+def _parse_rate(text: str):
+    pattern, _, value = text.partition("=")
+    if not value:
+        raise argparse.ArgumentTypeError(f"Expected PATTERN=RATE, got '{text}'")
+    return pattern, float(value)
+
 
 if __name__ == "__main__":
-    create_mock_ibm_dataset()
+    parser = argparse.ArgumentParser(description="Generate a synthetic AML transaction dataset with labeled patterns.")
+    parser.add_argument("--rows", type=int, default=1500)
+    parser.add_argument("--out", default="data/ibm_aml_sample.csv", help="Output file; .parquet/.pq writes Parquet, anything else CSV.")
+    parser.add_argument("--layout", choices=sorted(LAYOUTS), default="ibm_aml")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--chunk-rows", type=int, default=1_000_000)
+    parser.add_argument("--accounts", type=int, default=None, help="Number of distinct accounts (default: rows / 20).")
+    parser.add_argument("--rate", type=_parse_rate, action="append", default=[],
+                        help="Share of rows for one injected pattern, e.g. --rate velocity=0.01 (repeatable).")
+    args = parser.parse_args()
+
+    summary = generate_dataset(args.rows, args.out, layout=args.layout, seed=args.seed, chunk_rows=args.chunk_rows,
+                               n_accounts=args.accounts, rates=dict(args.rate))
+    print(f"✅ Generated {summary['rows']} records at '{summary['path']}' ({args.layout} layout)")
+    for pattern, count in sorted(summary["injected"].items()):
+        print(f"   {pattern}: {count} labeled rows")
+    print(f"✅ Labels written to '{summary['labels_path']}'")
@@ -0,0 +1,418 @@
+import hashlib
+import io
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from executor import (
+    PandasExecutor,
+    resolve_rule_columns,
+    skipped_metric,
+    error_metric,
+    flagged_metric,
+    to_lean_metrics_json,
+)
+from parsing import to_amount, to_datetime
+from operators import parse_window
+from query_plan import get_plan
+from reference_lists import reference_list_version
+
+DEFAULT_STATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "incremental")
+
+# Bump when the stored state layout changes so old states are rebuilt from scratch
+STATE_VERSION = 2
+
+# Appended rows are parsed and folded in this many at a time
+DEFAULT_CHUNKSIZE = 500_000
+
+# Only the start of the file is hashed to detect a rewritten (rather than appended) file
+_HEAD_BYTES = 1 << 16
+
+# Column added to the stored tail so its rows keep their global positions
+_POS = "__row__"
+
+
+def _head_hash(path: str, limit: int) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read(min(limit, _HEAD_BYTES))).hexdigest()
+
+
+def _reference_lists(query: str) -> list:
+    """Names of the reference lists a query's in_list() calls read."""
+    names = set()
+    for name, args, kwargs in get_plan(query).operators.values():
+        if name == "in_list":
+            names.update(value for kind, value in list(args[1:]) + [a for _, a in kwargs]
+                         if kind == "literal" and isinstance(value, str))
+    return sorted(names)
+
+
+class _ByteRange(io.RawIOBase):
+    """Read-only view of the next `length` bytes of an open binary file."""
+
+    def __init__(self, f, length: int):
+        self._f = f
+        self._remaining = length
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._f.read(min(len(buffer), self._remaining))
+        buffer[:len(data)] = data
+        self._remaining -= len(data)
+        return len(data)
+
+
+def _ruleset_fingerprint(rules) -> str:
+    # in_list rules are row-local, so their stored state is only valid for the list version it saw
+    fields = [(r.get("rule_id"), r.get("status"), r.get("pandas_query"), r.get("columns_remapped", []),
+               [(name, reference_list_version(name)) for name in _reference_lists(r.get("pandas_query") or "")])
+              for r in rules]
+    return hashlib.sha256(json.dumps(fields, default=str).encode("utf-8")).hexdigest()
+
+
+def history_window(query: str):
+    """
+    How much history a rule needs besides the new rows: None for row-local rules, a Timedelta
+    for windowed operators (the largest window/tolerance literal), or "all" for operators whose
+    result depends on every earlier row (e.g. duplicate_count without a time tolerance).
+    """
+    plan = get_plan(query)
+    window = None
+    for name, args, kwargs in plan.operators.values():
+        if name == "in_list":
+            continue
+        if name == "duplicate_count" and "time" not in dict(kwargs):
+            return "all"
+        for kind, value in list(args) + [a for _, a in kwargs]:
+            if kind == "literal" and isinstance(value, str):
+                try:
+                    delta = parse_window(value)
+                except ValueError:
+                    continue
+                window = delta if window is None else max(window, delta)
+        if window is None:
+            # Operators fall back to their default window
+            window = pd.Timedelta("24h")
+    return window
+
+
+class ExactRuleState:
+    """
+    Exactly mergeable per-rule metrics: count, exposure, date range and the violation count and
+    first position of every flagged account (so distinct accounts and top offenders stay exact).
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.amount_sum = 0.0
+        self.min_date = None
+        self.max_date = None
+        self.error = None
+        self.offenders = pd.DataFrame({"count": pd.Series(dtype=np.int64), "first_pos": pd.Series(dtype=np.int64)})
+
+    def update(self, positions, amounts=None, dates=None, accounts=None):
+        """Folds in violating rows (global positions plus their amount/date/account values)."""
+        self.count += len(positions)
+        if len(positions) == 0:
+            return
+        if amounts is not None:
+            self.amount_sum += float(to_amount(amounts).fillna(0).sum())
+        if dates is not None:
+            dates = to_datetime(dates).dropna()
+            if not dates.empty:
+                lo, hi = dates.min(), dates.max()
+                self.min_date = lo if self.min_date is None else min(self.min_date, lo)
+                self.max_date = hi if self.max_date is None else max(self.max_date, hi)
+        if accounts is not None:
+            accounts = pd.Series(np.asarray(accounts, dtype=object), index=np.asarray(positions))
+            accounts = accounts[accounts.notna()]
+            keys = accounts.map(lambda a: str(int(a)) if isinstance(a, float) and a.is_integer() else str(a))
+            batch = pd.DataFrame({"key": keys.to_numpy(), "pos": keys.index.to_numpy(dtype=np.int64)})
+            batch = batch.groupby("key", sort=False).agg(count=("pos", "size"), first_pos=("pos", "min"))
+            combined = pd.concat([self.offenders, batch])
+            self.offenders = combined.groupby(level=0, sort=False).agg({"count": "sum", "first_pos": "min"})
+
+    def to_metric(self, rule, total_rows):
+        """Renders the state as the same metric entry PandasExecutor produces."""
+        if self.error:
+            return error_metric(rule, self.error)
+        date_range = "N/A"
+        if self.min_date is not None:
+            date_range = f"{self.min_date.strftime('%Y-%m-%d %H:%M')} to {self.max_date.strftime('%Y-%m-%d %H:%M')}"
+        top = self.offenders.sort_values(["count", "first_pos"], ascending=[False, True], kind="stable").head(3)
+        return flagged_metric(
+            rule, self.count, total_rows,
+            unique_accounts=len(self.offenders),
+            total_exposure=self.amount_sum,
+            avg_amount=self.amount_sum / self.count if self.count else 0,
+            date_range=date_range,
+            top_offenders=[f"{acct} ({val} txns)" for acct, val in top["count"].items()],
+        )
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "amount_sum": self.amount_sum,
+            "min_date": self.min_date.isoformat() if self.min_date is not None else None,
+            "max_date": self.max_date.isoformat() if self.max_date is not None else None,
+            "error": self.error,
+        }
+
+    @classmethod
+    def from_dict(cls, data, offenders: pd.DataFrame):
+        state = cls()
+        state.count = data["count"]
+        state.amount_sum = data["amount_sum"]
+        state.min_date = pd.Timestamp(data["min_date"]) if data["min_date"] else None
+        state.max_date = pd.Timestamp(data["max_date"]) if data["max_date"] else None
+        state.error = data["error"]
+        state.offenders = offenders
+        return state
+
+
+class IncrementalExecutor:
+    """
+    Append-only mode: remembers a per-dataset watermark (rows and byte offset already evaluated)
+    and evaluates rules only on rows appended since, merging the deltas into stored exact
+    per-rule metrics.
+
+    Windowed rules (velocity/structuring/duplicate operators with a time window) are evaluated
+    over the new rows plus a stored tail covering the largest window, so only the affected
+    history is re-checked; tail rows that become violations through the new rows are added.
+    Rules whose operators need the whole history (duplicate_count without a tolerance) are
+    recomputed over the full file. Appended rows are read `chunksize` rows at a time, so the
+    first run over a large file never holds all of it; a windowed rule whose new rows fall
+    within a window of history already dropped from the tail (an out-of-order or back-dated
+    append) gets an ERROR status rather than silently undercounting.
+
+    State lives under `state_dir`, one folder per dataset, and is discarded when the file is
+    rewritten (its head changes or it shrinks) or the mapped rules change.
+    """
+
+    def __init__(self, csv_path: str, state_dir: str = DEFAULT_STATE_DIR, chunksize: int = DEFAULT_CHUNKSIZE):
+        self.csv_path = os.path.abspath(csv_path)
+        self.chunksize = chunksize
+        key = hashlib.sha256(self.csv_path.encode("utf-8")).hexdigest()[:16]
+        self.state_dir = os.path.join(state_dir, key)
+        os.makedirs(self.state_dir, exist_ok=True)
+
+    def get_schema_summary(self):
+        """Returns standard headers and 5 sample values (from the first rows) for Agent 2 to use in mapping."""
+        return PandasExecutor(pd.read_csv(self.csv_path, nrows=1000), compact=False).get_schema_summary()
+
+    # --- State persistence ---
+
+    def _state_path(self):
+        return os.path.join(self.state_dir, "state.json")
+
+    def _offenders_path(self, i):
+        return os.path.join(self.state_dir, f"offenders_{i}.parquet")
+
+    def _tail_path(self):
+        return os.path.join(self.state_dir, "tail.parquet")
+
+    def _load_state(self, ruleset_fp):
+        try:
+            with open(self._state_path(), encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        size = os.path.getsize(self.csv_path)
+        if (state.get("version") != STATE_VERSION or state.get("ruleset") != ruleset_fp
+                or size < state["offset"] or _head_hash(self.csv_path, state["offset"]) != state["head_hash"]):
+            return None
+        try:
+            rule_states = [ExactRuleState.from_dict(d, pd.read_parquet(self._offenders_path(i)))
+                           for i, d in enumerate(state["rules"])]
+            tail = pd.read_parquet(self._tail_path()) if os.path.exists(self._tail_path()) else None
+        except (OSError, ValueError) as e:
+            print(f"[Warning] Incremental state for {self.csv_path} is unreadable, rebuilding: {e}")
+            return None
+        return state, rule_states, tail
+
+    def _save_state(self, state, rule_states, tail):
+        for i, rule_state in enumerate(rule_states):
+            rule_state.offenders.to_parquet(self._offenders_path(i))
+        if tail is not None:
+            tail.to_parquet(self._tail_path(), index=False)
+        state["rules"] = [s.to_dict() for s in rule_states]
+        tmp = self._state_path() + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp, self._state_path())
+
+    # --- Reading ---
+
+    def _complete_end(self, offset):
+        """Byte position just after the last complete line (at least `offset`)."""
+        with open(self.csv_path, "rb") as f:
+            end = f.seek(0, os.SEEK_END)
+            while end > offset:
+                start = max(offset, end - _HEAD_BYTES)
+                f.seek(start)
+                block = f.read(end - start)
+                newline = block.rfind(b"\n")
+                if newline >= 0:
+                    return start + newline + 1
+                end = start
+        return offset
+
+    def _read_new_rows(self, offset, end, columns, first_row):
+        """Yields (DataFrame, columns) chunks parsed from the complete lines in bytes [offset, end)."""
+        with open(self.csv_path, "rb") as f:
+            f.seek(offset)
+            source = io.BufferedReader(_ByteRange(f, end - offset))
+            header = {} if offset == 0 else {"header": None, "names": columns}
+            try:
+                reader = pd.read_csv(source, chunksize=self.chunksize, **header)
+                for df in reader:
+                    columns = list(df.columns)
+                    if len(df) == 0:
+                        continue
+                    df.index = pd.RangeIndex(first_row, first_row + len(df))
+                    first_row += len(df)
+                    yield df, columns
+            except pd.errors.EmptyDataError:
+                return
+
+    # --- Execution ---
+
+    def _fold(self, rule_state, rule, executor, df, positions):
+        """Adds the violating rows at `positions` (index labels of `df`) to a rule's state."""
+        rule_amount_col, rule_date_col, rule_account_col = resolve_rule_columns(rule)
+        amount_col = rule_amount_col or executor.amount_col
+        date_col = rule_date_col or executor.date_col
+        account_col = rule_account_col or executor.account_col
+        rule_state.update(
+            positions,
+            amounts=df.loc[positions, amount_col] if amount_col in df.columns else None,
+            dates=df.loc[positions, date_col] if date_col in df.columns else None,
+            accounts=df.loc[positions, account_col] if account_col in df.columns else None,
+        )
+
+    def _recompute_full(self, rules, indices, rule_states):
+        """Evaluates the given rules over the whole file, replacing their state."""
+        df = pd.read_csv(self.csv_path)
+        executor = PandasExecutor(df, compact=False)
+        results = executor.execute_mapped_queries([rules[i]['pandas_query'] for i in indices])
+        for i, result in zip(indices, results):
+            rule_states[i] = ExactRuleState()
+            if not result["success"]:
+                rule_states[i].error = result["error"]
+                continue
+            self._fold(rule_states[i], rules[i], executor, executor.df, executor.df.index[result["violating_positions"]])
+
+    def run_all_rules_and_collect_metrics(self, rules_from_agent2):
+        """Evaluates only the rows appended since the last run and returns the lean metrics JSON for all rows."""
+        ready = [r for r in rules_from_agent2 if r['status'] == 'READY' and r['pandas_query']]
+        ruleset_fp = _ruleset_fingerprint(ready)
+
+        loaded = self._load_state(ruleset_fp)
+        if loaded is None:
+            print("Agent 3: No usable incremental state, evaluating the full file.")
+            state = {"version": STATE_VERSION, "ruleset": ruleset_fp, "offset": 0, "rows": 0,
+                     "head_hash": None, "columns": None, "dropped_max": None, "tail_flagged": [[] for _ in ready]}
+            rule_states, tail = [ExactRuleState() for _ in ready], None
+        else:
+            state, rule_states, tail = loaded
+
+        end = self._complete_end(state["offset"])
+        tail, full, appended = self._tail_frame(tail), set(), 0
+        for new_df, columns in self._read_new_rows(state["offset"], end, state["columns"], state["rows"]):
+            state["columns"] = columns
+            print(f"Agent 3: Evaluating {len(ready)} rules on {len(new_df)} appended rows (watermark: {state['rows']} rows).")
+            tail = self._evaluate_append(ready, rule_states, state, tail, new_df, full)
+            state["rows"] += len(new_df)
+            appended += len(new_df)
+        if appended:
+            if full:
+                print(f"Agent 3: {len(full)} rules need the full history, re-evaluating them over the whole file.")
+                self._recompute_full(ready, sorted(full), rule_states)
+            state["offset"] = end
+            state["head_hash"] = _head_hash(self.csv_path, state["offset"])
+            self._save_state(state, rule_states, tail.rename_axis(_POS).reset_index() if tail is not None else None)
+        else:
+            print(f"Agent 3: No new rows since the last run ({state['rows']} rows).")
+
+        metrics = []
+        by_rule = {id(r): s for r, s in zip(ready, rule_states)}
+        for rule in rules_from_agent2:
+            if id(rule) not in by_rule:
+                metrics.append(skipped_metric(rule))
+                continue
+            metric = by_rule[id(rule)].to_metric(rule, state["rows"])
+            print(f"  [{'ERROR' if by_rule[id(rule)].error else 'SUCCESS'}] {rule['title']}: {metric['violation_count']} violations.")
+            metrics.append(metric)
+        return to_lean_metrics_json(metrics)
+
+    @staticmethod
+    def _tail_frame(stored):
+        """The stored tail (global positions in a column) as a frame indexed by position."""
+        return stored.set_index(_POS).rename_axis(None) if stored is not None else None
+
+    def _evaluate_append(self, ready, rule_states, state, tail, new_df, full):
+        """
+        Folds one chunk of appended rows into the rule states. Returns the tail to carry forward;
+        indices of rules that need the whole file are added to `full`.
+        """
+        executor = PandasExecutor(new_df, compact=False)
+        windows = [history_window(r['pandas_query']) for r in ready]
+        date_col = executor.date_col
+        has_time = date_col is not None and pd.api.types.is_datetime64_any_dtype(new_df[date_col])
+
+        local = [i for i, w in enumerate(windows) if w is None]
+        tailed = [i for i, w in enumerate(windows) if w not in (None, "all") and has_time]
+        full.update(i for i in range(len(ready)) if i not in local and i not in tailed)
+
+        # Row-local rules only ever look at the new rows
+        results = executor.execute_mapped_queries([ready[i]['pandas_query'] for i in local])
+        for i, result in zip(local, results):
+            if rule_states[i].error:
+                continue
+            if not result["success"]:
+                rule_states[i].error = result["error"]
+                continue
+            self._fold(rule_states[i], ready[i], executor, new_df, new_df.index[result["violating_positions"]])
+
+        if not tailed:
+            return tail
+
+        # Windowed rules see the stored tail plus the new rows, unless the new rows reach back
+        # into history that was already dropped from the tail
+        window = max(windows[i] for i in tailed)
+        dropped_max = pd.Timestamp(state["dropped_max"]) if state.get("dropped_max") else None
+        if dropped_max is not None and (new_df[date_col].dropna() <= dropped_max + window).any():
+            for i in tailed:
+                rule_states[i].error = rule_states[i].error or (
+                    f"Rows appended to '{self.csv_path}' are not in `{date_col}` order, so windows reach rows "
+                    "already dropped from the incremental history; use an in-memory engine for windowed rules.")
+        live = [i for i in tailed if not rule_states[i].error]
+
+        frame = pd.concat([tail, new_df]) if tail is not None else new_df
+        if live:
+            frame_executor = PandasExecutor(frame, compact=False)
+            results = frame_executor.execute_mapped_queries([ready[i]['pandas_query'] for i in live])
+            for i, result in zip(live, results):
+                if not result["success"]:
+                    rule_states[i].error = result["error"]
+                    continue
+                flagged = frame.index[result["violating_positions"]].to_numpy(dtype=np.int64)
+                already = np.asarray(state["tail_flagged"][i], dtype=np.int64)
+                # New rows, plus tail rows that only became violations because of the new rows
+                fresh = flagged[(flagged >= state["rows"]) | ~np.isin(flagged, already)]
+                self._fold(rule_states[i], ready[i], frame_executor, frame, pd.Index(fresh))
+                state["tail_flagged"][i] = np.union1d(already, flagged).tolist()
+
+        # Keep just enough history for the largest window
+        keep = frame[date_col] >= frame[date_col].max() - window
+        dropped = frame.loc[~keep, date_col].max()
+        if pd.notna(dropped):
+            state["dropped_max"] = (dropped if dropped_max is None else max(dropped_max, dropped)).isoformat()
+        new_tail = frame[keep]
+        floor = int(new_tail.index.min()) if len(new_tail) else state["rows"] + len(new_df)
+        state["tail_flagged"] = [[p for p in flagged if p >= floor] for flagged in state["tail_flagged"]]
+        return new_tail
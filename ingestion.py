@@ -0,0 +1,109 @@
+import numpy as np
+import pandas as pd
+
+from parsing import is_text_dtype
+
+# String columns with at most this share of distinct values become categoricals
+CATEGORICAL_MAX_RATIO = 0.5
+
+# Identifier-like columns are dictionary-encoded whatever their cardinality
+_IDENTIFIER_HINTS = ("account", "acct", "_id", "iban", "customer", "sender", "receiver", "beneficiary")
+
+# Plain decimal integers without leading zeros (so "007" stays a string code) that fit int64
+_INTEGER_RE = r"^-?(?:0|[1-9]\d{0,17})$"
+
+
+def _memory(series: pd.Series) -> int:
+    return int(series.memory_usage(index=False, deep=True))
+
+
+def _compact_text(series: pd.Series, identifier: bool):
+    """Integer-looking identifiers become int64; other low-cardinality or identifier columns become categoricals."""
+    values = series.dropna()
+    if len(values) == 0:
+        return series
+    if identifier and not series.hasnans and values.astype(str).str.match(_INTEGER_RE).all():
+        return series.astype(np.int64)
+    if identifier or values.nunique() <= CATEGORICAL_MAX_RATIO * len(values):
+        return series.astype("category")
+    return series
+
+
+def _compact_integer(series: pd.Series):
+    """Downcasts to the smallest signed integer type holding the column's range."""
+    if len(series) == 0 or not pd.api.types.is_signed_integer_dtype(series) or isinstance(series.dtype, pd.api.extensions.ExtensionDtype):
+        return series
+    return pd.to_numeric(series, downcast="integer")
+
+
+def _compact_float(series: pd.Series):
+    """Downcasts to float32 only when every value round-trips exactly, so sums and thresholds are unchanged."""
+    if series.dtype != np.float64:
+        return series
+    values = series.to_numpy()
+    narrowed = values.astype(np.float32)
+    if np.array_equal(narrowed.astype(np.float64), values, equal_nan=True):
+        return pd.Series(narrowed, index=series.index, name=series.name)
+    return series
+
+
+def widen_numeric(value):
+    """
+    Undoes _compact_integer/_compact_float for computation: narrow signed integers become int64
+    and float32 becomes float64. Arithmetic and literal comparisons on the narrow dtypes would
+    overflow or round differently from the original column (NumPy casts Python scalars to the
+    array's dtype), so rules must always see the full-width values.
+    """
+    if not isinstance(value, pd.Series) or isinstance(value.dtype, pd.api.extensions.ExtensionDtype):
+        return value
+    if pd.api.types.is_signed_integer_dtype(value) and value.dtype != np.int64:
+        return value.astype(np.int64)
+    if value.dtype == np.float32:
+        return value.astype(np.float64)
+    return value
+
+
+def compact_dtypes(df: pd.DataFrame, skip=()) -> dict:
+    """
+    Profiles every column of `df` and re-types it in place to its most compact lossless dtype:
+    low-cardinality strings to categoricals, account identifiers to int64 or dictionary-encoded
+    codes, integers to the smallest width that fits and floats to float32 where no value changes.
+    Columns in `skip` (e.g. dates about to be parsed) are left alone. The narrow numeric dtypes
+    save memory at rest only: rule evaluation reads them through widen_numeric.
+
+    Returns a report: {"columns": {col: {"before", "after", "bytes_before", "bytes_after"}},
+    "bytes_before", "bytes_after"}.
+    """
+    report = {"columns": {}, "bytes_before": 0, "bytes_after": 0}
+    for col in df.columns:
+        series = df[col]
+        before = _memory(series)
+        compacted = series
+        if col not in skip:
+            if is_text_dtype(series):
+                identifier = any(hint in str(col).lower() for hint in _IDENTIFIER_HINTS)
+                compacted = _compact_text(series, identifier)
+            elif pd.api.types.is_integer_dtype(series):
+                compacted = _compact_integer(series)
+            elif pd.api.types.is_float_dtype(series):
+                compacted = _compact_float(series)
+
+        after = before
+        if compacted is not series:
+            df[col] = compacted
+            after = _memory(df[col])
+        report["columns"][col] = {
+            "before": str(series.dtype), "after": str(df[col].dtype),
+            "bytes_before": before, "bytes_after": after,
+        }
+        report["bytes_before"] += before
+        report["bytes_after"] += after
+    return report
+
+
+def format_memory_report(report: dict) -> str:
+    """One-line summary such as 'Ingestion: 3 columns re-typed, 12.4 MB -> 3.1 MB (4.0x smaller)'."""
+    changed = sum(1 for c in report["columns"].values() if c["before"] != c["after"])
+    before, after = report["bytes_before"] / 1e6, report["bytes_after"] / 1e6
+    ratio = report["bytes_before"] / report["bytes_after"] if report["bytes_after"] else 1.0
+    return f"Ingestion: {changed} columns re-typed, {before:.1f} MB -> {after:.1f} MB ({ratio:.1f}x smaller)"
@@ -0,0 +1,270 @@
+"""
+Run tracing for the three-agent pipeline.
+
+A Tracer records spans: named, timed sections with attributes such as rule_id, rows scanned or
+LLM token counts. Each span also gets the peak resident memory seen while it was open, sampled by
+one background thread per tracer. LLMPipeline, PandasExecutor and the app report into whichever
+tracer is active (see start_trace); with no active tracer, span() is a no-op, so library code
+can be instrumented unconditionally.
+
+The active tracer is context-local, so concurrent Streamlit sessions or batch runs each trace
+into their own run. Threads do not inherit it: work handed to a pool is submitted through
+`contextvars.copy_context().run` to keep reporting into the caller's trace.
+
+A finished run is exported as JSON lines (one span per line) and as a Prometheus textfile
+(per-stage, per-rule and per-agent gauges), both under .cache/traces/ by default.
+"""
+import contextvars
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+TRACE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "traces")
+PROMETHEUS_FILE = "compliance_pipeline.prom"
+
+# Span names exported as per-rule or per-agent metrics rather than as pipeline stages
+_DETAIL_SPANS = {"rule", "predicate", "operator", "llm"}
+
+
+def current_rss() -> int:
+    """Resident set size of this process in bytes (the lifetime peak where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # ru_maxrss is in KB on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token) for responses without usage metadata."""
+    return max(1, len(text) // 4) if text else 0
+
+
+class Span:
+    """One timed section. `attrs` holds free-form attributes; `peak_rss` is in bytes."""
+
+    def __init__(self, name: str, parent_id: str = None, attrs: dict = None):
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attrs = dict(attrs or {})
+        self.thread = threading.current_thread().name
+        self.start_time = time.time()
+        self._started = time.perf_counter()
+        self.duration = None
+        self.peak_rss = current_rss()
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def to_dict(self, trace_id: str) -> dict:
+        return {
+            "trace_id": trace_id, "span_id": self.span_id, "parent_id": self.parent_id,
+            "name": self.name, "start": round(self.start_time, 6), "duration_s": round(self.duration or 0.0, 6),
+            "peak_rss_mb": round(self.peak_rss / 2**20, 1), "thread": self.thread, **self.attrs,
+        }
+
+
+class _NoopSpan:
+    def set(self, **attrs):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+class Tracer:
+    """
+    Collects the spans of one pipeline run. Safe to use from several threads: each thread keeps
+    its own stack of open spans, so nesting (parent_id) follows the code that opened them.
+    """
+
+    def __init__(self, name: str = "pipeline_run", sample_interval: float = 0.01):
+        self.name = name
+        self.trace_id = uuid.uuid4().hex
+        self.started = time.time()
+        self.spans = []
+        self._open = set()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, args=(sample_interval,), daemon=True,
+                                         name="trace-rss-sampler")
+        self._sampler.start()
+
+    def _sample(self, interval: float):
+        while not self._stop.wait(interval):
+            rss = current_rss()
+            with self._lock:
+                for span in self._open:
+                    span.peak_rss = max(span.peak_rss, rss)
+
+    def _stack(self) -> list:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def span(self, name: str, **attrs):
+        stack = self._stack()
+        span = Span(name, stack[-1].span_id if stack else None, attrs)
+        stack.append(span)
+        with self._lock:
+            self._open.add(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.set(error=f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            span.duration = time.perf_counter() - span._started
+            span.peak_rss = max(span.peak_rss, current_rss())
+            stack.pop()
+            with self._lock:
+                self._open.discard(span)
+                self.spans.append(span)
+
+    def record(self, name: str, duration: float, **attrs) -> Span:
+        """
+        Adds an already-measured span (e.g. an LLM stream consumed across many yields, where a
+        `with` block would also time the consumer). It is parented to the calling thread's open span.
+        """
+        stack = self._stack()
+        span = Span(name, stack[-1].span_id if stack else None, attrs)
+        span.start_time -= duration
+        span.duration = duration
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+    def close(self):
+        """Stops the memory sampler; spans can still be recorded (with start/end memory only)."""
+        self._stop.set()
+
+    def records(self) -> list:
+        """Finished spans as dicts, in start order."""
+        with self._lock:
+            spans = list(self.spans)
+        return [s.to_dict(self.trace_id) for s in sorted(spans, key=lambda s: s.start_time)]
+
+    def to_jsonl(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            for record in self.records():
+                f.write(json.dumps(record, default=str) + "\n")
+
+    def to_prometheus(self, path: str):
+        """Writes the run as Prometheus text-format gauges (atomically, for a node_exporter textfile collector)."""
+        lines = []
+
+        def gauge(metric, help_text, samples):
+            if not samples:
+                return
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} gauge")
+            for labels, value in samples:
+                label_text = ",".join(f'{k}="{_escape_label(v)}"' for k, v in labels.items())
+                lines.append(f"{metric}{{{label_text}}} {float(value):.6g}" if labels else f"{metric} {float(value):.6g}")
+
+        records = self.records()
+        stages, stage_peaks = {}, {}
+        for r in records:
+            if r["name"] not in _DETAIL_SPANS:
+                stages[r["name"]] = stages.get(r["name"], 0.0) + r["duration_s"]
+                stage_peaks[r["name"]] = max(stage_peaks.get(r["name"], 0.0), r["peak_rss_mb"])
+        rules = [r for r in records if r["name"] == "rule" and "rule_id" in r]
+        llm = [r for r in records if r["name"] == "llm"]
+
+        run_seconds = max((r["start"] + r["duration_s"] for r in records), default=self.started) - self.started
+        gauge("compliance_run_seconds", "Wall time of the last pipeline run.", [({}, run_seconds)])
+        gauge("compliance_run_timestamp_seconds", "Start of the last pipeline run (Unix time).", [({}, self.started)])
+        gauge("compliance_run_peak_rss_bytes", "Peak resident memory during the last run.",
+              [({}, max((r["peak_rss_mb"] for r in records), default=0) * 2**20)])
+        gauge("compliance_stage_seconds", "Wall time per pipeline stage.", [({"stage": k}, v) for k, v in stages.items()])
+        gauge("compliance_stage_peak_rss_bytes", "Peak resident memory per pipeline stage.",
+              [({"stage": k}, v * 2**20) for k, v in stage_peaks.items()])
+        gauge("compliance_rule_seconds", "Wall time per rule (metrics aggregation, plus evaluation when not shared).",
+              [({"rule_id": r["rule_id"]}, r["duration_s"]) for r in rules])
+        gauge("compliance_rule_rows_scanned", "Rows scanned per rule.",
+              [({"rule_id": r["rule_id"]}, r["rows_scanned"]) for r in rules if r.get("rows_scanned") is not None])
+        gauge("compliance_rule_violations", "Violating rows per rule.",
+              [({"rule_id": r["rule_id"]}, r["violations"]) for r in rules if r.get("violations") is not None])
+        for field, metric, help_text in [
+            ("duration_s", "compliance_llm_seconds", "Wall time of each agent's LLM call."),
+            ("ttft_s", "compliance_llm_time_to_first_token_seconds", "Time to first streamed token per agent."),
+            ("tokens_per_second", "compliance_llm_tokens_per_second", "Output tokens per second per agent."),
+            ("prompt_chars", "compliance_llm_prompt_chars", "Prompt size in characters per agent."),
+            ("response_chars", "compliance_llm_response_chars", "Response size in characters per agent."),
+            ("output_tokens", "compliance_llm_output_tokens", "Output tokens per agent."),
+        ]:
+            gauge(metric, help_text, [({"agent": r.get("agent"), "cached": str(bool(r.get("cached"))).lower()}, r[field])
+                                      for r in llm if r.get(field) is not None])
+
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp, path)
+
+    def export(self, directory: str = TRACE_DIR) -> dict:
+        """Writes <trace_id>.jsonl and the Prometheus textfile to `directory`; returns their paths."""
+        os.makedirs(directory, exist_ok=True)
+        paths = {"jsonl": os.path.join(directory, f"{self.trace_id}.jsonl"),
+                 "prometheus": os.path.join(directory, PROMETHEUS_FILE)}
+        self.to_jsonl(paths["jsonl"])
+        self.to_prometheus(paths["prometheus"])
+        return paths
+
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# The tracer library code reports into, per context (thread, or task copied from one)
+_active = contextvars.ContextVar("active_tracer", default=None)
+
+
+def start_trace(name: str = "pipeline_run") -> Tracer:
+    """Starts a new tracer and makes it the active one in this context (closing the previous one's sampler)."""
+    previous = _active.get()
+    if previous is not None:
+        previous.close()
+    tracer = Tracer(name)
+    _active.set(tracer)
+    return tracer
+
+
+def stop_trace():
+    """Deactivates this context's tracer; returns it (or None)."""
+    tracer = _active.get()
+    _active.set(None)
+    if tracer is not None:
+        tracer.close()
+    return tracer
+
+
+def current_tracer():
+    return _active.get()
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Opens a span on the active tracer; yields a no-op span when nothing is being traced."""
+    tracer = _active.get()
+    if tracer is None:
+        yield _NOOP
+        return
+    with tracer.span(name, **attrs) as s:
+        yield s
+
+
+def record(name: str, duration: float, **attrs):
+    """Adds an already-measured span to the active tracer, if any."""
+    tracer = _active.get()
+    if tracer is not None:
+        tracer.record(name, duration, **attrs)
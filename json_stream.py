@@ -0,0 +1,66 @@
+import json
+
+
+class IncrementalJSONArrayParser:
+    """
+    Incrementally scans streamed LLM text and returns each element of the first JSON array
+    as soon as its closing brace arrives.
+
+    Works for a bare array (Agent 1's `[{...}, ...]`) and for an array nested in an object
+    (Agent 2's `{"mapped_rules": [{...}, ...]}`). Markdown fences and prose before the array
+    are skipped. Only the element currently being read is buffered, so cost is linear in the
+    length of the output.
+    """
+
+    def __init__(self):
+        self.depth = 0
+        self.array_depth = None
+        self.in_string = False
+        self.escape = False
+        self.done = False
+        self._item = None
+
+    def feed(self, text: str):
+        """Consumes one chunk of text and returns the list of elements it completed (as dicts/values)."""
+        completed = []
+        if self.done:
+            return completed
+
+        start = 0 if self._item is not None else None
+        for i, ch in enumerate(text):
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+                continue
+
+            if ch == '"':
+                self.in_string = True
+            elif ch in "[{":
+                self.depth += 1
+                if self.array_depth is None and ch == "[":
+                    self.array_depth = self.depth
+                elif self.array_depth is not None and self.depth == self.array_depth + 1 and self._item is None:
+                    self._item = []
+                    start = i
+            elif ch in "]}":
+                if self.array_depth is not None and self.depth == self.array_depth + 1 and self._item is not None:
+                    self._item.append(text[start:i + 1])
+                    raw = "".join(self._item)
+                    self._item, start = None, None
+                    try:
+                        completed.append(json.loads(raw))
+                    except json.JSONDecodeError:
+                        pass
+                elif self.array_depth is not None and self.depth == self.array_depth:
+                    self.done = True
+                    self.depth -= 1
+                    break
+                self.depth -= 1
+
+        if self._item is not None and start is not None:
+            self._item.append(text[start:])
+        return completed
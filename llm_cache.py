@@ -0,0 +1,103 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "llm")
+
+
+class LLMResponseCache:
+    """
+    Persistent content-addressed cache of LLM responses.
+
+    Entries are keyed by (model ID, prompt template version, rendered prompt hash, temperature)
+    and stored as the list of streamed text chunks, so streaming calls can be replayed chunk by
+    chunk. The directory is kept under `max_bytes` by evicting least-recently-used entries.
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_bytes: int = 256 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(model_id: str, template_version: str, prompt: str, temperature: float) -> str:
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        raw = json.dumps([model_id, template_version, prompt_hash, temperature])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key: str):
+        """Returns the cached list of text chunks, or None on a miss."""
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                entry = json.load(f)
+            # Touch the entry so eviction sees it as recently used
+            os.utime(path, None)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+            self.saved_seconds += entry.get("elapsed_seconds", 0.0)
+        return entry["chunks"]
+
+    def put(self, key: str, chunks, elapsed_seconds: float = 0.0):
+        """Stores a completed response and evicts old entries if the cache is over budget."""
+        path = self._path(key)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"created": time.time(), "elapsed_seconds": elapsed_seconds, "chunks": list(chunks)}, f)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"[Warning] Failed to write LLM cache entry: {e}")
+            return
+        self._evict()
+
+    def invalidate(self, key: str):
+        """Drops an entry, e.g. when the cached response turned out not to parse."""
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".json"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+                total -= size
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "saved_seconds": round(self.saved_seconds, 2),
+        }
@@ -1,18 +1,43 @@
 import os
 import json
-from google import genai
-from google.genai import types
+import threading
+import time
 from pydantic import BaseModel, Field
 from typing import List, Optional
 from dotenv import load_dotenv
 
 import prompts
+import instrumentation
+from llm_cache import LLMResponseCache
+from mapping_store import MappingStore
+from json_stream import IncrementalJSONArrayParser
+from reference_lists import available_reference_lists
 
 load_dotenv()
 
-client = genai.Client()
 MODEL_ID = 'gemini-3-flash-preview'
 
+# The GenAI SDK is slow to import and its client needs an API key, so both wait for the first
+# LLM call (see get_client); importing this module stays cheap. Tests replace `client` directly.
+client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """The process-wide GenAI client, created on first use."""
+    global client
+    if client is None:
+        with _client_lock:
+            if client is None:
+                from google import genai
+                client = genai.Client()
+    return client
+
+
+def _generation_config(temperature: float):
+    from google.genai import types
+    return types.GenerateContentConfig(temperature=temperature)
+
 # --- Output Schemas ---
 
 class Agent1Rule(BaseModel):
@@ -40,24 +65,117 @@ class Agent2MappedRule(BaseModel):
 class Agent2Response(BaseModel):
     mapped_rules: List[Agent2MappedRule]
 
+def _record_llm_call(template: str, prompt: str, response: str, duration: float = 0.0, ttft: float = None,
+                     usage=None, cached: bool = False):
+    """Adds an "llm" span to the active trace: timings, prompt/response sizes and token counts."""
+    prompt_tokens = getattr(usage, "prompt_token_count", None)
+    output_tokens = getattr(usage, "candidates_token_count", None)
+    estimated = output_tokens is None
+    if estimated:
+        prompt_tokens = instrumentation.estimate_tokens(prompt)
+        output_tokens = instrumentation.estimate_tokens(response)
+    generation = duration - (ttft or 0.0)
+    instrumentation.record(
+        "llm", duration, agent=template, cached=cached, ttft_s=ttft,
+        prompt_chars=len(prompt), response_chars=len(response),
+        prompt_tokens=prompt_tokens, output_tokens=output_tokens, tokens_estimated=estimated,
+        tokens_per_second=round(output_tokens / (generation if generation > 0 else duration), 1) if duration > 0 else None,
+    )
+
 # --- Pipeline Class ---
 
 class LLMPipeline:
     """The 3-Agent Orchestrator"""
-    
-    def _generate_and_parse_json(self, prompt: str, pydantic_model):
-        """Helper to yield raw stream tokens, then clean and parse the final JSON."""
-        response_stream = client.models.generate_content_stream(
+
+    def __init__(self, cache: LLMResponseCache = None, mapping_store: MappingStore = None):
+        # Identical (model, template, prompt, temperature) calls are replayed from disk
+        self.cache = cache if cache is not None else LLMResponseCache()
+        # Validated Agent 2 mappings per (rule, dataset layout)
+        self.mapping_store = mapping_store if mapping_store is not None else MappingStore()
+
+    def _cache_key(self, prompt: str, temperature: float, template: str) -> str:
+        return self.cache.make_key(MODEL_ID, prompts.PROMPT_VERSIONS[template], prompt, temperature)
+
+    def _stream_text(self, prompt: str, temperature: float, template: str):
+        """Yields response text chunks, replaying them from the cache when this exact call was seen before."""
+        key = self._cache_key(prompt, temperature, template)
+        cached = self.cache.get(key)
+        if cached is not None:
+            yield from cached
+            _record_llm_call(template, prompt, "".join(cached), cached=True)
+            return
+
+        started = time.perf_counter()
+        response_stream = get_client().models.generate_content_stream(
             model=MODEL_ID,
             contents=prompt,
-            config=types.GenerateContentConfig(temperature=0.1)
+            config=_generation_config(temperature)
         )
-        
-        full_text = ""
-        for chunk in response_stream:
-            text = chunk.text
-            full_text += text
+        chunks = []
+        # Only time spent waiting on the model counts, not the consumer's work between chunks
+        waited = 0.0
+        first_token = None
+        usage = None
+        iterator = iter(response_stream)
+        while True:
+            waiting = time.perf_counter()
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                waited += time.perf_counter() - waiting
+                break
+            waited += time.perf_counter() - waiting
+            if first_token is None:
+                first_token = waited
+            usage = getattr(chunk, "usage_metadata", None) or usage
+            text = chunk.text or ""
+            chunks.append(text)
             yield text
+        # Only completed streams are cached
+        self.cache.put(key, chunks, time.perf_counter() - started)
+        _record_llm_call(template, prompt, "".join(chunks), duration=waited, ttft=first_token, usage=usage)
+
+    def _generate_text(self, prompt: str, temperature: float, template: str) -> str:
+        """Non-streaming call through the same cache."""
+        key = self._cache_key(prompt, temperature, template)
+        cached = self.cache.get(key)
+        if cached is not None:
+            _record_llm_call(template, prompt, "".join(cached), cached=True)
+            return "".join(cached)
+
+        started = time.perf_counter()
+        response = get_client().models.generate_content(
+            model=MODEL_ID,
+            contents=prompt,
+            config=_generation_config(temperature)
+        )
+        text = response.text or ""
+        elapsed = time.perf_counter() - started
+        self.cache.put(key, [text], elapsed)
+        # A blocking call's first token arrives with the whole response
+        _record_llm_call(template, prompt, text, duration=elapsed, ttft=elapsed,
+                         usage=getattr(response, "usage_metadata", None))
+        return text
+    
+    def _generate_and_parse_json(self, prompt: str, pydantic_model, template: str, item_model=None):
+        """
+        Helper to yield raw stream tokens, then clean and parse the final JSON.
+        While streaming, each array element that validates against `item_model` is yielded
+        as ("RULE", item) the moment its closing brace arrives, so downstream stages can start early.
+        """
+        item_model = item_model or pydantic_model
+        parser = IncrementalJSONArrayParser()
+        chunks = []
+        for text in self._stream_text(prompt, 0.1, template):
+            chunks.append(text)
+            yield text
+            for raw_item in parser.feed(text):
+                try:
+                    yield ("RULE", item_model(**raw_item))
+                except Exception:
+                    # Left for the final parse below to report
+                    pass
+        full_text = "".join(chunks)
             
         # Clean markdown fences if present
         cleaned = full_text.strip()
@@ -74,40 +192,88 @@ class LLMPipeline:
                 parsed = pydantic_model(**raw_data)
             yield ("DONE", parsed)
         except json.JSONDecodeError as de:
+            # Don't keep replaying a response that cannot be parsed
+            self.cache.invalidate(self._cache_key(prompt, 0.1, template))
             yield ("ERROR", f"JSON Decode Error: {de}\n\nRAW OUTPUT:\n{full_text}")
         except Exception as e:
+            self.cache.invalidate(self._cache_key(prompt, 0.1, template))
             yield ("ERROR", f"JSON Parse/Validation failed: {e}\n\nRAW OUTPUT:\n{full_text}")
 
     def agent_1_extract_generic_rules(self, policy_text: str):
         """
         Agent 1 (Policy Interpreter) Generator:
-        Yields string tokens of the raw JSON stream from the LLM. 
-        When finished, yields a tuple ("DONE", List[Agent1Rule]).
+        Yields string tokens of the raw JSON stream from the LLM, plus a ("RULE", Agent1Rule)
+        tuple as each rule completes. When finished, yields a tuple ("DONE", List[Agent1Rule]).
         """
         prompt = prompts.AGENT_1_PROMPT.format(policy_text=policy_text)
-        yield from self._generate_and_parse_json(prompt, Agent1Rule)
+        yield from self._generate_and_parse_json(prompt, Agent1Rule, "agent_1")
 
     def agent_2_map_all_rules(self, rules: List[Agent1Rule], dataset_columns: List[str], sample_data: str):
         """
         Agent 2 (Schema Mapper) — Single batched LLM call for ALL rules.
         Returns Agent2Response directly (no streaming needed for speed).
+        Rules already mapped for this dataset layout come from the mapping store; only
+        new or changed rules are sent to the LLM.
         """
+        with instrumentation.span("agent_2", rules=len(rules)) as span:
+            status, payload = self._map_all_rules(rules, dataset_columns, sample_data)
+            span.set(status=status)
+        return status, payload
+
+    def _map_all_rules(self, rules: List[Agent1Rule], dataset_columns: List[str], sample_data: str):
+        schema_fp = MappingStore.schema_fingerprint(dataset_columns)
+        rule_fps = [MappingStore.rule_fingerprint(r) for r in rules]
+        stored = self.mapping_store.get_many(rule_fps, schema_fp, sample_data)
+        to_map = [r for r, fp in zip(rules, rule_fps) if fp not in stored]
+        print(f"Agent 2: Reusing {len(rules) - len(to_map)} stored mappings, sending {len(to_map)} rules to the LLM.")
+
+        fresh = {}
+        if to_map:
+            status, payload = self._map_rules_with_llm(to_map, dataset_columns, sample_data)
+            if status == "ERROR":
+                return (status, payload)
+
+            # Pair LLM results back to the rules that were sent, by rule_id
+            fp_by_rule_id = {}
+            for r, fp in zip(rules, rule_fps):
+                if fp not in stored:
+                    fp_by_rule_id.setdefault(r.rule_id, []).append(fp)
+            unmatched = []
+            for mapped in payload.mapped_rules:
+                candidates = fp_by_rule_id.get(mapped.rule_id)
+                if candidates:
+                    fresh[candidates.pop(0)] = mapped
+                else:
+                    unmatched.append(mapped)
+
+            self.mapping_store.put_many({
+                fp: mapped.model_dump() for fp, mapped in fresh.items()
+                if MappingStore.is_valid(mapped.model_dump(), dataset_columns)
+            }, schema_fp, sample_data)
+
+        mapped_rules = []
+        for fp in rule_fps:
+            if fp in fresh:
+                mapped_rules.append(fresh[fp])
+            elif fp in stored:
+                mapped_rules.append(Agent2MappedRule(**stored[fp]))
+        if to_map:
+            mapped_rules.extend(unmatched)
+        return ("DONE", Agent2Response(mapped_rules=mapped_rules))
+
+    def _map_rules_with_llm(self, rules: List[Agent1Rule], dataset_columns: List[str], sample_data: str):
+        """The batched Agent 2 LLM call; returns ("DONE", Agent2Response) or ("ERROR", message)."""
         rules_json = json.dumps([r.model_dump() for r in rules], indent=2)
         
         prompt = prompts.AGENT_2_PROMPT.format(
             rules_json=rules_json,
             dataset_columns=dataset_columns,
-            sample_data=sample_data
+            sample_data=sample_data,
+            reference_lists=", ".join(available_reference_lists()) or "None"
         )
         
         try:
-            response = client.models.generate_content(
-                model=MODEL_ID,
-                contents=prompt,
-                config=types.GenerateContentConfig(temperature=0.1)
-            )
-            
-            cleaned = response.text.strip()
+            cleaned = self._generate_text(prompt, 0.1, "agent_2").strip()
             if "```json" in cleaned:
                 cleaned = cleaned.split("```json")[1].split("```")[0].strip()
             elif "```" in cleaned:
@@ -120,17 +286,19 @@ class LLMPipeline:
             elif isinstance(raw_data, list):
                 raw_list = raw_data
             else:
+                self.cache.invalidate(self._cache_key(prompt, 0.1, "agent_2"))
                 return ("ERROR", f"Agent 2 unexpected format: {type(raw_data)}")
                 
             return ("DONE", Agent2Response(mapped_rules=[Agent2MappedRule(**r) for r in raw_list]))
         except Exception as e:
+            self.cache.invalidate(self._cache_key(prompt, 0.1, "agent_2"))
             return ("ERROR", f"Agent 2 mapping failed: {e}")
 
     def agent_2_map_schema_and_values(self, rules: List[Agent1Rule], dataset_columns: List[str], sample_data: str):
         """
         Agent 2 (Schema Mapper) Generator:
-        Yields string tokens of the raw JSON stream from the LLM. 
-        When finished, yields a tuple ("DONE", Agent2Response).
+        Yields string tokens of the raw JSON stream from the LLM, plus ("RULE", Agent2MappedRule)
+        tuples as each mapping completes. When finished, yields a tuple ("DONE", Agent2Response).
         """
         # Convert Pydantic rules to dicts to pass in prompt
         rules_json = json.dumps([r.model_dump() for r in rules], indent=2)
@@ -138,11 +306,12 @@ class LLMPipeline:
         prompt = prompts.AGENT_2_PROMPT.format(
             rules_json=rules_json,
             dataset_columns=dataset_columns,
-            sample_data=sample_data
+            sample_data=sample_data,
+            reference_lists=", ".join(available_reference_lists()) or "None"
         )
         
         # We need Agent2Response which wraps the list of rules
-        yield from self._generate_and_parse_json(prompt, Agent2Response)
+        yield from self._generate_and_parse_json(prompt, Agent2Response, "agent_2", item_model=Agent2MappedRule)
 
     def agent_3_generate_executive_report(self, execution_metrics_json: str) -> str:
         """
@@ -152,10 +321,4 @@ class LLMPipeline:
         prompt = prompts.AGENT_3_PROMPT.format(execution_metrics_json=execution_metrics_json)
         
         print("Agent 3: Generating Executive Report (Streaming)...")
-        response_stream = client.models.generate_content_stream(
-            model=MODEL_ID,
-            contents=prompt,
-            config=types.GenerateContentConfig(temperature=0.2)
-        )
-        for chunk in response_stream:
-            yield chunk.text
+        yield from self._stream_text(prompt, 0.2, "agent_3")
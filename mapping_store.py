@@ -0,0 +1,113 @@
+import hashlib
+import json
+import os
+import re
+import threading
+
+from query_plan import referenced_columns
+
+DEFAULT_STORE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "mappings")
+
+# Fields that define what a rule does; prose fields (description, explanation) are left out
+# so a reworded explanation doesn't invalidate an otherwise identical mapping
+_FINGERPRINT_FIELDS = ("rule_id", "title", "severity", "threshold", "logic_type", "sql_query", "pandas_query")
+
+
+def _normalize(value) -> str:
+    return re.sub(r"\s+", " ", str(value or "")).strip()
+
+
+class MappingStore:
+    """
+    Persists validated Agent 2 mappings keyed by (Agent 1 rule fingerprint, dataset schema fingerprint),
+    so rules already mapped for a known dataset layout skip the LLM entirely.
+    One JSON file per schema fingerprint holds {rule_fingerprint: mapped_rule}.
+
+    Agent 2 picks literal values (and values_remapped) from the sample it was shown, so each stored
+    mapping also keeps the sample values of the columns its query reads; it is only reused while
+    the current sample shows the same values for those columns.
+    """
+
+    def __init__(self, store_dir: str = DEFAULT_STORE_DIR):
+        self.store_dir = store_dir
+        self._lock = threading.Lock()
+        os.makedirs(self.store_dir, exist_ok=True)
+
+    @staticmethod
+    def rule_fingerprint(rule) -> str:
+        data = rule.model_dump() if hasattr(rule, "model_dump") else dict(rule)
+        normalized = [_normalize(data.get(field)) for field in _FINGERPRINT_FIELDS]
+        return hashlib.sha256(json.dumps(normalized).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def schema_fingerprint(dataset_columns) -> str:
+        return hashlib.sha256(json.dumps([str(c) for c in dataset_columns]).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def is_valid(mapped_rule: dict, dataset_columns) -> bool:
+        """Only READY mappings whose pandas_query parses and uses existing columns are worth reusing."""
+        if mapped_rule.get("status") != "READY" or not mapped_rule.get("pandas_query"):
+            return False
+        try:
+            return referenced_columns(mapped_rule["pandas_query"]) <= set(dataset_columns)
+        except (SyntaxError, ValueError):
+            return False
+
+    @staticmethod
+    def sample_vocabulary(mapped_rule: dict, sample_data: str) -> dict:
+        """{column: sorted sample values} for the columns the mapping's pandas_query reads."""
+        try:
+            sample = json.loads(sample_data)
+            columns = referenced_columns(mapped_rule.get("pandas_query") or "")
+        except (TypeError, SyntaxError, ValueError):
+            return {}
+        if not isinstance(sample, dict):
+            return {}
+        return {c: sorted(str(v) for v in sample.get(c) or []) for c in sorted(columns)}
+
+    def _path(self, schema_fp: str) -> str:
+        return os.path.join(self.store_dir, f"{schema_fp}.json")
+
+    def _load(self, schema_fp: str) -> dict:
+        try:
+            with open(self._path(schema_fp), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def get_many(self, rule_fps, schema_fp: str, sample_data: str = None) -> dict:
+        """
+        Returns {rule_fingerprint: mapped_rule_dict} for the fingerprints already stored whose
+        recorded sample values still match `sample_data` (not checked when it is None).
+        """
+        stored = self._load(schema_fp)
+        found = {}
+        for fp in rule_fps:
+            entry = dict(stored.get(fp) or {})
+            vocabulary = entry.pop("sample_values", None)
+            if not entry:
+                continue
+            if sample_data is not None and vocabulary != self.sample_vocabulary(entry, sample_data):
+                continue
+            found[fp] = entry
+        return found
+
+    def put_many(self, mappings: dict, schema_fp: str, sample_data: str = None):
+        """Adds {rule_fingerprint: mapped_rule_dict} entries for a schema, with their sample values."""
+        if not mappings:
+            return
+        with self._lock:
+            stored = self._load(schema_fp)
+            stored.update({
+                fp: dict(mapped, sample_values=self.sample_vocabulary(mapped, sample_data))
+                if sample_data is not None else mapped
+                for fp, mapped in mappings.items()
+            })
+            path = self._path(schema_fp)
+            tmp = f"{path}.{threading.get_ident()}.tmp"
+            try:
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(stored, f, indent=2)
+                os.replace(tmp, path)
+            except OSError as e:
+                print(f"[Warning] Failed to persist Agent 2 mappings: {e}")
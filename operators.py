@@ -0,0 +1,175 @@
+"""
+Vectorized operators that mapped pandas_query strings can call like functions, for rule logic
+plain comparisons cannot express on their own (e.g. `velocity_count(`Account`, `Timestamp`, '24h') > 5`).
+
+Each operator receives column arguments as Series and literal arguments as plain values, and
+returns one value per row aligned with the DataFrame. Results are cached per executor, so every
+rule that references the same call shares one computation.
+"""
+import re
+
+import numpy as np
+import pandas as pd
+
+from parsing import to_datetime
+from reference_lists import load_reference_list
+
+
+def parse_window(window) -> pd.Timedelta:
+    """Window literal such as '24h' or '7d' as a Timedelta (day units accepted in either case)."""
+    if isinstance(window, str):
+        window = re.sub(r"(?<=\d)\s*d\b", "D", window.strip())
+    return pd.Timedelta(window)
+
+
+def _to_datetime_ns(times: pd.Series) -> np.ndarray:
+    """Datetime column (or parseable strings) as int64 nanoseconds; NaT becomes INT64_MIN."""
+    if not pd.api.types.is_datetime64_any_dtype(times):
+        times = to_datetime(times)
+    return times.to_numpy(dtype="datetime64[ns]").view(np.int64)
+
+
+def rolling_window_stats(keys, times: pd.Series, window, values: pd.Series = None, centered: bool = False):
+    """
+    For every row, counts (and optionally sums `values` over) the rows with the same key whose
+    time falls in the trailing window (t - window, t], the row itself included. With
+    centered=True the window is [t - window, t + window] instead.
+
+    Runs in O(n log n) with one sort and two searchsorted calls: rows are ordered by a composite
+    int64 key (group code * stride + time) so each group occupies its own disjoint range and a
+    window lookup can never cross into a neighbouring group. Rows with a missing key or time get 0.
+    """
+    n = len(keys)
+    counts = np.zeros(n, dtype=np.int64)
+    sums = np.zeros(n, dtype=np.float64) if values is not None else None
+
+    codes, _ = pd.factorize(keys)
+    t = _to_datetime_ns(times)
+    valid = (codes >= 0) & (t != np.iinfo(np.int64).min)
+    if not valid.any():
+        return counts, sums
+
+    rows = np.flatnonzero(valid)
+    codes, t = codes[valid].astype(np.int64), t[valid]
+    t = t - t.min()
+    w = int(parse_window(window).value)
+
+    # Coarsen the time resolution only if (groups * stride) would overflow int64
+    resolution = 1
+    n_groups = int(codes.max()) + 1
+    while n_groups * (int(t.max()) // resolution + 2 * (w // resolution) + 2) >= 2 ** 62:
+        resolution *= 1000
+    t, w = t // resolution, w // resolution
+    stride = int(t.max()) + 2 * w + 1
+
+    composite = codes * stride + t
+    order = np.argsort(composite, kind="stable")
+    composite = composite[order]
+
+    if centered:
+        left = np.searchsorted(composite, composite - w, side="left")
+        right = np.searchsorted(composite, composite + w, side="right")
+    else:
+        left = np.searchsorted(composite, composite - w, side="right")
+        right = np.searchsorted(composite, composite, side="right")
+    counts[rows[order]] = right - left
+
+    if values is not None:
+        v = pd.to_numeric(values, errors='coerce').to_numpy(dtype=np.float64, na_value=0.0)[valid][order]
+        v = np.nan_to_num(v)
+        csum = np.concatenate(([0.0], np.cumsum(v)))
+        sums[rows[order]] = csum[right] - csum[left]
+
+    return counts, sums
+
+
+def velocity_count(account: pd.Series, time: pd.Series, window: str = "24h") -> np.ndarray:
+    """Number of transactions by the same account within the trailing `window` (including this one)."""
+    counts, _ = rolling_window_stats(account, time, window)
+    return counts
+
+
+def velocity_sum(account: pd.Series, time: pd.Series, amount: pd.Series, window: str = "24h") -> np.ndarray:
+    """Total `amount` moved by the same account within the trailing `window` (including this one)."""
+    _, sums = rolling_window_stats(account, time, window, values=amount)
+    return sums
+
+
+def _hash_key(columns, amount: pd.Series = None, bucket: float = None):
+    """
+    Combines the given columns (plus an optionally bucketed amount) into one uint64 hash per row.
+    Returns (hashes, valid), where rows with a missing value in any key column are not valid.
+    """
+    columns = list(columns)
+    if amount is not None:
+        amount = pd.to_numeric(amount, errors='coerce')
+        columns.append(np.floor(amount / bucket) if bucket else amount)
+
+    n = len(columns[0])
+    hashes = np.zeros(n, dtype=np.uint64)
+    valid = np.ones(n, dtype=bool)
+    for col in columns:
+        col = pd.Series(col).reset_index(drop=True)
+        valid &= col.notna().to_numpy()
+        hashes = hashes * np.uint64(0x100000001B3) ^ pd.util.hash_pandas_object(col, index=False).to_numpy()
+    return hashes, valid
+
+
+def duplicate_keys(*columns, amount: pd.Series = None, bucket: float = None):
+    """
+    The key duplicate_count() groups rows by, as (uint64 hashes, valid mask). Hashes are stable
+    across calls, so counts can be accumulated over separately read chunks of one file.
+    """
+    if not columns and amount is None:
+        raise ValueError("duplicate_count() needs at least one key column")
+    return _hash_key(columns, amount, bucket)
+
+
+def duplicate_count(*columns, amount: pd.Series = None, bucket: float = None,
+                    time: pd.Series = None, tolerance: str = None) -> np.ndarray:
+    """
+    Number of rows sharing this row's key (the row itself included), so `duplicate_count(...) >= 2`
+    flags every member of a duplicate group.
+
+    The key is a single hash over `columns`, plus `amount` (floored into `bucket`-sized buckets when
+    given). With `time` and `tolerance`, rows only match when they are at most `tolerance` apart.
+    Without a time tolerance groups are found with one hash-table pass, so cost is linear in rows.
+    """
+    hashes, valid = duplicate_keys(*columns, amount=amount, bucket=bucket)
+    counts = np.zeros(len(hashes), dtype=np.int64)
+
+    if time is not None:
+        keys = pd.arrays.IntegerArray(hashes, ~valid)
+        counts, _ = rolling_window_stats(keys, time, tolerance or "0s", centered=True)
+        return counts
+
+    codes, uniques = pd.factorize(hashes[valid])
+    counts[valid] = np.bincount(codes, minlength=len(uniques))[codes]
+    return counts
+
+
+def structuring_count(account: pd.Series, time: pd.Series, amount: pd.Series, threshold: float = 10000,
+                      margin: float = 0.1, window: str = "24h") -> np.ndarray:
+    """
+    Number of payments by the same account within the trailing `window` whose amount falls just
+    under `threshold` (in [threshold * (1 - margin), threshold)), this row included if it does.
+    """
+    amount = pd.to_numeric(amount, errors='coerce')
+    near = ((amount >= threshold * (1 - margin)) & (amount < threshold)).astype(np.float64)
+    _, sums = rolling_window_stats(account, time, window, values=near)
+    return sums.astype(np.int64)
+
+
+def in_list(column: pd.Series, name: str) -> np.ndarray:
+    """True where the value is on the named reference list (see reference_lists.py), e.g. `in_list(`Account.1`, 'sanctions')`."""
+    return load_reference_list(name).contains(column)
+
+
+# Operator names recognised inside pandas_query strings
+OPERATORS = {
+    "velocity_count": velocity_count,
+    "velocity_sum": velocity_sum,
+    "duplicate_count": duplicate_count,
+    "structuring_count": structuring_count,
+    "in_list": in_list,
+}
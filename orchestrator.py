@@ -0,0 +1,191 @@
+import contextvars
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from executor import to_lean_metrics_json
+
+
+class PipelineOrchestrator:
+    """
+    Overlaps the three agents instead of running them back to back.
+
+    Agent 1 streams in the caller's thread; every `map_batch_size` extracted rules are sent to
+    Agent 2 as a small mapping request on a bounded pool, and each mapped batch is executed right
+    away on an execution pool, through one shared scan (execute_mapped_queries) where the
+    executor has one. Workers report back through a bounded event queue, so wall-clock time
+    approaches the slowest stage rather than the sum of all three.
+
+    `run()` is a generator of (event, payload) tuples, usable from Streamlit or headless:
+        ("TEXT", str)            raw Agent 1 tokens for live display
+        ("EXTRACTED", Agent1Rule)
+        ("MAPPED", dict)         one Agent 2 mapped rule (model_dump)
+        ("EXECUTED", dict)       one rule's metric entry
+        ("ERROR", str)
+        ("DONE", dict)           {"agent_1_rules", "mapped_rules", "metrics", "metrics_json", "errors"}
+    """
+
+    def __init__(self, pipeline, executor, map_batch_size: int = 4, max_concurrent_mappings: int = 4,
+                 execution_workers: int = 4, queue_size: int = 256):
+        self.pipeline = pipeline
+        self.executor = executor
+        self.map_batch_size = map_batch_size
+        self.max_concurrent_mappings = max_concurrent_mappings
+        self.execution_workers = execution_workers
+        self.queue_size = queue_size
+
+    def run(self, policy_text: str, dataset_columns, sample_data: str):
+        events = queue.Queue(maxsize=self.queue_size)
+        # [(future, what it was doing)]; futures that raised are reported as ERROR events
+        pending = []
+        reported = set()
+        pending_lock = threading.Lock()
+        stopped = threading.Event()
+        per_rule = hasattr(self.executor, "collect_rule_metric")
+        shared_scan = hasattr(self.executor, "execute_mapped_queries")
+
+        map_pool = ThreadPoolExecutor(max_workers=self.max_concurrent_mappings, thread_name_prefix="agent2")
+        exec_pool = ThreadPoolExecutor(max_workers=self.execution_workers, thread_name_prefix="agent3")
+
+        def track(future, description):
+            with pending_lock:
+                pending.append((future, description))
+
+        def emit(item):
+            # Once the caller has stopped listening, events are dropped instead of blocking on a full queue
+            while not stopped.is_set():
+                try:
+                    events.put(item, timeout=0.05)
+                    return
+                except queue.Full:
+                    continue
+
+        def execute(batch):
+            # One shared scan per mapped batch, so common predicates and operators are evaluated once
+            results = {}
+            if shared_scan:
+                queries = [m['pandas_query'] for _, m in batch if m.get('status') == 'READY' and m.get('pandas_query')]
+                results = dict(zip(queries, self.executor.execute_mapped_queries(queries)))
+            for order, mapped in batch:
+                try:
+                    result = results.get(mapped.get('pandas_query'))
+                    metric = self.executor.collect_rule_metric(mapped, result) if shared_scan else \
+                        self.executor.collect_rule_metric(mapped)
+                    emit(("EXECUTED", (order, metric)))
+                except Exception as e:
+                    emit(("ERROR", f"Execution failed for '{mapped.get('title')}': {e}"))
+
+        def map_batch(first_order, batch):
+            status, payload = self.pipeline.agent_2_map_all_rules(batch, dataset_columns, sample_data)
+            if status == "ERROR":
+                emit(("ERROR", payload))
+                return
+            mapped_batch = []
+            for offset, mapped in enumerate(payload.mapped_rules):
+                order = (first_order, offset)
+                mapped = mapped.model_dump()
+                emit(("MAPPED", (order, mapped)))
+                mapped_batch.append((order, mapped))
+            if per_rule and mapped_batch:
+                titles = ", ".join(f"'{m.get('title')}'" for _, m in mapped_batch)
+                track(exec_pool.submit(contextvars.copy_context().run, execute, mapped_batch),
+                      f"Execution failed for {titles}")
+
+        def submit_batch(batch):
+            rule_ids = ", ".join(str(r.rule_id) for r in batch)
+            track(map_pool.submit(contextvars.copy_context().run, map_batch, len(agent_1_rules) - len(batch), list(batch)),
+                  f"Agent 2 mapping failed for {rule_ids}")
+            batch.clear()
+
+        agent_1_rules = []
+        mapped_rules = {}
+        metrics = {}
+        errors = []
+
+        def failures():
+            """ERROR events for finished futures that raised, each reported once."""
+            with pending_lock:
+                failed = [(f, d) for f, d in pending if f.done() and not f.cancelled() and f.exception() and f not in reported]
+                reported.update(f for f, _ in failed)
+            for future, description in failed:
+                message = f"{description}: {future.exception()}"
+                errors.append(message)
+                yield ("ERROR", message)
+
+        def drain(block=False):
+            """Moves worker events to the caller; with block=True waits until all work is finished."""
+            while True:
+                try:
+                    event, payload = events.get(timeout=0.05) if block else events.get_nowait()
+                except queue.Empty:
+                    yield from failures()
+                    if not block:
+                        return
+                    with pending_lock:
+                        finished = all(f.done() for f, _ in pending) and events.empty()
+                    if finished:
+                        yield from failures()
+                        return
+                    continue
+                if event == "MAPPED":
+                    mapped_rules[payload[0]] = payload[1]
+                    yield ("MAPPED", payload[1])
+                elif event == "EXECUTED":
+                    metrics[payload[0]] = payload[1]
+                    yield ("EXECUTED", payload[1])
+                else:
+                    errors.append(payload)
+                    yield (event, payload)
+
+        try:
+            batch = []
+            for chunk in self.pipeline.agent_1_extract_generic_rules(policy_text):
+                if not isinstance(chunk, tuple):
+                    yield ("TEXT", chunk)
+                elif chunk[0] == "RULE":
+                    agent_1_rules.append(chunk[1])
+                    batch.append(chunk[1])
+                    yield ("EXTRACTED", chunk[1])
+                    if len(batch) >= self.map_batch_size:
+                        submit_batch(batch)
+                elif chunk[0] == "ERROR":
+                    yield ("ERROR", chunk[1])
+                    return
+                elif chunk[0] == "DONE" and len(chunk[1]) != len(agent_1_rules):
+                    # Some rules only validated in the final parse; map whatever was not streamed
+                    streamed_ids = [r.rule_id for r in agent_1_rules]
+                    for rule in chunk[1]:
+                        if rule.rule_id in streamed_ids:
+                            streamed_ids.remove(rule.rule_id)
+                            continue
+                        agent_1_rules.append(rule)
+                        batch.append(rule)
+                        yield ("EXTRACTED", rule)
+                yield from drain()
+            if batch:
+                submit_batch(batch)
+
+            yield from drain(block=True)
+        finally:
+            # Normally every future is done by now; if the caller stopped early (or Agent 1 failed),
+            # queued work is cancelled and running workers are not waited for
+            stopped.set()
+            map_pool.shutdown(wait=False, cancel_futures=True)
+            exec_pool.shutdown(wait=False, cancel_futures=True)
+
+        ordered_mapped = [mapped_rules[k] for k in sorted(mapped_rules)]
+        if per_rule:
+            ordered_metrics = [metrics[k] for k in sorted(metrics)]
+            metrics_json = to_lean_metrics_json(ordered_metrics)
+        else:
+            # Executors without per-rule execution (e.g. chunked) run once all rules are mapped
+            metrics_json = self.executor.run_all_rules_and_collect_metrics(ordered_mapped)
+            ordered_metrics = None
+
+        yield ("DONE", {
+            "agent_1_rules": agent_1_rules,
+            "mapped_rules": ordered_mapped,
+            "metrics": ordered_metrics,
+            "metrics_json": metrics_json,
+            "errors": errors,
+        })
@@ -0,0 +1,253 @@
+"""
+Multi-core rule evaluation for PandasExecutor.
+
+The columns (and operator results) a batch of rules reads are copied once into shared memory;
+worker processes attach to those blocks and evaluate the compiled predicates over contiguous row
+shards without receiving pickled copies of the data. Each worker returns its shard's leaf masks
+bit-packed, and the parent stitches them back into full-length masks, so everything downstream
+(rule composition, bitmaps, metrics) runs exactly as in the serial executor and produces the
+same metrics JSON.
+"""
+import multiprocessing
+import os
+import threading
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from executor import PandasExecutor
+from parsing import is_text_dtype
+from query_plan import get_plan
+
+# Frames with fewer rows per worker than this are evaluated serially (process start-up would dominate)
+MIN_SHARD_ROWS = 250_000
+
+# Workers are started with "spawn" so the pool is safe to create from threaded hosts such as Streamlit
+_START_METHOD = "spawn"
+
+_MASKED_ARRAYS = (pd.arrays.IntegerArray, pd.arrays.FloatingArray, pd.arrays.BooleanArray)
+
+
+class _SharedColumn:
+    """
+    One column copied into shared memory. `spec` is the small picklable description workers
+    use to rebuild a zero-copy view of it: {"layout", "dtype", "buffers": [(name, dtype, length)]}.
+    """
+
+    def __init__(self, layout: str, dtype, arrays: list, meta=None):
+        self.blocks = []
+        buffers = []
+        for array in arrays:
+            array = np.ascontiguousarray(array)
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[:] = array
+            self.blocks.append(block)
+            buffers.append((block.name, array.dtype.str, len(array)))
+        self.spec = {"layout": layout, "dtype": dtype, "buffers": buffers, "meta": meta}
+
+    def release(self):
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+
+def share_series(series: pd.Series):
+    """
+    Copies a column into shared memory; returns a _SharedColumn, or None for dtypes that have no
+    flat buffer layout (e.g. object columns mixing strings and numbers).
+
+    Layouts: "numpy" (plain NumPy dtypes), "datetimetz" (UTC int64 plus the zone), "masked"
+    (nullable Int/Float/boolean: values plus a missing mask), "category" (codes; the categories
+    travel with the dtype) and "string" (Arrow large_string offsets, bytes and validity).
+    """
+    dtype = series.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        return _SharedColumn("category", dtype, [series.cat.codes.to_numpy()])
+    if isinstance(dtype, pd.DatetimeTZDtype):
+        utc = series.dt.tz_convert("UTC").dt.tz_localize(None).to_numpy()
+        return _SharedColumn("datetimetz", dtype, [utc.view(np.int64)], meta=str(utc.dtype))
+    if isinstance(series.array, _MASKED_ARRAYS):
+        values = series.array.to_numpy(dtype=dtype.numpy_dtype, na_value=dtype.numpy_dtype.type(0))
+        return _SharedColumn("masked", dtype, [values, series.isna().to_numpy()])
+    if isinstance(dtype, np.dtype) and dtype.kind in "biufcmM":
+        return _SharedColumn("numpy", dtype, [series.to_numpy()])
+    if is_text_dtype(series):
+        try:
+            array = pa.array(series, type=pa.large_string(), from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            return None
+        validity, offsets, data = array.buffers()
+        arrays = [np.frombuffer(offsets, dtype=np.int64, count=len(array) + 1),
+                  np.frombuffer(data, dtype=np.uint8) if data is not None else np.empty(0, dtype=np.uint8)]
+        if validity is not None:
+            arrays.append(np.frombuffer(validity, dtype=np.uint8, count=-(-len(array) // 8)))
+        return _SharedColumn("string", dtype, arrays, meta=len(array))
+    return None
+
+
+# Worker-side state: shared blocks this process has attached to, by block name
+_ATTACHED = {}
+
+
+def _attach(name: str, dtype: str, length: int) -> np.ndarray:
+    if name not in _ATTACHED:
+        block = shared_memory.SharedMemory(name=name)
+        _ATTACHED[name] = (block, np.ndarray((length,), dtype=np.dtype(dtype), buffer=block.buf))
+    return _ATTACHED[name][1]
+
+
+def _column_view(spec: dict, start: int, stop: int) -> pd.Series:
+    """Rebuilds rows [start, stop) of a shared column as a Series with its original dtype."""
+    arrays = [_attach(*buffer) for buffer in spec["buffers"]]
+    layout, dtype = spec["layout"], spec["dtype"]
+    index = pd.RangeIndex(start, stop)
+    if layout == "numpy":
+        return pd.Series(arrays[0][start:stop], index=index, dtype=dtype, copy=False)
+    if layout == "category":
+        return pd.Series(pd.Categorical.from_codes(arrays[0][start:stop], dtype=dtype), index=index)
+    if layout == "datetimetz":
+        utc = pd.Series(arrays[0][start:stop].view(spec["meta"]), index=index, copy=False)
+        return utc.dt.tz_localize("UTC").dt.tz_convert(dtype.tz)
+    if layout == "masked":
+        array_type = {"b": pd.arrays.BooleanArray, "f": pd.arrays.FloatingArray}.get(dtype.kind, pd.arrays.IntegerArray)
+        return pd.Series(array_type(arrays[0][start:stop], arrays[1][start:stop]), index=index)
+    offsets, data = pa.py_buffer(arrays[0]), pa.py_buffer(arrays[1])
+    validity = pa.py_buffer(arrays[2]) if len(arrays) > 2 else None
+    strings = pa.LargeStringArray.from_buffers(spec["meta"], offsets, data, validity).slice(start, stop - start)
+    return pd.Series(strings, index=index, dtype=dtype)
+
+
+def _evaluate_shard(start: int, stop: int, columns: dict, operators: dict, leaves: list) -> dict:
+    """
+    Worker entry point: evaluates `leaves` ([(query, [leaf keys])]) on rows [start, stop).
+    Returns {key: bit-packed mask} or {key: ("error", message)} per leaf.
+    """
+    df = pd.DataFrame({col: _column_view(spec, start, stop) for col, spec in columns.items()}, copy=False)
+    operator_values = {var: _attach(*spec["buffers"][0])[start:stop] for var, spec in operators.items()}
+    results = {}
+    for query, keys in leaves:
+        plan = get_plan(query)
+        for key in keys:
+            try:
+                results[key] = np.packbits(plan.evaluate_leaf(df, key, operator_values))
+            except Exception as e:
+                results[key] = ("error", f"{key}: {e}")
+    return results
+
+
+def _release(shared: dict, pool_holder: list):
+    for column in shared.values():
+        if column is not None:
+            column.release()
+    shared.clear()
+    if pool_holder:
+        pool_holder.pop().shutdown(wait=False, cancel_futures=True)
+
+
+class ParallelExecutor(PandasExecutor):
+    """
+    PandasExecutor that evaluates rule predicates across `n_workers` processes.
+
+    Rows are split into one contiguous shard per worker (boundaries on multiples of 8, so packed
+    masks concatenate directly). Window operators (velocity, duplicates, structuring) still run
+    once over the whole frame in this process, since their windows cross shard boundaries; their
+    results are shared with the workers like ordinary columns. Leaves that read a column with no
+    shareable layout are evaluated here serially.
+
+    Call close() (or use the executor as a context manager) to stop the workers and free the
+    shared memory; it is also released when the executor is garbage collected.
+    """
+
+    def __init__(self, df: pd.DataFrame, column_roles: dict = None, compact: bool = True,
+                 n_workers: int = None, min_shard_rows: int = MIN_SHARD_ROWS):
+        super().__init__(df, column_roles, compact)
+        self.n_workers = n_workers or os.cpu_count() or 1
+        self.min_shard_rows = min_shard_rows
+        # Shared copies of columns and operator results, by column name or operator variable (None: not shareable)
+        self._shared = {}
+        self._pool_holder = []
+        # Rules may be evaluated from several threads (e.g. the orchestrator's execution pool);
+        # guards creating the pool and each shared segment exactly once
+        self._share_lock = threading.Lock()
+        self._finalizer = weakref.finalize(self, _release, self._shared, self._pool_holder)
+
+    def close(self):
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _pool(self) -> ProcessPoolExecutor:
+        with self._share_lock:
+            if not self._pool_holder:
+                context = multiprocessing.get_context(_START_METHOD)
+                self._pool_holder.append(ProcessPoolExecutor(max_workers=self.n_workers, mp_context=context))
+            return self._pool_holder[0]
+
+    def _shards(self) -> list:
+        """[(start, stop)] row ranges, one per worker, each holding at least min_shard_rows rows."""
+        n = len(self.df)
+        count = max(1, min(self.n_workers, n // max(self.min_shard_rows, 1)))
+        bounds = [min(n, (n * i // count) // 8 * 8) for i in range(count)] + [n]
+        return [(lo, hi) for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
+
+    def _share(self, key, values):
+        with self._share_lock:
+            if key not in self._shared:
+                if isinstance(values, np.ndarray):
+                    self._shared[key] = _SharedColumn("numpy", values.dtype, [values]) if values.dtype.kind in "biufcmM" else None
+                else:
+                    self._shared[key] = share_series(values)
+            column = self._shared[key]
+        return column.spec if column is not None else None
+
+    def _evaluate_leaves(self, leaves: dict, operator_values: dict):
+        shards = self._shards()
+        if len(shards) < 2 or not leaves:
+            return super()._evaluate_leaves(leaves, operator_values)
+
+        serial = {}
+        by_query = {}
+        columns, operators = {}, {}
+        for key, plan in leaves.items():
+            specs = {col: self._share(col, self.df[col]) for col in plan.columns}
+            op_specs = {var: self._share(("op", var), operator_values[var]) for var in plan.operators if var in key}
+            if any(spec is None for spec in list(specs.values()) + list(op_specs.values())):
+                serial[key] = plan
+                continue
+            columns.update(specs)
+            operators.update(op_specs)
+            by_query.setdefault(plan.query, []).append(key)
+
+        leaf_masks, leaf_errors = super()._evaluate_leaves(serial, operator_values) if serial else ({}, {})
+        if not by_query:
+            return leaf_masks, leaf_errors
+
+        tasks = list(by_query.items())
+        try:
+            futures = [self._pool().submit(_evaluate_shard, lo, hi, columns, operators, tasks) for lo, hi in shards]
+            shard_results = [future.result() for future in futures]
+        except Exception as e:
+            print(f"[Warning] Parallel evaluation failed ({e}); evaluating serially.")
+            pending = {key: leaves[key] for keys in by_query.values() for key in keys}
+            masks, errors = super()._evaluate_leaves(pending, operator_values)
+            return {**leaf_masks, **masks}, {**leaf_errors, **errors}
+
+        n = len(self.df)
+        for keys in by_query.values():
+            for key in keys:
+                parts = [result[key] for result in shard_results]
+                failed = [part[1] for part in parts if isinstance(part, tuple)]
+                if failed:
+                    leaf_errors[key] = failed[0]
+                else:
+                    leaf_masks[key] = np.unpackbits(np.concatenate(parts), count=n).view(bool)
+        return leaf_masks, leaf_errors
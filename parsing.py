@@ -0,0 +1,96 @@
+import re
+
+import pandas as pd
+
+# Candidate timestamp layouts, most specific first; the first one that parses a whole sample wins
+DATE_FORMATS = ['%Y/%m/%d %H:%M', '%Y/%m/%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d', '%d/%m/%Y', '%m/%d/%Y']
+
+# Amounts such as 1234.56, 1,234.56, $1,234.56, -€ 99 (currency symbol and thousands separators optional)
+_AMOUNT_RE = r'^\s*[-+]?\s*[\$€£]?\s*[-+]?(?:\d{1,3}(?:,\d{3})+|\d+)(?:\.\d+)?\s*$'
+_AMOUNT_STRIP = re.compile(r'[\$€£,\s]')
+
+_SAMPLE_SIZE = 1000
+
+# Share of sampled values that must parse for a column to be converted; the rest are counted as failures
+MIN_PARSE_RATIO = 0.9
+
+
+def is_text_dtype(series: pd.Series) -> bool:
+    """True for object columns and pandas' `str` dtype (pandas 3 no longer reports these as 'object')."""
+    return pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series)
+
+
+def _sample(series: pd.Series) -> pd.Series:
+    """Up to _SAMPLE_SIZE non-null values spread over the whole column (head, middle and tail)."""
+    values = series.dropna()
+    if len(values) <= _SAMPLE_SIZE:
+        return values.astype(str)
+    step = len(values) // _SAMPLE_SIZE
+    return values.iloc[::step].astype(str)
+
+
+def detect_datetime_format(series: pd.Series):
+    """Returns the DATE_FORMATS entry that parses the most sampled values (at least MIN_PARSE_RATIO), or None."""
+    sample = _sample(series)
+    if len(sample) == 0:
+        return None
+    best, best_ratio = None, MIN_PARSE_RATIO
+    for fmt in DATE_FORMATS:
+        ratio = pd.to_datetime(sample, format=fmt, errors='coerce').notna().mean()
+        if ratio == 1.0:
+            return fmt
+        if ratio >= best_ratio and (best is None or ratio > best_ratio):
+            best, best_ratio = fmt, ratio
+    return best
+
+
+def is_amount_text(series: pd.Series) -> bool:
+    """True if at least MIN_PARSE_RATIO of sampled values look like plain or currency-formatted numbers."""
+    sample = _sample(series)
+    return len(sample) > 0 and sample.str.match(_AMOUNT_RE).mean() >= MIN_PARSE_RATIO
+
+
+def parse_datetime_column(series: pd.Series, fmt: str = None):
+    """
+    Parses a whole column with one fixed format (detected from a sample unless given).
+    Returns (parsed, report) where report is {"kind", "format", "failures"}; `failures` counts
+    non-null values that did not parse. Columns that are already datetimes are returned as-is.
+    """
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series, {"kind": "datetime", "format": None, "failures": 0}
+    fmt = fmt or detect_datetime_format(series)
+    if fmt is None:
+        # Unknown layout: fall back to pandas' per-element inference
+        parsed = pd.to_datetime(series, errors='coerce', format='mixed')
+    else:
+        parsed = pd.to_datetime(series, format=fmt, errors='coerce')
+    failures = int((parsed.isna() & series.notna()).sum())
+    return parsed, {"kind": "datetime", "format": fmt, "failures": failures}
+
+
+def parse_amount_column(series: pd.Series):
+    """
+    Parses a whole amount column, stripping currency symbols and thousands separators in one
+    vectorized pass. Returns (parsed float64 Series, report) like parse_datetime_column.
+    """
+    if pd.api.types.is_numeric_dtype(series):
+        return series, {"kind": "amount", "format": None, "failures": 0}
+    text = series.astype("string")
+    formatted = bool(text.str.contains(_AMOUNT_STRIP.pattern, regex=True).any())
+    if formatted:
+        text = text.str.replace(_AMOUNT_STRIP.pattern, '', regex=True)
+    parsed = pd.to_numeric(text, errors='coerce').astype('float64')
+    failures = int((parsed.isna() & series.notna()).sum())
+    return parsed, {"kind": "amount", "format": "currency" if formatted else "plain", "failures": failures}
+
+
+def to_datetime(series: pd.Series) -> pd.Series:
+    """Datetime view of a column for callers that only need the values (parse failures become NaT)."""
+    return parse_datetime_column(series)[0]
+
+
+def to_amount(series: pd.Series) -> pd.Series:
+    """float64 view of an amount column (parse failures become NaN)."""
+    if pd.api.types.is_numeric_dtype(series):
+        return series.astype('float64')
+    return parse_amount_column(series)[0]
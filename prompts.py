@@ -1,3 +1,10 @@
+# Bump a template's version whenever its wording changes so cached LLM responses are not reused
+PROMPT_VERSIONS = {
+    "agent_1": "4",
+    "agent_2": "4",
+    "agent_3": "1",
+}
+
 AGENT_1_PROMPT = """You are Agent 1 — Policy Interpreter.
 
 You receive a compliance policy document (PDF text).
@@ -22,6 +29,10 @@ RULES FOR QUERIES:
 - Generic Schema: Table: transactions. Columns: tx_id, timestamp, sender_account, receiver_account, amount, currency, tx_type, sender_country, receiver_country
 - SQL: SQLite dialect. No placeholders. SELECT must include: tx_id, timestamp, sender_account, receiver_account, amount, tx_type. Return ONLY violating records.
 - Pandas: Generate ONE string to be evaluated inside `df.query()`. DO NOT use `df[` or variables. Use standard operators (`and`, `or`, `==`, `>=`, `<=`, `in`).
+- Velocity rules (same account within a time window): call `velocity_count(sender_account, timestamp, '24h')` (transactions in the trailing window) or `velocity_sum(sender_account, timestamp, amount, '24h')` (amount in the trailing window) inside the Pandas string, e.g. `velocity_count(sender_account, timestamp, '24h') > 5`.
+- Duplicate rules: `duplicate_count(sender_account, receiver_account, amount=amount, bucket=1, time=timestamp, tolerance='1h') >= 2` counts rows sharing the same key columns (amount floored into `bucket`-sized buckets, times at most `tolerance` apart; both optional).
+- Watchlist / sanctions rules: never inline the list; call `in_list(receiver_account, 'sanctions')` with the list's name.
+- Structuring rules (many payments just under a reporting threshold): `structuring_count(sender_account, timestamp, amount, threshold=10000, margin=0.1, window='24h') >= 3`.
 
 Output raw JSON array only.
 
@@ -36,6 +47,8 @@ Rewrite every query using the real column names and real values. Do NOT change l
 STEP 1 — Map Columns: match by MEANING (e.g. `amount` -> `trans_amt`, `sender_account` -> `from_acct`).
 STEP 2 — Map Values: check sample data to align values (e.g. `cash_deposit` -> `CASH-IN`, `Iran` -> `IR`).
 STEP 3 — Rewrite Queries: replace generic columns and values in `sql_query` and `pandas_query` with actual ones.
+Keep operator calls such as `velocity_count(...)`, `duplicate_count(...)`, `structuring_count(...)` or `in_list(...)` in `pandas_query` and only remap their column arguments; `in_list` must name one of the available reference lists below.
+The `sql_query` is executed with DuckDB against the table `transactions`: use `SELECT *`, and quote column names containing spaces with double quotes (e.g. "Amount Paid").
 
 OUTPUT raw JSON exactly like this:
 {{
@@ -62,7 +75,9 @@ GENERIC QUERIES & RULES (From Agent 1):
 DATASET COLUMNS (Actual Schema):
 {dataset_columns}
 SAMPLE DATA / CONTEXT:
-{sample_data}"""
+{sample_data}
+AVAILABLE REFERENCE LISTS:
+{reference_lists}"""
 
 
 AGENT_3_PROMPT = """You are Agent 3 — Compliance Executor.
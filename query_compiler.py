@@ -0,0 +1,226 @@
+"""
+Compiles a parsed pandas_query predicate into a reusable evaluator.
+
+Only a whitelisted subset of Python is accepted: column references, literals, comparisons
+(including chained ones, and `in` / `not in` / `==` / `!=` against a list, which mean membership
+as they do in DataFrame.query), arithmetic, boolean logic, the math functions numexpr provides
+(`abs`, `sqrt`, `log`, ...) and a fixed set of Series, `.str` and `.dt` methods. Anything else
+(subscripts, arbitrary calls, lambdas, attribute access on non-columns) is rejected at compile
+time instead of being handed to eval.
+
+The compiled form is a tree of closures over vectorized pandas/NumPy operations, so evaluating a
+cached query touches the data only.
+"""
+import ast
+import operator
+
+import numpy as np
+import pandas as pd
+
+from ingestion import widen_numeric
+
+
+class QueryCompileError(ValueError):
+    """Raised when a pandas_query uses syntax or functions outside the whitelist."""
+
+
+_COMPARE = {
+    ast.Eq: operator.eq, ast.NotEq: operator.ne,
+    ast.Lt: operator.lt, ast.LtE: operator.le,
+    ast.Gt: operator.gt, ast.GtE: operator.ge,
+}
+
+_ORDERING = {ast.Lt, ast.LtE, ast.Gt, ast.GtE}
+
+_ARITHMETIC = {
+    ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul,
+    ast.Div: operator.truediv, ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod, ast.Pow: operator.pow,
+}
+
+_SERIES_METHODS = {"isin", "between", "abs", "isna", "notna", "isnull", "notnull", "round", "fillna"}
+_STR_METHODS = {"contains", "startswith", "endswith", "match", "fullmatch", "lower", "upper", "strip", "len"}
+_DT_ATTRIBUTES = {"year", "month", "day", "hour", "minute", "second", "dayofweek", "day_of_week",
+                  "weekday", "dayofyear", "quarter", "date"}
+_DT_METHODS = {"day_name", "month_name", "normalize"}
+
+# Plain function calls DataFrame.eval accepts (numexpr's math functions)
+_FUNCTIONS = {
+    "abs": np.abs, "sqrt": np.sqrt, "exp": np.exp, "expm1": np.expm1,
+    "log": np.log, "log10": np.log10, "log1p": np.log1p,
+    "sin": np.sin, "cos": np.cos, "tan": np.tan,
+    "arcsin": np.arcsin, "arccos": np.arccos, "arctan": np.arctan, "arctan2": np.arctan2,
+    "sinh": np.sinh, "cosh": np.cosh, "tanh": np.tanh,
+    "arcsinh": np.arcsinh, "arccosh": np.arccosh, "arctanh": np.arctanh,
+    "floor": np.floor, "ceil": np.ceil,
+}
+
+
+def to_mask(value, length: int) -> np.ndarray:
+    """Turns a compiled predicate's result into a plain boolean array (missing values are False)."""
+    if isinstance(value, pd.Series):
+        value = value.to_numpy(dtype=bool, na_value=False)
+    value = np.asarray(value)
+    if value.dtype != bool:
+        value = value.astype(bool)
+    if value.ndim == 0:
+        value = np.full(length, bool(value))
+    return value
+
+
+def _ordered(value):
+    """
+    Ingestion stores low-cardinality text as unordered categoricals, which only support ==/!=.
+    For <, >, ... compare on the category values, as the original column would have.
+    """
+    if isinstance(value, pd.Series) and isinstance(value.dtype, pd.CategoricalDtype) and not value.dtype.ordered:
+        return value.astype(value.dtype.categories.dtype)
+    return value
+
+
+def _literal(node):
+    """Evaluates a constant, a negated number or a list/tuple/set of those; returns (ok, value)."""
+    if isinstance(node, ast.Constant):
+        return True, node.value
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)) and isinstance(node.operand, ast.Constant) \
+            and isinstance(node.operand.value, (int, float)):
+        return True, -node.operand.value if isinstance(node.op, ast.USub) else node.operand.value
+    if isinstance(node, (ast.List, ast.Tuple, ast.Set)):
+        values = []
+        for element in node.elts:
+            ok, value = _literal(element)
+            if not ok:
+                return False, None
+            values.append(value)
+        return True, values
+    return False, None
+
+
+class _Compiler:
+    def __init__(self, columns: dict):
+        self.placeholders = columns
+        self.columns = set()
+
+    def compile(self, node):
+        ok, value = _literal(node)
+        if ok:
+            return lambda df, ops: value
+
+        if isinstance(node, ast.Name):
+            return self._name(node.id)
+        if isinstance(node, ast.Compare):
+            return self._compare(node)
+        if isinstance(node, ast.BoolOp):
+            parts = [self.compile(v) for v in node.values]
+            combine = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+            return lambda df, ops: combine.reduce([to_mask(p(df, ops), len(df)) for p in parts])
+        if isinstance(node, ast.UnaryOp):
+            operand = self.compile(node.operand)
+            if isinstance(node.op, (ast.Not, ast.Invert)):
+                return lambda df, ops: ~to_mask(operand(df, ops), len(df))
+            if isinstance(node.op, ast.USub):
+                return lambda df, ops: -operand(df, ops)
+            return operand
+        if isinstance(node, ast.BinOp) and type(node.op) in _ARITHMETIC:
+            fn, left, right = _ARITHMETIC[type(node.op)], self.compile(node.left), self.compile(node.right)
+            return lambda df, ops: fn(left(df, ops), right(df, ops))
+        if isinstance(node, ast.Attribute):
+            return self._attribute(node)
+        if isinstance(node, ast.Call):
+            return self._call(node)
+        raise QueryCompileError(f"Unsupported syntax in query: {ast.unparse(node)}")
+
+    def _name(self, name: str):
+        if name.startswith("__op_"):
+            return lambda df, ops: ops[name]
+        column = self.placeholders.get(name, name)
+        self.columns.add(column)
+        return lambda df, ops: widen_numeric(df[column])
+
+    def _compare(self, node):
+        membership_ops = (ast.In, ast.NotIn, ast.Eq, ast.NotEq)
+        is_list = [isinstance(n, (ast.List, ast.Tuple)) for n in [node.left] + node.comparators]
+        if any(isinstance(op, (ast.In, ast.NotIn)) for op in node.ops) or any(is_list):
+            # `col in [...]`, and `col == [...]` / `[...] == col` as DataFrame.query reads them
+            if len(node.ops) != 1 or not isinstance(node.ops[0], membership_ops) or all(is_list):
+                raise QueryCompileError(f"Unsupported comparison in query: {ast.unparse(node)}")
+            column, listed = node.left, node.comparators[0]
+            if is_list[0] and isinstance(node.ops[0], (ast.Eq, ast.NotEq)):
+                column, listed = listed, column
+            ok, values = _literal(listed)
+            if not ok or not isinstance(values, list):
+                raise QueryCompileError(f"`in` needs a literal list: {ast.unparse(listed)}")
+            left, negate = self.compile(column), isinstance(node.ops[0], (ast.NotIn, ast.NotEq))
+
+            def membership(df, ops):
+                value = left(df, ops)
+                result = (value if isinstance(value, pd.Series) else pd.Series(value)).isin(values)
+                return ~result if negate else result
+            return membership
+
+        for op in node.ops:
+            if type(op) not in _COMPARE:
+                raise QueryCompileError(f"Unsupported comparison in query: {ast.unparse(node)}")
+        fns = [_COMPARE[type(op)] for op in node.ops]
+        operands = [self.compile(node.left)] + [self.compile(c) for c in node.comparators]
+        if any(type(op) in _ORDERING for op in node.ops):
+            operands = [lambda df, ops, operand=operand: _ordered(operand(df, ops)) for operand in operands]
+        if len(fns) == 1:
+            fn, left, right = fns[0], operands[0], operands[1]
+            return lambda df, ops: fn(left(df, ops), right(df, ops))
+
+        def chained(df, ops):
+            # a < b < c is the AND of each adjacent pair, with every operand evaluated once
+            values = [operand(df, ops) for operand in operands]
+            return np.logical_and.reduce([to_mask(fn(values[i], values[i + 1]), len(df)) for i, fn in enumerate(fns)])
+        return chained
+
+    def _accessor(self, node):
+        """Splits `column.str` / `column.dt` into (compiled column, accessor name), else (None, None)."""
+        if isinstance(node, ast.Attribute) and node.attr in ("str", "dt"):
+            return self.compile(node.value), node.attr
+        return None, None
+
+    def _attribute(self, node):
+        base, accessor = self._accessor(node.value)
+        if accessor == "dt" and node.attr in _DT_ATTRIBUTES:
+            return lambda df, ops: getattr(base(df, ops).dt, node.attr)
+        raise QueryCompileError(f"Unsupported attribute in query: {ast.unparse(node)}")
+
+    def _call(self, node):
+        if isinstance(node.func, ast.Name) and node.func.id in _FUNCTIONS and not node.keywords:
+            fn, args = _FUNCTIONS[node.func.id], [self.compile(a) for a in node.args]
+            return lambda df, ops: fn(*[a(df, ops) for a in args])
+        if not isinstance(node.func, ast.Attribute):
+            raise QueryCompileError(f"Unsupported function call in query: {ast.unparse(node)}")
+        method = node.func.attr
+        args = [self.compile(a) for a in node.args]
+        kwargs = {k.arg: self.compile(k.value) for k in node.keywords if k.arg}
+        if len(kwargs) != len(node.keywords):
+            raise QueryCompileError(f"Unsupported call arguments in query: {ast.unparse(node)}")
+
+        base, accessor = self._accessor(node.func.value)
+        if accessor is None:
+            if method not in _SERIES_METHODS:
+                raise QueryCompileError(f"Unsupported method in query: .{method}()")
+            base = self.compile(node.func.value)
+        elif method not in (_STR_METHODS if accessor == "str" else _DT_METHODS):
+            raise QueryCompileError(f"Unsupported method in query: .{accessor}.{method}()")
+
+        def call(df, ops):
+            target = base(df, ops)
+            if accessor:
+                target = getattr(target, accessor)
+            return getattr(target, method)(*[a(df, ops) for a in args], **{k: v(df, ops) for k, v in kwargs.items()})
+        return call
+
+
+def compile_expression(node, columns: dict):
+    """
+    Compiles one parsed predicate (after operator extraction) into `fn(df, operator_values)`.
+    `columns` maps backtick placeholders to real column names. Returns (fn, referenced_columns).
+    Raises QueryCompileError for anything outside the whitelist.
+    """
+    compiler = _Compiler(columns)
+    fn = compiler.compile(node)
+    return fn, compiler.columns
@@ -0,0 +1,228 @@
+import ast
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from ingestion import widen_numeric
+from operators import OPERATORS
+from query_compiler import compile_expression, to_mask
+
+
+_PLACEHOLDER = "__col_{}__"
+_PLACEHOLDER_RE = re.compile(r"__col_(\d+)__")
+
+
+def _tokenize_query(query: str):
+    """
+    Rewrites a df.query() string into plain Python source.
+    Backtick-quoted column names become placeholder identifiers, and `&` / `|` are
+    rewritten to `and` / `or` so operator precedence matches pandas' own parser.
+    Returns (source, {placeholder: column_name}).
+    """
+    out = []
+    columns = {}
+    seen = {}
+    i, n = 0, len(query)
+    while i < n:
+        ch = query[i]
+        if ch in ("'", '"'):
+            # Copy string literals verbatim, honouring escapes
+            j = i + 1
+            while j < n and query[j] != ch:
+                j += 2 if query[j] == "\\" else 1
+            out.append(query[i:j + 1])
+            i = j + 1
+        elif ch == "`":
+            j = query.find("`", i + 1)
+            if j == -1:
+                raise ValueError("Unterminated backtick-quoted column name.")
+            name = query[i + 1:j]
+            if name not in seen:
+                seen[name] = _PLACEHOLDER.format(len(seen))
+                columns[seen[name]] = name
+            out.append(seen[name])
+            i = j + 1
+        elif ch == "&":
+            out.append(" and ")
+            i += 1
+        elif ch == "|":
+            out.append(" or ")
+            i += 1
+        else:
+            out.append(ch)
+            i += 1
+    return "".join(out), columns
+
+
+def _restore_columns(source: str, columns: dict) -> str:
+    """Turns placeholder identifiers back into backtick-quoted column names."""
+    return _PLACEHOLDER_RE.sub(lambda m: f"`{columns[m.group(0)]}`", source)
+
+
+def referenced_columns(query: str) -> set:
+    """
+    Returns every column name a pandas_query refers to: backtick-quoted names plus bare
+    identifiers that are not method or attribute names. Raises SyntaxError/ValueError if the
+    query cannot be parsed.
+    """
+    source, columns = _tokenize_query(query)
+    tree = ast.parse(source.strip(), mode="eval")
+    called = {id(node.func) for node in ast.walk(tree) if isinstance(node, ast.Call)}
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and id(node) not in called:
+            names.add(columns.get(node.id, node.id))
+    return names - {"True", "False", "None"}
+
+
+def _is_predicate(node) -> bool:
+    """True if the node produces a boolean mask on its own (so `~` / `&` act logically)."""
+    if isinstance(node, (ast.Compare, ast.BoolOp)):
+        return True
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.Not, ast.Invert)):
+        return _is_predicate(node.operand)
+    return False
+
+
+class _OperatorExtractor(ast.NodeTransformer):
+    """Replaces calls to registered operators with `@`-variables the compiled leaves read from the operator values."""
+
+    def __init__(self, columns, operators):
+        self.columns = columns
+        self.operators = operators
+
+    def _arg(self, node):
+        if isinstance(node, ast.Name):
+            return ("column", self.columns.get(node.id, node.id))
+        if isinstance(node, ast.Constant):
+            return ("literal", node.value)
+        raise ValueError(f"Unsupported operator argument: {ast.unparse(node)}")
+
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        if not (isinstance(node.func, ast.Name) and node.func.id in OPERATORS):
+            return node
+        args = tuple(self._arg(a) for a in node.args)
+        kwargs = tuple(sorted((k.arg, self._arg(k.value)) for k in node.keywords))
+        canonical = _restore_columns(ast.unparse(node), self.columns)
+        var = "__op_" + hashlib.sha1(canonical.encode("utf-8")).hexdigest()[:12]
+        self.operators[var] = (node.func.id, args, kwargs)
+        return ast.copy_location(ast.Name(id=var, ctx=ast.Load()), node)
+
+
+class QueryPlan:
+    """
+    A parsed and compiled pandas_query split into its distinct leaf predicates.
+
+    `tree` is a nested tuple: ("and", [...]), ("or", [...]), ("not", child) or ("leaf", key),
+    where `key` is the normalized source of that predicate and `leaves[key]` its compiled
+    evaluator (see query_compiler.py). `columns` holds every column the query reads, so it can
+    be checked against a schema before any data is scanned.
+
+    Calls to registered operators (see operators.py) are lifted out into `operators`
+    ({variable: (name, args, kwargs)}); leaves refer to them as `@variable`.
+
+    Queries that cannot be parsed, or that use syntax outside the compiler's whitelist, get
+    `error` set and no leaves.
+    """
+
+    def __init__(self, query: str):
+        self.query = query
+        self.leaves = {}
+        self.operators = {}
+        self.columns = set()
+        self.error = None
+        self.tree = None
+        try:
+            source, columns = _tokenize_query(query)
+            expr = ast.parse(source.strip(), mode="eval").body
+            self.tree = self._build(expr, columns)
+        except (SyntaxError, ValueError) as e:
+            self.leaves, self.operators = {}, {}
+            self.error = f"Invalid query: {e}"
+
+        for name, args, kwargs in self.operators.values():
+            self.columns.update(value for kind, value in list(args) + [a for _, a in kwargs] if kind == "column")
+
+    def _build(self, node, columns):
+        if isinstance(node, ast.BoolOp):
+            op = "and" if isinstance(node.op, ast.And) else "or"
+            return (op, [self._build(v, columns) for v in node.values])
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.Not, ast.Invert)) and _is_predicate(node.operand):
+            return ("not", self._build(node.operand, columns))
+        node = _OperatorExtractor(columns, self.operators).visit(node)
+        key = _restore_columns(ast.unparse(node), columns)
+        key = re.sub(r"\b(__op_[0-9a-f]{12})\b", r"@\1", key)
+        if key not in self.leaves:
+            self.leaves[key], referenced = compile_expression(node, columns)
+            self.columns |= referenced
+        return ("leaf", key)
+
+    def missing_columns(self, available) -> list:
+        """Referenced columns that are not in `available`, in sorted order."""
+        return sorted(self.columns - set(available))
+
+    def evaluate_leaf(self, df: pd.DataFrame, key: str, operator_values: dict = None) -> np.ndarray:
+        """Runs one compiled predicate and returns it as a plain boolean array."""
+        return to_mask(self.leaves[key](df, operator_values or {}), len(df))
+
+    def combine(self, leaf_masks: dict) -> np.ndarray:
+        """Composes the rule mask from already-evaluated leaf masks."""
+        return self._combine(self.tree, leaf_masks)
+
+    def _combine(self, node, leaf_masks):
+        kind, payload = node
+        if kind == "leaf":
+            return leaf_masks[payload]
+        if kind == "not":
+            return ~self._combine(payload, leaf_masks)
+        masks = [self._combine(child, leaf_masks) for child in payload]
+        reducer = np.logical_and if kind == "and" else np.logical_or
+        return reducer.reduce(masks)
+
+
+# Compiled plans shared by every executor in the process, keyed by normalized query text
+_PLAN_CACHE = OrderedDict()
+_PLAN_CACHE_LOCK = threading.Lock()
+PLAN_CACHE_SIZE = 1024
+
+_QUOTED_RE = re.compile(r"""('(?:\\.|[^'\\])*'|"(?:\\.|[^"\\])*"|`[^`]*`)""")
+
+
+def _normalize_query(query: str) -> str:
+    """Collapses whitespace outside string literals and backtick names, so formatting-only differences share a plan."""
+    parts = _QUOTED_RE.split(str(query).strip())
+    return "".join(part if i % 2 else re.sub(r"\s+", " ", part) for i, part in enumerate(parts))
+
+
+def get_plan(query: str) -> QueryPlan:
+    """Returns the compiled QueryPlan for `query`, parsing and compiling it only on first use."""
+    key = _normalize_query(query)
+    with _PLAN_CACHE_LOCK:
+        plan = _PLAN_CACHE.get(key)
+        if plan is not None:
+            _PLAN_CACHE.move_to_end(key)
+            return plan
+    plan = QueryPlan(key)
+    with _PLAN_CACHE_LOCK:
+        _PLAN_CACHE[key] = plan
+        while len(_PLAN_CACHE) > PLAN_CACHE_SIZE:
+            _PLAN_CACHE.popitem(last=False)
+    return plan
+
+
+def evaluate_operator(df: pd.DataFrame, name: str, args, kwargs) -> np.ndarray:
+    """Runs one registered operator, passing column arguments as Series and literals as values."""
+    def resolve(arg):
+        kind, value = arg
+        if kind == "column":
+            if value not in df.columns:
+                raise ValueError(f"Unknown column '{value}'")
+            return widen_numeric(df[value])
+        return value
+
+    return np.asarray(OPERATORS[name](*[resolve(a) for a in args], **{k: resolve(v) for k, v in kwargs}))
@@ -0,0 +1,119 @@
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+import instrumentation
+
+DEFAULT_REFERENCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "reference")
+
+# Supported list files: one entry per line (.txt, '#' starts a comment) or the first column of a CSV
+_EXTENSIONS = (".txt", ".csv")
+
+# Built lists are shared by every executor and rule in the process: {path: (size, mtime_ns, ReferenceList)}
+_CACHE = {}
+_CACHE_LOCK = threading.Lock()
+
+
+class ReferenceList:
+    """
+    A named watchlist (sanctions, high-risk accounts, ...) pre-built for vectorized membership checks.
+
+    Entries are kept as a hashed string index; when every entry is an integer they are also kept as a
+    hashed int64 index, so numeric account columns are probed directly instead of being converted
+    to strings first.
+    """
+
+    def __init__(self, name: str, entries):
+        self.name = name
+        entries = pd.Series(entries, dtype="string").str.strip()
+        entries = entries[entries.notna() & (entries != "")].drop_duplicates()
+        self.strings = pd.Index(entries.to_numpy(dtype=object))
+
+        as_int = pd.to_numeric(entries, errors='coerce')
+        if len(entries) and as_int.notna().all() and (as_int == np.floor(as_int)).all():
+            self.integers = pd.Index(np.unique(as_int.to_numpy(dtype=np.int64)))
+        else:
+            self.integers = None
+
+    def __len__(self):
+        return len(self.strings)
+
+    def contains(self, values: pd.Series) -> np.ndarray:
+        """Boolean mask of which values are on the list; missing values never match."""
+        values = pd.Series(values)
+        if self.integers is not None and pd.api.types.is_integer_dtype(values) and not values.hasnans:
+            return self.integers.get_indexer(values.to_numpy(dtype=np.int64)) >= 0
+        if self.integers is not None and pd.api.types.is_numeric_dtype(values):
+            numbers = values.to_numpy(dtype=np.float64, na_value=np.nan)
+            integral = np.isfinite(numbers) & (numbers == np.floor(numbers))
+            codes = np.where(integral, numbers, 0).astype(np.int64)
+            return integral & (self.integers.get_indexer(codes) >= 0)
+
+        strings = values.astype("string").str.strip()
+        found = self.strings.get_indexer(strings.to_numpy(dtype=object, na_value=None)) >= 0
+        return found & strings.notna().to_numpy()
+
+
+def _list_path(name: str, directory: str):
+    # Names come from rule queries: only plain file names inside `directory` are allowed
+    if (not isinstance(name, str) or not name or name in (".", "..") or ".." in name or os.path.isabs(name)
+            or os.path.basename(name) != name or os.sep in name or (os.altsep and os.altsep in name)):
+        raise ValueError(f"Invalid reference list name {name!r}: expected a plain list name such as 'sanctions'")
+    for ext in _EXTENSIONS:
+        path = os.path.join(directory, name + ext)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def _read_entries(path: str):
+    if path.endswith(".csv"):
+        return pd.read_csv(path, usecols=[0], dtype=str).iloc[:, 0]
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.split("#", 1)[0] for line in f]
+
+
+def available_reference_lists(directory: str = DEFAULT_REFERENCE_DIR):
+    """Names of the reference lists found in `directory` (file names without extension)."""
+    if not os.path.isdir(directory):
+        return []
+    return sorted({os.path.splitext(f)[0] for f in os.listdir(directory)
+                   if f.endswith(_EXTENSIONS) and not f.startswith(".")})
+
+
+def reference_list_version(name: str, directory: str = DEFAULT_REFERENCE_DIR):
+    """(file name, size, mtime_ns) of the named list's file, or None if it does not exist."""
+    try:
+        path = _list_path(name, directory)
+    except ValueError:
+        return None
+    if path is None:
+        return None
+    stat = os.stat(path)
+    return os.path.basename(path), stat.st_size, stat.st_mtime_ns
+
+
+def load_reference_list(name: str, directory: str = DEFAULT_REFERENCE_DIR) -> ReferenceList:
+    """
+    Returns the named list, reading and indexing its file only the first time (or after the file
+    changes on disk). Raises ValueError if no such list exists or `name` is not a plain list name
+    (path separators, '..' and absolute paths are rejected).
+    """
+    path = _list_path(name, directory)
+    if path is None:
+        raise ValueError(f"Unknown reference list '{name}' (available: {', '.join(available_reference_lists(directory)) or 'none'})")
+
+    stat = os.stat(path)
+    with _CACHE_LOCK:
+        cached = _CACHE.get(path)
+        if cached and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+            return cached[2]
+
+    with instrumentation.span("reference_list", list=name) as span:
+        reference = ReferenceList(name, _read_entries(path))
+        span.set(entries=len(reference))
+    with _CACHE_LOCK:
+        _CACHE[path] = (stat.st_size, stat.st_mtime_ns, reference)
+    return reference
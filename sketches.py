@@ -0,0 +1,147 @@
+import numpy as np
+import pandas as pd
+
+
+def _normalize_keys(values) -> pd.Series:
+    """
+    Drops NaNs and turns integral floats back into int64, so an account read as float in one
+    chunk (because of a missing value) hashes and compares equal to the same account read as int.
+    """
+    values = pd.Series(values).dropna().reset_index(drop=True)
+    if pd.api.types.is_float_dtype(values) and np.all(np.mod(values.to_numpy(), 1) == 0):
+        values = values.astype(np.int64)
+    return values
+
+
+def _hash_values(values: pd.Series) -> np.ndarray:
+    """Stable 64-bit hashes for a Series of account identifiers."""
+    return pd.util.hash_pandas_object(values, index=False).to_numpy()
+
+
+def _leading_zeros(w: np.ndarray) -> np.ndarray:
+    """Vectorized count-leading-zeros for uint64 arrays."""
+    w = w.copy()
+    for shift in (1, 2, 4, 8, 16, 32):
+        w |= w >> np.uint64(shift)
+    return 64 - np.bitwise_count(w).astype(np.int64)
+
+
+class HyperLogLog:
+    """
+    Mergeable distinct-count sketch. Counts are exact while fewer than `exact_limit` distinct
+    hashes have been seen, then switch to 2^precision registers (16 KB at the default precision).
+    """
+
+    def __init__(self, precision: int = 14, exact_limit: int = 4096):
+        self.precision = precision
+        self.exact_limit = exact_limit
+        self.exact = set()
+        self.registers = None
+
+    def _to_registers(self):
+        self.registers = np.zeros(1 << self.precision, dtype=np.uint8)
+        self._add_hashes(np.fromiter(self.exact, dtype=np.uint64, count=len(self.exact)))
+        self.exact = None
+
+    def _add_hashes(self, hashes: np.ndarray):
+        if hashes.size == 0:
+            return
+        p = np.uint64(self.precision)
+        idx = (hashes >> (np.uint64(64) - p)).astype(np.int64)
+        rank = np.minimum(_leading_zeros(hashes << p) + 1, 64 - self.precision + 1).astype(np.uint8)
+        np.maximum.at(self.registers, idx, rank)
+
+    def update(self, values):
+        """Adds a batch of values (NaNs are ignored)."""
+        hashes = _hash_values(_normalize_keys(values))
+        if self.registers is None:
+            self.exact.update(np.unique(hashes).tolist())
+            if len(self.exact) > self.exact_limit:
+                self._to_registers()
+        else:
+            self._add_hashes(hashes)
+
+    def merge(self, other: "HyperLogLog"):
+        if self.registers is None and other.registers is None:
+            self.exact |= other.exact
+            if len(self.exact) > self.exact_limit:
+                self._to_registers()
+            return self
+        if self.registers is None:
+            self._to_registers()
+        if other.registers is None:
+            self._add_hashes(np.fromiter(other.exact, dtype=np.uint64, count=len(other.exact)))
+        else:
+            np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def count(self) -> int:
+        if self.registers is None:
+            return len(self.exact)
+        m = float(self.registers.size)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.power(2.0, -self.registers.astype(np.float64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            # Small-range correction (linear counting)
+            estimate = m * np.log(m / zeros)
+        return int(round(estimate))
+
+
+class SpaceSaving:
+    """
+    Mergeable heavy-hitters sketch keeping at most `capacity` counters.
+    Each counter tracks (count, error, first_pos); counts are exact until the sketch fills up,
+    and ties are ranked by first appearance like pandas' value_counts().
+    """
+
+    def __init__(self, capacity: int = 1000):
+        self.capacity = capacity
+        self.table = pd.DataFrame({"count": pd.Series(dtype=np.int64),
+                                   "error": pd.Series(dtype=np.int64),
+                                   "first_pos": pd.Series(dtype=np.int64)})
+        self.truncated = False
+
+    def _floor(self) -> int:
+        """Upper bound on the count of any key not tracked by this sketch (0 while counts are exact)."""
+        return int(self.table["count"].min()) if self.truncated else 0
+
+    def update(self, values, positions=None):
+        """Adds a batch of values; `positions` are their global row positions for tie-breaking."""
+        values = pd.Series(values).reset_index(drop=True)
+        if positions is None:
+            positions = np.arange(len(values))
+        positions = np.asarray(positions)[values.notna().to_numpy()]
+        values = _normalize_keys(values)
+        if values.empty:
+            return
+        codes, uniques = pd.factorize(values)
+        counts = np.bincount(codes, minlength=len(uniques)).astype(np.int64)
+        _, first_idx = np.unique(codes, return_index=True)
+        batch = pd.DataFrame({"count": counts, "error": np.zeros(len(uniques), dtype=np.int64),
+                              "first_pos": positions[first_idx]}, index=pd.Index(uniques))
+        other = SpaceSaving(self.capacity)
+        other.table = batch
+        self.merge(other)
+
+    def merge(self, other: "SpaceSaving"):
+        floor_a, floor_b = self._floor(), other._floor()
+        a, b = self.table, other.table
+        keys = a.index.union(b.index, sort=False)
+        a, b = a.reindex(keys), b.reindex(keys)
+        merged = pd.DataFrame({
+            "count": a["count"].fillna(floor_a) + b["count"].fillna(floor_b),
+            "error": a["error"].fillna(floor_a) + b["error"].fillna(floor_b),
+            "first_pos": np.fmin(a["first_pos"], b["first_pos"]),
+        }).astype(np.int64)
+        if len(merged) > self.capacity:
+            merged = merged.sort_values(["count", "first_pos"], ascending=[False, True], kind="stable").head(self.capacity)
+            self.truncated = True
+        self.truncated = self.truncated or other.truncated
+        self.table = merged
+        return self
+
+    def top(self, k: int = 3):
+        """Returns [(value, count), ...] for the k heaviest keys."""
+        ranked = self.table.sort_values(["count", "first_pos"], ascending=[False, True], kind="stable").head(k)
+        return list(zip(ranked.index.tolist(), ranked["count"].tolist()))
@@ -0,0 +1,42 @@
+import functools
+import os
+import shutil
+import sys
+import types
+
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+import benchmark
+import dataset_cache
+import dataset_registry
+import llm_pipeline
+from llm_cache import LLMResponseCache
+from mapping_store import MappingStore
+
+
+def test_full_run_produces_pdf_report(tmp_path, monkeypatch):
+    monkeypatch.setattr(llm_pipeline, "client", types.SimpleNamespace(models=benchmark.RecordedModels(10)))
+    # Fresh caches, so the run goes through the (recorded) models rather than earlier results
+    monkeypatch.setattr(llm_pipeline, "LLMPipeline", functools.partial(
+        llm_pipeline.LLMPipeline, LLMResponseCache(str(tmp_path / "llm")), MappingStore(str(tmp_path / "maps"))))
+    # Load copies of data/ CSVs, so their Arrow caches are written under tmp_path
+    loader = lambda path: dataset_cache.load_dataset(shutil.copy(path, tmp_path / os.path.basename(path)))
+    monkeypatch.setattr(dataset_registry, "_registry", dataset_registry.DatasetRegistry(loader=loader))
+    # The script runner installs app.py as __main__; restore it so spawned worker processes in
+    # later tests do not re-run the app
+    monkeypatch.setitem(sys.modules, "__main__", sys.modules["__main__"])
+    st.cache_resource.clear()
+
+    app = AppTest.from_file("app.py", default_timeout=120).run()
+    with open("test_policy.txt", "rb") as f:
+        app.sidebar.file_uploader[0].set_value(("policy.txt", f.read(), "text/plain"))
+    app.run()
+    next(b for b in app.sidebar.button if b.label == "Run Full Agent Pipeline").click().run()
+    st.cache_resource.clear()
+
+    assert not app.exception
+    assert not app.error
+    assert app.session_state.final_report
+    pdf = app.session_state.report_pdf
+    assert isinstance(pdf, (bytes, bytearray)) and bytes(pdf).startswith(b"%PDF")
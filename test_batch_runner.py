@@ -0,0 +1,51 @@
+import json
+import os
+import shutil
+import types
+
+import benchmark
+import llm_pipeline
+from batch_runner import BatchRunner, load_manifest, read_progress
+from dataset_registry import DatasetRegistry
+from llm_cache import LLMResponseCache
+from mapping_store import MappingStore
+
+
+def test_batch_runner_shares_datasets_and_resumes(tmp_path, monkeypatch):
+    import executor
+
+    monkeypatch.setattr(llm_pipeline, "client", types.SimpleNamespace(models=benchmark.RecordedModels(10)))
+    compactions = []
+    compact = executor.compact_dtypes
+    monkeypatch.setattr(executor, "compact_dtypes", lambda df, skip=(): compactions.append(1) or compact(df, skip))
+    shutil.copy("data/ibm_aml_sample_1000.csv", tmp_path / "emea.csv")
+    shutil.copy("test_policy.txt", tmp_path / "aml.txt")
+    manifest = tmp_path / "nightly.jsonl"
+    manifest.write_text("\n".join(json.dumps(job) for job in [
+        {"policy": "aml.txt", "dataset": "emea.csv", "output": "out/a", "id": "a"},
+        {"policy": "aml.txt", "dataset": "emea.csv", "output": "out/b", "id": "b"},
+        {"policy": "missing.txt", "dataset": "emea.csv", "output": "out/c", "id": "c"},
+    ]) + "\n")
+    jobs = load_manifest(str(manifest))
+    assert jobs[0]["dataset"] == str(tmp_path / "emea.csv")
+
+    def runner():
+        pipeline = llm_pipeline.LLMPipeline(cache=LLMResponseCache(str(tmp_path / "llm")),
+                                            mapping_store=MappingStore(str(tmp_path / "maps")))
+        return BatchRunner(pipeline, jobs=3, llm_concurrency=1, execution_workers=2, registry=DatasetRegistry())
+
+    progress = str(tmp_path / "progress.jsonl")
+    first = runner()
+    summary = first.run(jobs, progress)
+    assert sorted(summary["done"]) == ["a", "b"] and list(summary["failed"]) == ["c"]
+    assert first.registry.stats()["loads"] == 1 and first.registry.stats()["in_use"] == 0
+    # Only the registry's load types the frame; jobs reuse it as is
+    assert len(compactions) == 1
+    for job in ("a", "b"):
+        metrics = json.loads((tmp_path / "out" / job / "metrics.json").read_text())
+        assert len(metrics) >= 10
+        assert (tmp_path / "out" / job / "report.md").read_text()
+
+    resumed = runner().run(jobs, progress)
+    assert sorted(resumed["skipped"]) == ["a", "b"] and list(resumed["failed"]) == ["c"]
+    assert read_progress(progress)["c"]["status"] == "failed"
@@ -0,0 +1,31 @@
+import copy
+
+import benchmark
+
+
+def test_benchmark_runs_offline_and_flags_regressions(tmp_path, monkeypatch):
+    monkeypatch.setattr(benchmark, "BENCHMARK_DIR", str(tmp_path))
+    report = benchmark.run_benchmarks(["pandas"], [3000], [12])
+
+    stages = [r["stage"] for r in report["results"]]
+    assert stages == benchmark.STAGES
+    assert all(r["seconds"] >= 0 and r["peak_rss_mb"] > 0 for r in report["results"])
+    assert report["meta"]["seed"] == 42
+
+    slower = copy.deepcopy(report)
+    for row in slower["results"]:
+        row["seconds"] = row["seconds"] * 2 + 0.1
+    comparison = benchmark.compare_results(report, slower)
+    assert len(comparison) == len(stages) and all(c["regression"] for c in comparison)
+    assert not any(c["regression"] for c in benchmark.compare_results(report, report))
+
+
+def test_rule_variants_scale_thresholds_only():
+    rules = [{"rule_id": "R1", "pandas_query": "`Amount Paid` > 10000 & `Payment Format` == 'Cash 500'",
+              "sql_query": "SELECT * FROM t WHERE \"Account.1\" IN (828728463) AND \"Amount Paid\" > 10000"}]
+    original, variant = benchmark.expand_rules(rules, 2)
+
+    assert original == rules[0]
+    assert variant["rule_id"] == "R1#1"
+    assert variant["pandas_query"] == "`Amount Paid` > 10100 & `Payment Format` == 'Cash 500'"
+    assert variant["sql_query"] == "SELECT * FROM t WHERE \"Account.1\" IN (828728463) AND \"Amount Paid\" > 10100"
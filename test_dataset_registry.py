@@ -0,0 +1,48 @@
+import os
+import shutil
+import threading
+
+from dataset_registry import DatasetRegistry
+from executor import PandasExecutor
+
+
+def test_registry_shares_one_frame_and_copies_on_write(tmp_path):
+    path = shutil.copy("data/ibm_aml_sample_1000.csv", tmp_path / "emea.csv")
+    registry = DatasetRegistry()
+    handles = []
+    threads = [threading.Thread(target=lambda: handles.append(registry.acquire(path))) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert registry.stats()["loads"] == 1 and registry.stats()["in_use"] == 1
+
+    first, second = handles[:2]
+    before = second.df["Amount Paid"].copy()
+    executor = PandasExecutor(first.copy(), first.column_roles)
+    executor.df["Amount Paid"] = 0
+    first.df.loc[0, "Amount Paid"] = -1
+    assert second.df["Amount Paid"].equals(before)
+    assert registry.acquire(path).df["Amount Paid"].equals(before)
+
+
+def test_registry_evicts_unused_and_changed_datasets(tmp_path):
+    a = shutil.copy("data/ibm_aml_sample_1000.csv", tmp_path / "a.csv")
+    b = shutil.copy("data/ibm_aml_sample_1000.csv", tmp_path / "b.csv")
+    registry = DatasetRegistry(max_bytes=1)
+
+    with registry.acquire(a) as held:
+        registry.acquire(b).release()
+        # Over budget: the unused dataset goes, the held one stays
+        assert registry.stats()["datasets"] == 1
+        os.utime(a, ns=(0, 0))
+        assert held.stale
+    assert registry.stats()["datasets"] == 0
+
+    registry.max_bytes = 1 << 40
+    registry.acquire(a).release()
+    os.utime(a, ns=(10**9, 10**9))
+    registry.acquire(a).release()
+    # The superseded version is dropped even though the budget allows it
+    stats = registry.stats()
+    assert stats["datasets"] == 1 and stats["loads"] == 4
@@ -0,0 +1,26 @@
+import json
+
+import pandas as pd
+from duckdb_executor import DuckDBExecutor
+from executor import PandasExecutor
+
+rules = [
+  {
+    "rule_id": "Rule 3.3",
+    "title": "Ultra-High Transaction Alert",
+    "severity": "CRITICAL",
+    "sql_query": "SELECT * FROM transactions WHERE `Amount Paid` >= 1000000;",
+    "pandas_query": "`Amount Paid` >= 1000000",
+    "status": "READY"
+  }
+]
+
+
+def test_duckdb_metrics_match_pandas():
+    pandas_metrics = json.loads(PandasExecutor(pd.read_csv('data/ibm_aml_sample_1000.csv')).run_all_rules_and_collect_metrics(rules))
+    duckdb_metrics = json.loads(DuckDBExecutor('data/ibm_aml_sample_1000.csv').run_all_rules_and_collect_metrics(rules))
+
+    for expected, actual in zip(pandas_metrics, duckdb_metrics):
+        for key in ["status", "violation_count", "unique_accounts", "date_range", "top_offenders", "risk_score"]:
+            assert actual[key] == expected[key]
+        assert abs(actual["total_amount_exposure"] - expected["total_amount_exposure"]) < 1e-3
@@ -18,3 +18,292 @@ rules = [
 metrics = executor.run_all_rules_and_collect_metrics(rules)
 with open('metrics.json', 'w') as f:
     json.dump(metrics, f, indent=2)
+
+
+def test_shared_scan_matches_per_rule_eval():
+    queries = [
+        "`Amount Paid` >= 10000 and `Payment Format` == 'Cash'",
+        "`Payment Format` == 'Cash' & `Amount Paid` >= 10000 | `Is Laundering` == 1",
+        "not (`Payment Format` in ['Cash','Wire']) and ~(`Amount Paid` < 500)",
+        "unknown_column > 3",
+    ]
+    for query, batched in zip(queries, executor.execute_mapped_queries(queries)):
+        single = executor.execute_mapped_query(query)
+        assert batched["success"] == single["success"]
+        if single["success"]:
+            assert list(batched["violating_indices"]) == list(single["violating_indices"])
+
+
+def test_chunked_executor_matches_in_memory_metrics():
+    from chunked_executor import ChunkedExecutor
+
+    expected = json.loads(PandasExecutor(pd.read_csv('data/ibm_aml_sample_1000.csv')).run_all_rules_and_collect_metrics(rules))
+    actual = json.loads(ChunkedExecutor('data/ibm_aml_sample_1000.csv', chunksize=137).run_all_rules_and_collect_metrics(rules))
+
+    for exp, act in zip(expected, actual):
+        for key in ["status", "violation_count", "unique_accounts", "date_range", "top_offenders", "risk_score"]:
+            assert act[key] == exp[key]
+        assert abs(act["total_amount_exposure"] - exp["total_amount_exposure"]) < 1e-3
+
+
+def test_chunked_operators_see_rows_in_other_chunks():
+    from chunked_executor import ChunkedExecutor
+
+    operator_rules = [
+        {"rule_id": f"Op {i}", "title": f"Operator rule {i}", "severity": "HIGH", "status": "READY", "pandas_query": query}
+        for i, query in enumerate([
+            "duplicate_count(`Payment Format`, `From Bank`) >= 2",
+            "duplicate_count(`From Bank`, amount=`Amount Paid`, bucket=1000) >= 2 and `Payment Format` == 'Cash'",
+        ])
+    ]
+    expected = json.loads(PandasExecutor(pd.read_csv('data/ibm_aml_sample_1000.csv')).run_all_rules_and_collect_metrics(operator_rules))
+    actual = json.loads(ChunkedExecutor('data/ibm_aml_sample_1000.csv', chunksize=100).run_all_rules_and_collect_metrics(operator_rules))
+
+    assert all(exp["violation_count"] > 0 for exp in expected)
+    for exp, act in zip(expected, actual):
+        for key in ["status", "violation_count", "unique_accounts", "date_range", "top_offenders"]:
+            assert act[key] == exp[key], (exp["rule_id"], key)
+
+
+def test_velocity_count_matches_brute_force():
+    import numpy as np
+    from operators import rolling_window_stats
+
+    rng = np.random.default_rng(7)
+    n = 2000
+    tx = pd.DataFrame({
+        "account": rng.integers(0, 40, n),
+        "ts": pd.Timestamp("2022-01-01") + pd.to_timedelta(rng.integers(0, 60 * 24 * 10, n), unit="min"),
+        "amount": rng.random(n) * 1000,
+    })
+    counts, sums = rolling_window_stats(tx["account"], tx["ts"], "24h", tx["amount"])
+
+    for i in rng.integers(0, n, 100):
+        in_window = (tx["account"] == tx["account"][i]) & (tx["ts"] > tx["ts"][i] - pd.Timedelta("24h")) & (tx["ts"] <= tx["ts"][i])
+        assert counts[i] == in_window.sum()
+        assert abs(sums[i] - tx["amount"][in_window].sum()) < 1e-6
+
+    velocity = PandasExecutor(tx).execute_mapped_query("velocity_count(account, ts, '24h') > 5 and amount > 100")
+    assert velocity["violation_count"] == int(((counts > 5) & (tx["amount"] > 100).to_numpy()).sum())
+
+
+def test_duplicate_count_groups_rows_by_hashed_key():
+    tx = pd.DataFrame({
+        "sender": ["a", "a", "b", "a", None],
+        "receiver": ["x", "x", "x", "x", "x"],
+        "amount": [100.2, 100.7, 100.2, 100.2, 100.2],
+        "ts": pd.to_datetime(["2022-01-01 00:00", "2022-01-01 00:30", "2022-01-01 00:00", "2022-01-01 03:00", "2022-01-01 00:00"]),
+    })
+    executor = PandasExecutor(tx)
+
+    exact = executor.execute_mapped_query("duplicate_count(sender, receiver, amount=amount) >= 2")
+    assert list(exact["violating_indices"]) == [0, 3]
+
+    bucketed = executor.execute_mapped_query("duplicate_count(sender, receiver, amount=amount, bucket=1) >= 2")
+    assert list(bucketed["violating_indices"]) == [0, 1, 3]
+
+    within_hour = executor.execute_mapped_query(
+        "duplicate_count(sender, receiver, amount=amount, bucket=1, time=ts, tolerance='1h') >= 2"
+    )
+    assert list(within_hour["violating_indices"]) == [0, 1]
+
+
+def test_in_list_matches_reference_list_entries(tmp_path):
+    from reference_lists import load_reference_list
+
+    (tmp_path / "watch.txt").write_text("# comment\n1001\n1003  # trailing note\n\n")
+    watch = load_reference_list("watch", str(tmp_path))
+    assert watch is load_reference_list("watch", str(tmp_path))
+    assert list(watch.contains(pd.Series([1001, 1002, 1003, None]))) == [True, False, True, False]
+    assert list(watch.contains(pd.Series(["1001", "x", None]))) == [True, False, False]
+
+    tx = pd.DataFrame({"Account.1": [828728463, 1, 855176955], "Amount Paid": [10.0, 20.0, 30.0]})
+    sanctioned = PandasExecutor(tx).execute_mapped_query("in_list(`Account.1`, 'sanctions')")
+    assert list(sanctioned["violating_indices"]) == [0, 2]
+
+
+def test_reference_list_names_cannot_leave_the_list_directory(tmp_path):
+    import pytest
+    from reference_lists import load_reference_list
+
+    (tmp_path / "secrets.txt").write_text("1001\n")
+    lists = tmp_path / "lists"
+    lists.mkdir()
+    for name in ["../secrets", str(tmp_path / "secrets"), "a/b", "..", ""]:
+        with pytest.raises(ValueError, match="Invalid reference list name"):
+            load_reference_list(name, str(lists))
+
+    tx = pd.DataFrame({"Account.1": [1001, 1002]})
+    result = PandasExecutor(tx).execute_mapped_query("in_list(`Account.1`, '../../secrets')")
+    assert not result["success"] and "Invalid reference list name" in result["error"]
+
+
+def test_compact_dtypes_shrinks_memory_without_changing_metrics():
+    rules = [
+        {"rule_id": "R1", "title": "Wire above 100k", "severity": "HIGH", "sql_query": "",
+         "pandas_query": "`Payment Format` == 'Wire' and `Amount Paid` > 100000", "status": "READY"},
+        {"rule_id": "R2", "title": "Euro from BOA", "severity": "LOW", "sql_query": "",
+         "pandas_query": "`Payment Currency` in ['Euro'] and `From Bank` == 'BOA'", "status": "READY"},
+        {"rule_id": "R3", "title": "Formats after B", "severity": "LOW", "sql_query": "",
+         "pandas_query": "'B' < `Payment Format` <= 'Cheque' or `From Bank` >= 'W'", "status": "READY"},
+    ]
+    plain = PandasExecutor(pd.read_csv('data/ibm_aml_sample_1000.csv'), compact=False)
+    compact = PandasExecutor(pd.read_csv('data/ibm_aml_sample_1000.csv'))
+
+    assert compact.df["Payment Format"].dtype == "category"
+    assert compact.ingestion_report["bytes_after"] < compact.ingestion_report["bytes_before"] / 2
+    assert compact.run_all_rules_and_collect_metrics(rules) == plain.run_all_rules_and_collect_metrics(rules)
+
+
+def test_compacted_numeric_columns_evaluate_at_full_width():
+    raw = pd.DataFrame({"Amount": [100000, 200000, 5], "Flag": [0, 1, 1], "Rate": [1.0, 2.5, 0.5]})
+    executor = PandasExecutor(raw.copy())
+
+    assert executor.df["Flag"].dtype == "int8" and executor.df["Rate"].dtype == "float32"
+    for q in ["`Amount` * 100000 > 1000000", "`Amount` * 30000 < 0", "`Flag` + 200 > 100",
+              "`Rate` >= 1.00000001", "abs(-`Flag` * 200) > 150"]:
+        assert executor.execute_mapped_query(q)["violation_count"] == int(raw.eval(q).sum()), q
+
+
+def test_concurrent_rules_build_each_operator_once(monkeypatch):
+    import threading
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    import executor as executor_module
+
+    calls = []
+    evaluate = executor_module.evaluate_operator
+
+    def slow_evaluate(*args):
+        calls.append(args[1])
+        time.sleep(0.05)
+        return evaluate(*args)
+
+    monkeypatch.setattr(executor_module, "evaluate_operator", slow_evaluate)
+    executor = PandasExecutor(pd.read_csv('data/ibm_aml_sample_1000.csv'))
+    rule = {"rule_id": "V", "title": "Velocity", "severity": "LOW", "sql_query": "",
+            "pandas_query": "velocity_count(`Account`, `Timestamp`, '1d') > 1", "status": "READY"}
+    start = threading.Barrier(4)
+
+    def run(i):
+        start.wait()
+        return executor.collect_rule_metric(dict(rule, rule_id=f"V{i}"))
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        metrics = list(pool.map(run, range(4)))
+    assert calls == ["velocity_count"]
+    assert len({m["violation_count"] for m in metrics}) == 1
+    assert sorted(executor.rule_bitmaps) == ["V0", "V1", "V2", "V3"]
+
+
+def test_parsing_detects_formats_once_and_counts_failures():
+    tx = pd.DataFrame({
+        "Timestamp": ["2022/11/24 03:01", "2022/11/25 14:30"] * 5 + ["not a date", None],
+        "Amount": ["$1,234.56", "12"] * 5 + ["n/a", "$10,000.00"],
+    })
+    executor = PandasExecutor(tx)
+
+    assert executor.parse_report["Timestamp"] == {"kind": "datetime", "format": "%Y/%m/%d %H:%M", "failures": 1}
+    assert pd.api.types.is_datetime64_any_dtype(executor.df["Timestamp"])
+    assert list(executor.df["Amount"].fillna(-1)[-3:]) == [12.0, -1, 10000.0]
+    assert executor.df["Amount"][0] == 1234.56
+    assert executor.parse_report["Amount"]["failures"] == 1
+
+
+def test_compiled_queries_are_validated_and_cached():
+    from query_plan import get_plan
+
+    executor = PandasExecutor(pd.read_csv('data/ibm_aml_sample_1000.csv'))
+    for q in ["`Payment Currency` in ['Euro', 'US Dollar'] & ~(`From Bank` == 'BOA')",
+              "1000 < `Amount Paid` < 5000 or `From Bank`.str.startswith('B')",
+              "`Timestamp`.dt.hour < 6 and `Payment Format` not in ['Cash']",
+              "`Payment Format` == ['Cash', 'Wire']",
+              "['Cash', 'Wire'] != `Payment Format`",
+              "abs(`Amount Paid` - `Amount Received`) > 100",
+              "log10(`Amount Paid` + 1) >= 4 | floor(`Amount Received`) == 0"]:
+        assert executor.execute_mapped_query(q)["violation_count"] == int(executor.df.eval(q).sum())
+
+    assert get_plan("`Amount Paid`  >=   1000000") is get_plan("`Amount Paid` >= 1000000")
+    assert executor.execute_mapped_query("`Missing Col` > 1")["error"] == "Unknown column(s): Missing Col"
+    assert not executor.execute_mapped_query("__import__('os').system('ls')")["success"]
+    assert not executor.execute_mapped_query("`Amount Paid`.to_csv('out.csv')")["success"]
+
+
+def test_rule_bitmaps_and_account_rule_index():
+    import numpy as np
+    from bitmaps import RowBitmap
+
+    rng = np.random.default_rng(3)
+    a, b = rng.random(200_000) < 0.3, rng.random(200_000) < 0.001
+    bits_a, bits_b = RowBitmap.from_mask(a), RowBitmap.from_positions(np.flatnonzero(b)[::-1], len(b))
+    assert len(bits_a) == a.sum() and bits_a.nbytes < a.nbytes
+    assert (bits_a & bits_b).to_mask().tolist() == (a & b).tolist()
+    assert (bits_a | bits_b).to_mask().tolist() == (a | b).tolist()
+    assert (bits_a - bits_b).to_mask().tolist() == (a & ~b).tolist()
+
+    tx = pd.DataFrame({"Account": ["x", "y", "x", "z", "y", "x"], "Amount": [50, 500, 900, 20, 700, 5]})
+    executor = PandasExecutor(tx)
+    rules = [
+        {"rule_id": "big", "title": "Big", "severity": "HIGH", "sql_query": "", "pandas_query": "Amount > 100", "status": "READY"},
+        {"rule_id": "small", "title": "Small", "severity": "LOW", "sql_query": "", "pandas_query": "Amount < 60", "status": "READY"},
+    ]
+    executor.run_all_rules_and_collect_metrics(rules)
+    index = executor.account_rule_index()
+    assert index.intersection(["big", "small"]) == ["x"]
+    assert index.union(["big", "small"]) == ["x", "y", "z"]
+    offenders = index.multi_rule_offenders(min_rules=1)
+    assert offenders["account"].tolist() == ["x", "y", "z"]
+    assert offenders.iloc[0][["rules_tripped", "violations"]].tolist() == [2, 3]
+
+
+def test_fused_metrics_match_pandas_aggregations():
+    import numpy as np
+
+    rng = np.random.default_rng(11)
+    n = 5000
+    tx = pd.DataFrame({
+        "Account": rng.choice([f"A{i}" for i in range(300)] + [None], n),
+        "Amount": np.where(rng.random(n) < 0.05, np.nan, rng.integers(1, 10_000, n) / 100),
+        "Timestamp": pd.Timestamp("2022-01-01") + pd.to_timedelta(rng.integers(0, 10**6, n), unit="min"),
+    })
+    executor = PandasExecutor(tx.copy())
+    for query in ["Amount > 90", "Amount < 0.5", "Amount > 50 and Amount < 50.5"]:
+        rule = {"rule_id": query, "title": query, "severity": "LOW", "sql_query": "", "pandas_query": query, "status": "READY"}
+        metric = executor.collect_rule_metric(rule)
+
+        hits = tx[tx.eval(query)]
+        accounts = hits["Account"]
+        assert metric["violation_count"] == len(hits)
+        assert metric["unique_accounts"] == accounts.nunique()
+        assert metric["top_offenders"] == [f"{a} ({c} txns)" for a, c in accounts.value_counts().head(3).items()]
+        assert abs(metric["total_amount_exposure"] - hits["Amount"].fillna(0).sum()) < 1e-6
+        assert metric["date_range"].startswith(hits["Timestamp"].min().strftime('%Y-%m-%d %H:%M'))
+
+
+def test_chunked_windowed_operators_carry_history_across_chunks(tmp_path):
+    from chunked_executor import ChunkedExecutor
+
+    df = pd.read_csv('data/ibm_aml_sample_1000.csv')
+    ordered = df.iloc[pd.to_datetime(df['Timestamp']).argsort(kind="stable")]
+    ordered.to_csv(tmp_path / "ordered.csv", index=False)
+    windowed_rules = [
+        {"rule_id": f"Win {i}", "title": f"Windowed rule {i}", "severity": "HIGH", "status": "READY", "pandas_query": query}
+        for i, query in enumerate([
+            "velocity_sum(`Account`, `Timestamp`, `Amount Paid`, '7d') > 50000",
+            "structuring_count(`Account`, `Timestamp`, `Amount Paid`, threshold=10000, margin=0.5) >= 1",
+            "duplicate_count(`From Bank`, time=`Timestamp`, tolerance='1h') >= 2",
+        ])
+    ]
+    expected = json.loads(PandasExecutor(pd.read_csv(tmp_path / "ordered.csv")).run_all_rules_and_collect_metrics(windowed_rules))
+    actual = json.loads(ChunkedExecutor(str(tmp_path / "ordered.csv"), chunksize=100).run_all_rules_and_collect_metrics(windowed_rules))
+
+    assert all(exp["violation_count"] > 0 for exp in expected)
+    for exp, act in zip(expected, actual):
+        for key in ["status", "violation_count", "unique_accounts", "date_range", "top_offenders"]:
+            assert act[key] == exp[key], (exp["rule_id"], key)
+
+    # Out of time order, the windows would be cut short: reported as an error, not an undercount
+    unordered = json.loads(ChunkedExecutor('data/ibm_aml_sample_1000.csv', chunksize=100).run_all_rules_and_collect_metrics(windowed_rules))
+    assert len(unordered) == len(windowed_rules)
+    assert all(m["status"].startswith("ERROR") and "not in `Timestamp` order" in m["status"] for m in unordered)
@@ -0,0 +1,48 @@
+import pandas as pd
+
+from executor import PandasExecutor
+from generate_mock_data import generate_dataset
+
+
+def test_generator_is_seeded_and_matches_the_shipped_layout(tmp_path):
+    first = generate_dataset(5000, str(tmp_path / "a.csv"), seed=7, chunk_rows=1500)
+    second = generate_dataset(5000, str(tmp_path / "b.csv"), seed=7, chunk_rows=1500)
+
+    assert (tmp_path / "a.csv").read_bytes() == (tmp_path / "b.csv").read_bytes()
+    assert first["injected"] == second["injected"]
+
+    sample = pd.read_csv('data/ibm_aml_sample_1000.csv', nrows=5)
+    generated = pd.read_csv(tmp_path / "a.csv")
+    assert list(generated.columns) == list(sample.columns)
+    assert len(generated) == 5000
+    assert generated["Timestamp"].str.match(r"^\d{4}/\d{2}/\d{2} \d{2}:\d{2}$").all()
+
+
+def test_injected_patterns_are_caught_by_their_rules(tmp_path):
+    rates = {"structuring": 0.01, "velocity": 0.02, "sanctions": 0.005, "duplicate": 0.01}
+    summary = generate_dataset(20000, str(tmp_path / "tx.parquet"), seed=3, chunk_rows=8000, rates=rates)
+    labels = pd.read_json(summary["labels_path"], lines=True)
+    assert summary["labels_path"].endswith(".labels.jsonl")
+    executor = PandasExecutor(pd.read_parquet(summary["path"]))
+
+    assert set(labels["pattern"]) == set(rates)
+    assert executor.df["Is Laundering"].sum() == len(labels)
+
+    queries = {
+        "structuring": "structuring_count(`Account`, `Timestamp`, `Amount Paid`) >= 4",
+        "velocity": "velocity_count(`Account`, `Timestamp`, '1h') >= 12",
+        "sanctions": "in_list(`Account.1`, 'sanctions')",
+        "duplicate": "duplicate_count(`Account`, `Account.1`, amount=`Amount Paid`, time=`Timestamp`, tolerance='30min') >= 2",
+    }
+    for pattern, query in queries.items():
+        flagged = pd.Series(False, index=executor.df.index)
+        flagged.iloc[executor.execute_mapped_query(query)["violating_positions"]] = True
+        rows = labels[labels["pattern"] == pattern]
+        if pattern in ("structuring", "velocity"):
+            # Trailing windows flag the group from its last row on
+            assert flagged.iloc[rows["row"]].groupby(rows["group"].to_numpy()).any().all(), pattern
+        else:
+            assert flagged.iloc[rows["row"]].all(), pattern
+    # Background traffic never pays a sanctioned account, so that rule is exact
+    sanctioned = executor.execute_mapped_query(queries["sanctions"])["violating_positions"]
+    assert sorted(sanctioned) == sorted(labels.loc[labels["pattern"] == "sanctions", "row"])
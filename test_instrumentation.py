@@ -0,0 +1,89 @@
+import json
+
+import pandas as pd
+
+import instrumentation
+from executor import PandasExecutor
+
+rules = [
+    {"rule_id": "Rule 3.3", "title": "Cash Threshold", "severity": "HIGH", "pandas_query": "`Amount Paid` >= 10000 and `Payment Format` == 'Cash'", "status": "READY"},
+    {"rule_id": "Rule 8.1", "title": "Unmappable", "severity": "LOW", "pandas_query": "", "status": "SKIPPED"},
+]
+
+
+def test_traced_run_exports_stages_rules_and_prometheus(tmp_path):
+    tracer = instrumentation.start_trace("test_run")
+    try:
+        executor = PandasExecutor(pd.read_csv('data/ibm_aml_sample_1000.csv'))
+        metrics = json.loads(executor.run_all_rules_and_collect_metrics(rules))
+    finally:
+        instrumentation.stop_trace()
+    paths = tracer.export(str(tmp_path))
+
+    with open(paths["jsonl"]) as f:
+        records = [json.loads(line) for line in f]
+    names = {r["name"] for r in records}
+    assert {"dtype_fix", "execution", "rule_eval", "predicate", "rule", "json"} <= names
+
+    by_id = {r["span_id"]: r for r in records}
+    rule = next(r for r in records if r["name"] == "rule" and r["rule_id"] == "Rule 3.3")
+    assert rule["violations"] == metrics[0]["violation_count"]
+    assert rule["rows_scanned"] == 1000
+    assert by_id[rule["parent_id"]]["name"] == "execution"
+    assert all(r["duration_s"] >= 0 and r["peak_rss_mb"] > 0 for r in records)
+
+    prom = open(paths["prometheus"]).read()
+    assert 'compliance_stage_seconds{stage="execution"}' in prom
+    assert 'compliance_rule_violations{rule_id="Rule 3.3"}' in prom
+
+
+def test_spans_are_noops_without_active_trace():
+    assert instrumentation.current_tracer() is None
+    with instrumentation.span("anything", rows=1) as s:
+        s.set(more=2)
+    instrumentation.record("llm", 0.1, agent="agent_1")
+
+
+def test_concurrent_runs_keep_their_own_trace():
+    import contextvars
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+
+    both_started = threading.Barrier(2)
+    results = {}
+
+    def run(name):
+        tracer = instrumentation.start_trace(name)
+        both_started.wait()
+        with instrumentation.span("stage", run=name):
+            with ThreadPoolExecutor(max_workers=1) as pool:
+                pool.submit(contextvars.copy_context().run, instrumentation.record, "llm", 0.1, run=name).result()
+        both_started.wait()
+        assert instrumentation.stop_trace() is tracer
+        results[name] = tracer.records()
+
+    threads = [threading.Thread(target=run, args=(name,)) for name in ("a", "b")]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    for name in ("a", "b"):
+        assert sorted(r["name"] for r in results[name]) == ["llm", "stage"]
+        assert {r["run"] for r in results[name]} == {name}
+    assert instrumentation.current_tracer() is None
+
+
+def test_reference_list_loads_are_traced_not_printed(tmp_path, capsys):
+    from reference_lists import load_reference_list
+
+    (tmp_path / "watchlist.txt").write_text("1001\n1002\n")
+    tracer = instrumentation.start_trace("test_run")
+    try:
+        load_reference_list("watchlist", str(tmp_path))
+    finally:
+        instrumentation.stop_trace()
+
+    loads = [r for r in tracer.records() if r["name"] == "reference_list"]
+    assert [(r["list"], r["entries"]) for r in loads] == [("watchlist", 2)]
+    assert capsys.readouterr().out == ""
@@ -0,0 +1,185 @@
+import json
+import os
+import types
+
+os.environ.setdefault("GOOGLE_API_KEY", "test-key")
+
+import llm_pipeline
+from llm_cache import LLMResponseCache
+
+
+class FakeModels:
+    """Stands in for client.models, returning a fixed Agent 1 response in two chunks."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def generate_content_stream(self, model, contents, config):
+        self.calls += 1
+        text = '[{"rule_id": "Rule 1", "title": "High Value", "severity": "HIGH", "threshold": "$50,000", ' \
+               '"logic_type": "threshold", "sql_query": "SELECT 1", "pandas_query": "amount > 50000", "explanation": "x"}]'
+        for part in (text[:40], text[40:]):
+            yield types.SimpleNamespace(text=part)
+
+
+def test_agent_1_replays_cached_stream(tmp_path, monkeypatch):
+    fake = FakeModels()
+    monkeypatch.setattr(llm_pipeline, "client", types.SimpleNamespace(models=fake))
+    pipeline = llm_pipeline.LLMPipeline(cache=LLMResponseCache(str(tmp_path)))
+
+    first = list(pipeline.agent_1_extract_generic_rules("policy"))
+    second = list(pipeline.agent_1_extract_generic_rules("policy"))
+
+    assert fake.calls == 1
+    assert first[:-1] == second[:-1]
+    assert second[-1][0] == "DONE" and second[-1][1][0].rule_id == "Rule 1"
+    assert pipeline.cache.stats()["hits"] == 1
+
+    # The rule is emitted as soon as its closing brace streams in, before the final DONE
+    events = [e for e in first if isinstance(e, tuple)]
+    assert [e[0] for e in events] == ["RULE", "DONE"]
+    assert events[0][1].rule_id == "Rule 1"
+
+
+def test_incremental_parser_handles_split_chunks():
+    from json_stream import IncrementalJSONArrayParser
+
+    items = [{"rule_id": f"Rule {i}", "pandas_query": "`a` == '}]'"} for i in range(3)]
+    text = "```json\n" + json.dumps({"mapped_rules": items}) + "\n```"
+    parser = IncrementalJSONArrayParser()
+    parsed = []
+    for i in range(0, len(text), 7):
+        parsed.extend(parser.feed(text[i:i + 7]))
+    assert parsed == items
+
+
+class FakeAgent2Models:
+    """Returns a READY mapping for every rule id found in the prompt."""
+
+    def __init__(self):
+        self.prompts = []
+
+    def generate_content(self, model, contents, config):
+        self.prompts.append(contents)
+        mapped = [{"rule_id": rid, "title": "t", "severity": "HIGH", "sql_query": "SELECT * FROM transactions",
+                   "pandas_query": "`Amount Paid` > 1", "columns_remapped": ["amount -> Amount Paid"],
+                   "values_remapped": [], "status": "READY"}
+                  for rid in ("Rule 1", "Rule 2") if f'"rule_id": "{rid}"' in contents]
+        return types.SimpleNamespace(text=json.dumps({"mapped_rules": mapped}))
+
+
+def test_agent_2_only_maps_rules_missing_from_store(tmp_path, monkeypatch):
+    from mapping_store import MappingStore
+
+    fake = FakeAgent2Models()
+    monkeypatch.setattr(llm_pipeline, "client", types.SimpleNamespace(models=fake))
+    pipeline = llm_pipeline.LLMPipeline(cache=LLMResponseCache(str(tmp_path / "llm")),
+                                        mapping_store=MappingStore(str(tmp_path / "maps")))
+
+    def rule(rule_id):
+        return llm_pipeline.Agent1Rule(rule_id=rule_id, title="t", severity="HIGH", threshold="1", logic_type="threshold",
+                                       sql_query="SELECT 1", pandas_query="amount > 1", explanation="x")
+
+    columns = ["Amount Paid"]
+    status, first = pipeline.agent_2_map_all_rules([rule("Rule 1")], columns, "{}")
+    status, second = pipeline.agent_2_map_all_rules([rule("Rule 1"), rule("Rule 2")], columns, "{}")
+
+    assert status == "DONE"
+    assert [m.rule_id for m in second.mapped_rules] == ["Rule 1", "Rule 2"]
+    assert len(fake.prompts) == 2
+    assert '"rule_id": "Rule 1"' not in fake.prompts[1]
+
+    # Same layout, different values in the mapped column: the stored mapping is not trusted
+    pipeline.agent_2_map_all_rules([rule("Rule 1")], columns, '{"Amount Paid": [5, 7]}')
+    pipeline.agent_2_map_all_rules([rule("Rule 1")], columns, '{"Amount Paid": [7, 5]}')
+    assert len(fake.prompts) == 3
+    assert '"rule_id": "Rule 1"' in fake.prompts[2]
+
+
+class FakeFullPipelineModels(FakeAgent2Models):
+    """Streams two Agent 1 rules, then maps whichever rules each Agent 2 prompt contains."""
+
+    def generate_content_stream(self, model, contents, config):
+        rules = [{"rule_id": f"Rule {i}", "title": "t", "severity": "HIGH", "threshold": "1", "logic_type": "threshold",
+                  "sql_query": "SELECT 1", "pandas_query": "amount > 1", "explanation": "x"} for i in (1, 2)]
+        text = json.dumps(rules)
+        for i in range(0, len(text), 25):
+            yield types.SimpleNamespace(text=text[i:i + 25])
+
+
+def test_orchestrator_maps_and_executes_streamed_rules(tmp_path, monkeypatch):
+    import pandas as pd
+    from executor import PandasExecutor
+    from mapping_store import MappingStore
+    from orchestrator import PipelineOrchestrator
+
+    monkeypatch.setattr(llm_pipeline, "client", types.SimpleNamespace(models=FakeFullPipelineModels()))
+    pipeline = llm_pipeline.LLMPipeline(cache=LLMResponseCache(str(tmp_path / "llm")),
+                                        mapping_store=MappingStore(str(tmp_path / "maps")))
+    executor = PandasExecutor(pd.read_csv('data/ibm_aml_sample_1000.csv'))
+
+    events = list(PipelineOrchestrator(pipeline, executor, map_batch_size=1).run("policy", list(executor.df.columns), "{}"))
+
+    kinds = [e for e, _ in events if e != "TEXT"]
+    assert kinds.count("EXECUTED") == 2 and kinds[-1] == "DONE"
+    done = events[-1][1]
+    assert [m["rule_id"] for m in done["mapped_rules"]] == ["Rule 1", "Rule 2"]
+    assert json.loads(done["metrics_json"])[0]["violation_count"] == len(executor.df)
+
+
+def test_orchestrator_reports_failed_mapping_batches_and_stops_without_waiting(tmp_path, monkeypatch):
+    import time
+    import pandas as pd
+    from executor import PandasExecutor
+    from mapping_store import MappingStore
+    from orchestrator import PipelineOrchestrator
+
+    monkeypatch.setattr(llm_pipeline, "client", types.SimpleNamespace(models=FakeFullPipelineModels()))
+    pipeline = llm_pipeline.LLMPipeline(cache=LLMResponseCache(str(tmp_path / "llm")),
+                                        mapping_store=MappingStore(str(tmp_path / "maps")))
+    executor = PandasExecutor(pd.read_csv('data/ibm_aml_sample_1000.csv'))
+    map_rules = pipeline.agent_2_map_all_rules
+
+    def flaky_mapping(rules, *args):
+        if any(r.rule_id == "Rule 2" for r in rules):
+            raise RuntimeError("connection reset")
+        return map_rules(rules, *args)
+
+    monkeypatch.setattr(pipeline, "agent_2_map_all_rules", flaky_mapping)
+    events = list(PipelineOrchestrator(pipeline, executor, map_batch_size=1).run("policy", list(executor.df.columns), "{}"))
+
+    done = events[-1][1]
+    assert [m["rule_id"] for m in done["mapped_rules"]] == ["Rule 1"]
+    assert done["errors"] == ["Agent 2 mapping failed for Rule 2: connection reset"]
+    assert ("ERROR", done["errors"][0]) in events
+
+    def slow_mapping(rules, *args):
+        time.sleep(2)
+        return map_rules(rules, *args)
+
+    monkeypatch.setattr(pipeline, "agent_2_map_all_rules", slow_mapping)
+    run = PipelineOrchestrator(pipeline, executor, map_batch_size=1).run("policy", list(executor.df.columns), "{}")
+    assert next(e for e, _ in run if e == "EXTRACTED")
+    started = time.perf_counter()
+    run.close()
+    assert time.perf_counter() - started < 1
+
+
+def test_orchestrator_executes_each_mapped_batch_in_one_shared_scan(tmp_path, monkeypatch):
+    import pandas as pd
+    from executor import PandasExecutor
+    from mapping_store import MappingStore
+    from orchestrator import PipelineOrchestrator
+
+    monkeypatch.setattr(llm_pipeline, "client", types.SimpleNamespace(models=FakeFullPipelineModels()))
+    pipeline = llm_pipeline.LLMPipeline(cache=LLMResponseCache(str(tmp_path / "llm")),
+                                        mapping_store=MappingStore(str(tmp_path / "maps")))
+    executor = PandasExecutor(pd.read_csv('data/ibm_aml_sample_1000.csv'))
+    scans = []
+    execute = executor.execute_mapped_queries
+    monkeypatch.setattr(executor, "execute_mapped_queries", lambda queries: scans.append(list(queries)) or execute(queries))
+
+    events = list(PipelineOrchestrator(pipeline, executor, map_batch_size=2).run("policy", list(executor.df.columns), "{}"))
+
+    assert [e for e, _ in events].count("EXECUTED") == 2
+    assert scans == [["`Amount Paid` > 1", "`Amount Paid` > 1"]]
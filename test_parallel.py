@@ -0,0 +1,49 @@
+import pandas as pd
+
+from executor import PandasExecutor
+from parallel import ParallelExecutor
+
+rules = [
+    {"rule_id": "R1", "title": "Large payment", "severity": "HIGH", "sql_query": "",
+     "pandas_query": "`Amount Paid` >= 100000", "status": "READY"},
+    {"rule_id": "R2", "title": "Cash in foreign currency", "severity": "MEDIUM", "sql_query": "",
+     "pandas_query": "`Payment Format` == 'Cash' & `Payment Currency` != 'US Dollar'", "status": "READY"},
+    {"rule_id": "R3", "title": "Bank velocity", "severity": "MEDIUM", "sql_query": "",
+     "pandas_query": "velocity_count(`From Bank`, `Timestamp`, '7d') > 2 & `To Bank`.str.startswith('A')",
+     "status": "READY"},
+    {"rule_id": "R4", "title": "Unsupported comparison", "severity": "LOW", "sql_query": "",
+     "pandas_query": "`Payment Format` > 5", "status": "READY"},
+]
+
+
+def test_parallel_metrics_are_identical_to_serial():
+    df = pd.read_csv('data/ibm_aml_sample_1000.csv')
+    expected = PandasExecutor(df.copy()).run_all_rules_and_collect_metrics(rules)
+
+    # Tiny shards so the 1000-row sample is really split across workers
+    with ParallelExecutor(df.copy(), n_workers=3, min_shard_rows=100) as executor:
+        assert len(executor._shards()) == 3
+        assert all(lo % 8 == 0 for lo, _ in executor._shards())
+        actual = executor.run_all_rules_and_collect_metrics(rules)
+        assert executor._shared
+
+    assert actual == expected
+    assert not executor._shared
+
+
+def test_concurrent_callers_share_one_segment_per_column():
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+
+    df = pd.read_csv('data/ibm_aml_sample_1000.csv')
+    with ParallelExecutor(df, n_workers=2, min_shard_rows=100) as executor:
+        start = threading.Barrier(8)
+
+        def share(_):
+            start.wait()
+            return executor._share("Amount Paid", executor.df["Amount Paid"])
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            specs = list(pool.map(share, range(8)))
+        assert all(spec == specs[0] for spec in specs)
+        assert list(executor._shared) == ["Amount Paid"]
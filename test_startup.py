@@ -0,0 +1,49 @@
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Cold-start budgets in seconds, well above what a warm CI machine needs (~0.4s and ~1.5s),
+# so they catch an eager heavy import rather than machine noise
+IMPORT_BUDGET_SECONDS = 2.0
+FIRST_PAINT_BUDGET_SECONDS = 8.0
+
+HEAVY_MODULES = ["google.genai", "PyPDF2", "fpdf", "duckdb"]
+
+
+def _cold(code: str) -> dict:
+    """Runs `code` in a fresh interpreter (no API key) and returns its elapsed time and the heavy modules it loaded."""
+    script = (
+        "import sys, time, json\n"
+        "started = time.perf_counter()\n"
+        f"{code}\n"
+        "print(json.dumps({'seconds': time.perf_counter() - started,"
+        f" 'loaded': [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))\n"
+    )
+    env = {k: v for k, v in os.environ.items() if k != "GOOGLE_API_KEY"}
+    out = subprocess.run([sys.executable, "-c", script], cwd=ROOT, env=env, capture_output=True, text=True, timeout=120)
+    assert out.returncode == 0, out.stderr
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def test_executor_paths_import_fast_without_llm_sdk():
+    result = _cold("import executor, chunked_executor, dataset_cache, llm_pipeline, utils")
+    assert result["loaded"] == []
+    assert result["seconds"] < IMPORT_BUDGET_SECONDS
+
+
+def test_first_paint_is_fast_and_lazy(tmp_path):
+    result = _cold(
+        # Load copies of data/ CSVs, so their Arrow caches are written under tmp_path
+        "import os, shutil, dataset_cache, dataset_registry\n"
+        "dataset_registry._registry = dataset_registry.DatasetRegistry(loader=lambda path: dataset_cache.load_dataset(\n"
+        f"    shutil.copy(path, os.path.join({str(tmp_path)!r}, os.path.basename(path)))))\n"
+        "from streamlit.testing.v1 import AppTest\n"
+        "app = AppTest.from_file('app.py', default_timeout=60).run()\n"
+        "assert not app.exception, app.exception\n"
+        "assert app.sidebar.success, 'dataset was not loaded'"
+    )
+    assert result["loaded"] == []
+    assert result["seconds"] < FIRST_PAINT_BUDGET_SECONDS
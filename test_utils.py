@@ -0,0 +1,42 @@
+import io
+
+import PyPDF2
+from fpdf import FPDF
+
+import utils
+
+
+def _pdf(pages: int) -> io.BytesIO:
+    pdf = FPDF()
+    pdf.set_font("Helvetica", size=12)
+    for i in range(pages):
+        pdf.add_page()
+        pdf.multi_cell(0, 8, f"Rule {i}.1: report cash deposits over {1000 + i} USD.")
+    upload = io.BytesIO(bytes(pdf.output()))
+    upload.name = "policy.pdf"
+    return upload
+
+
+def test_parallel_extraction_matches_serial_and_is_cached(tmp_path, monkeypatch):
+    upload = _pdf(40)
+    serial = utils.extract_text_from_file(upload, workers=1, cache_dir=None)
+    assert serial.count("\n") == 40 and "Rule 39.1" in serial
+
+    pages = list(utils.iter_pages(upload, workers=2, cache_dir=str(tmp_path)))
+    assert [i for i, _ in pages] == list(range(40))
+    assert "".join(text + "\n" for _, text in pages) == serial
+
+    # A second extraction of the same content never parses the PDF
+    monkeypatch.setattr(PyPDF2, "PdfReader", None)
+    copy = io.BytesIO(upload.getvalue())
+    copy.name = "renamed.pdf"
+    assert utils.extract_text_from_file(copy, cache_dir=str(tmp_path)) == serial
+
+
+def test_iter_pages_streams_before_the_document_is_finished(tmp_path):
+    upload = _pdf(5)
+    pages = utils.iter_pages(upload, cache_dir=str(tmp_path))
+    first = next(pages)
+    assert first[0] == 0 and "Rule 0.1" in first[1]
+    pages.close()
+    assert sorted(p.name for p in next(tmp_path.iterdir()).iterdir()) == ["0.txt", "pages"]
@@ -1,18 +1,156 @@
-import PyPDF2
+import hashlib
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
 
-def extract_text_from_file(uploaded_file) -> str:
+# Extracted page text, by document content hash: <dir>/<sha256>/<page>.txt
+PAGE_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "pdf_pages")
+
+# Bump when the extraction itself changes so stale page text is not reused
+EXTRACTION_VERSION = 1
+
+# Documents with fewer pages than this are extracted in-process (worker start-up would dominate)
+MIN_PARALLEL_PAGES = 32
+# Pages per worker task: each task re-parses the document's cross-reference table once
+PAGES_PER_TASK = 16
+
+# Same reasoning as parallel.py: "spawn" is safe to start from Streamlit's threads
+_START_METHOD = "spawn"
+
+
+def _document_key(data: bytes) -> str:
+    import PyPDF2
+    digest = hashlib.sha256(data)
+    digest.update(f"|v{EXTRACTION_VERSION}|PyPDF2-{PyPDF2.__version__}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _extract_pages(data: bytes, start: int, stop: int) -> list:
+    """Worker entry point: [(page index, text)] for pages [start, stop) of the PDF in `data`."""
+    import PyPDF2
+    reader = PyPDF2.PdfReader(io.BytesIO(data))
+    return [(i, reader.pages[i].extract_text() or "") for i in range(start, stop)]
+
+
+class _PageCache:
+    """Per-page text files for one document, written atomically so interrupted runs leave no partial pages."""
+
+    def __init__(self, cache_dir: str, key: str):
+        self.folder = os.path.join(cache_dir, key) if cache_dir else None
+
+    def page_count(self):
+        try:
+            with open(os.path.join(self.folder, "pages")) as f:
+                return int(f.read())
+        except (OSError, ValueError, TypeError):
+            return None
+
+    def get(self, index: int):
+        try:
+            with open(os.path.join(self.folder, f"{index}.txt"), encoding="utf-8") as f:
+                return f.read()
+        except (OSError, TypeError):
+            return None
+
+    def _write(self, name: str, text: str):
+        if self.folder is None:
+            return
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            tmp = os.path.join(self.folder, f".{name}.{os.getpid()}.tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp, os.path.join(self.folder, name))
+        except OSError as e:
+            print(f"[Warning] Failed to cache extracted page text: {e}")
+
+    def put(self, index: int, text: str):
+        self._write(f"{index}.txt", text)
+
+    def set_page_count(self, count: int):
+        self._write("pages", str(count))
+
+
+def _iter_pdf_pages(data: bytes, workers: int, cache_dir: str):
+    cache = _PageCache(cache_dir, _document_key(data))
+    count = cache.page_count()
+    if count is None:
+        import PyPDF2
+        count = len(PyPDF2.PdfReader(io.BytesIO(data)).pages)
+        cache.set_page_count(count)
+
+    cached = [cache.get(i) for i in range(count)]
+    missing = [i for i in range(count) if cached[i] is None]
+    workers = workers or os.cpu_count() or 1
+    if len(missing) < MIN_PARALLEL_PAGES or workers < 2:
+        yield from _extract_serially(data, cached, cache, 0)
+        return
+
+    # Contiguous runs of missing pages, split into tasks; pages are yielded in order as soon as
+    # every earlier page is available
+    tasks = []
+    for i in missing:
+        if tasks and tasks[-1][1] == i and tasks[-1][1] - tasks[-1][0] < PAGES_PER_TASK:
+            tasks[-1][1] = i + 1
+        else:
+            tasks.append([i, i + 1])
+
+    position = 0
+    pool = None
+    try:
+        pool = ProcessPoolExecutor(max_workers=min(workers, len(tasks)),
+                                   mp_context=multiprocessing.get_context(_START_METHOD))
+        futures = {start: pool.submit(_extract_pages, data, start, stop) for start, stop in tasks}
+        for i in range(count):
+            if cached[i] is None:
+                for page, text in futures.pop(i).result():
+                    cached[page] = text
+                    cache.put(page, text)
+            position = i + 1
+            yield i, cached[i]
+    except Exception as e:
+        print(f"[Warning] Parallel PDF extraction failed ({e}); extracting serially.")
+        yield from _extract_serially(data, cached, cache, position)
+    finally:
+        # Also reached when the consumer stops early: queued pages are abandoned, not waited for
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _extract_serially(data: bytes, cached: list, cache: _PageCache, first: int):
+    reader = None
+    for i in range(first, len(cached)):
+        if cached[i] is None:
+            if reader is None:
+                import PyPDF2
+                reader = PyPDF2.PdfReader(io.BytesIO(data))
+            cached[i] = reader.pages[i].extract_text() or ""
+            cache.put(i, cached[i])
+        yield i, cached[i]
+
+
+def iter_pages(uploaded_file, workers: int = None, cache_dir: str = PAGE_CACHE_DIR):
+    """
+    Yields (page index, text) for an uploaded PDF or TXT file, in page order, as each page becomes
+    available. PDF pages come from a content-hash keyed cache when this document was seen before;
+    the others are extracted, across `workers` processes for large documents, and cached.
+    A TXT file is yielded as a single page. Pass cache_dir=None to skip the cache.
+    """
+    if uploaded_file.name.endswith('.pdf'):
+        yield from _iter_pdf_pages(uploaded_file.getvalue(), workers, cache_dir)
+    else:
+        yield 0, uploaded_file.getvalue().decode("utf-8")
+
+
+def extract_text_from_file(uploaded_file, workers: int = None, cache_dir: str = PAGE_CACHE_DIR) -> str:
     """Safely extracts text from uploaded PDF or TXT files."""
     if uploaded_file.name.endswith('.pdf'):
-        pdf_reader = PyPDF2.PdfReader(uploaded_file)
-        text = ""
-        for i, page in enumerate(pdf_reader.pages):
-            extracted = page.extract_text()
-            if extracted:
-                text += extracted + "\n"
-                
+        text = "".join(extracted + "\n" for _, extracted in iter_pages(uploaded_file, workers, cache_dir) if extracted)
+
         if not text.strip():
             raise ValueError(f"No extractable text found in '{uploaded_file.name}'. Is it a scanned document? Standard text-based PDFs are required.")
-            
+
         return text
     else:
         return uploaded_file.getvalue().decode("utf-8")